@@ -0,0 +1,93 @@
+"""
+Cost of set_online_users_video_status as rooms grow.
+
+Run against the configured database, everything is rolled back afterwards:
+    FLASK_ENV=test python -m benchmarks.bench_online_users_video_status
+"""
+import time
+
+from sqlalchemy import event
+
+from main import db
+from main.models.room import Room
+from main.models.room_participant import RoomParticipant
+from main.models.user import User
+from main.libs import video_engine
+from main.enums import ParticipantStatus, RoomStatus, VideoStatus
+from database import create_all
+
+ROOM_SIZES = [10, 100, 1000, 5000]
+RUNS = 5
+
+
+def _load_and_loop(room_id, status):
+    """Previous implementation, kept for comparison"""
+    online_users = RoomParticipant.query \
+        .filter(RoomParticipant.room_id == room_id) \
+        .filter(RoomParticipant.status == ParticipantStatus.IN) \
+        .all()
+
+    for user in online_users:
+        user.video_status = status
+
+    db.session.commit()
+
+
+def _setup_room(size):
+    users = [User(name='Bench User', email='bench_{}_{}@test.com'.format(size, i), password_hash='', status='active')
+             for i in range(size)]
+    db.session.add_all(users)
+    db.session.flush()
+
+    room = Room(name='Bench Room', creator_id=users[0].id, fingerprint='bench{}'.format(size), status=RoomStatus.ACTIVE)
+    db.session.add(room)
+    db.session.flush()
+
+    db.session.add_all([RoomParticipant(user_id=user.id, room_id=room.id, status=ParticipantStatus.IN)
+                        for user in users])
+    db.session.commit()
+    return room.id
+
+
+def _measure(function, room_id):
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    start = time.perf_counter()
+    for i in range(RUNS):
+        status = VideoStatus.PLAYING if i % 2 else VideoStatus.PAUSING
+        function(room_id, status)
+        # Start every run with an empty session, as a new request would
+        db.session.expunge_all()
+    elapsed = (time.perf_counter() - start) / RUNS
+    event.remove(db.engine, 'before_cursor_execute', count)
+
+    return elapsed * 1000, len(statements) / RUNS
+
+
+def main():
+    create_all()
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    db.session = db.create_scoped_session(options=dict(bind=connection, binds={}))
+
+    print('{:>12} {:>16} {:>12} {:>16} {:>12}'.format('participants', 'load-loop ms', 'statements',
+                                                      'bulk ms', 'statements'))
+    try:
+        for size in ROOM_SIZES:
+            room_id = _setup_room(size)
+            loop_ms, loop_statements = _measure(_load_and_loop, room_id)
+            bulk_ms, bulk_statements = _measure(video_engine.set_online_users_video_status, room_id)
+            print('{:>12} {:>16.2f} {:>12.0f} {:>16.2f} {:>12.0f}'.format(size, loop_ms, loop_statements,
+                                                                          bulk_ms, bulk_statements))
+    finally:
+        db.session.close()
+        transaction.rollback()
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
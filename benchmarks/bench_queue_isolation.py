@@ -0,0 +1,91 @@
+"""
+Latency of playback events while the outbox is flooded with chat events.
+
+Starts in-process workers for the realtime queues on the configured broker and database, with a backend
+simulating Pusher calls. Events are committed through the outbox, as the endpoints do:
+    python -m benchmarks.bench_queue_isolation
+
+Compares every event sent by one relay, as before playback events were relayed on their own.
+"""
+import time
+
+from celery.contrib.testing import tasks  # noqa, registers the ping task needed by test workers
+from celery.contrib.testing.worker import start_worker
+
+from main import db, redis
+from main.cfg import config
+from main.libs import outbox, realtime
+from main.libs.tasks import celery_app
+from main.models.outbox_event import OutboxEvent
+from main.enums import PusherEvent, TaskQueue
+from database import create_all
+
+ROUNDS = 20
+# Chat transactions committed before each playback event, one room each
+MESSAGES_PER_ROUND = 50
+# Duration of a simulated Pusher call
+CALL_TIME = 0.005
+
+
+class SlowBackend(object):
+    """Records when playback events are sent"""
+
+    def __init__(self):
+        self.latencies = []
+
+    def trigger_batch(self, channel_name, events):
+        time.sleep(CALL_TIME)
+        now = time.time()
+        self.latencies.extend(now - event['data']['sent_at'] for event in events
+                              if event['name'] == PusherEvent.PROCEED)
+
+
+def _commit(room_id, event, data):
+    outbox.add(room_id, event, data)
+    db.session.commit()
+
+
+def _run(backend, isolated):
+    critical_events = outbox.CRITICAL_EVENTS
+    if not isolated:
+        outbox.CRITICAL_EVENTS = set()
+
+    workers = [start_worker(celery_app, queues=[queue], perform_ping_check=False)
+               for queue in (TaskQueue.REALTIME_CRITICAL, TaskQueue.REALTIME_BULK)]
+    for worker in workers:
+        worker.__enter__()
+    try:
+        for _ in range(ROUNDS):
+            for i in range(MESSAGES_PER_ROUND):
+                _commit(i + 1, PusherEvent.NEW_MESSAGE, {'index': i})
+            _commit(0, PusherEvent.PROCEED, {'sent_at': time.time()})
+
+        while len(backend.latencies) < ROUNDS or OutboxEvent.query.count():
+            db.session.remove()
+            time.sleep(0.01)
+    finally:
+        for worker in reversed(workers):
+            worker.__exit__(None, None, None)
+        outbox.CRITICAL_EVENTS = critical_events
+
+
+def main():
+    create_all()
+    config.REALTIME_BACKEND = 'slow'
+    # Test workers do not run tasks with a countdown
+    config.PUSHER_BATCH_WINDOW = 0
+    # Relays of an interrupted run
+    redis.delete(outbox._relay_key(True), outbox._relay_key(False))
+    print('{:>10} {:>12} {:>12}'.format('relay', 'p50 (ms)', 'max (ms)'))
+    for isolated in (False, True):
+        backend = SlowBackend()
+        realtime._backends['slow'] = backend
+        _run(backend, isolated)
+
+        latencies = sorted(backend.latencies)
+        print('{:>10} {:>12.1f} {:>12.1f}'.format('split' if isolated else 'shared',
+                                                  latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
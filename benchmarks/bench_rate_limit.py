@@ -0,0 +1,82 @@
+"""
+Overhead of the rate limiter per request, and how many requests get through when they race.
+The local tier is measured for a single process.
+
+Run against the configured Redis:
+    FLASK_ENV=test python -m benchmarks.bench_rate_limit
+"""
+import threading
+import time
+
+from main import redis
+from main.cfg import config
+from main.libs import rate_limit
+
+CALLS = 2000
+THREADS = 8
+RATE = 100
+
+
+def _fixed_window_hit(name, rate, window):
+    """Previous implementation, kept for comparison: check then increase in separate round trips"""
+    key = '{}-bench-fixed:{}'.format(config.REDIS_PREFIX, name)
+    current_value = redis.get(key)
+    if current_value is not None and int(current_value) > rate:
+        return False, 0
+
+    current_value = redis.get(key)
+    if current_value is None:
+        redis.set(key, 1, window)
+    else:
+        redis.incr(key)
+    return True, 0
+
+
+def _cleanup():
+    keys = redis.keys('{}-bench-fixed:*'.format(config.REDIS_PREFIX)) + \
+        redis.keys('{}-rate-limit:bench*'.format(config.REDIS_PREFIX))
+    if keys:
+        redis.delete(*keys)
+
+
+def _overhead(hit):
+    start = time.perf_counter()
+    for i in range(CALLS):
+        hit('bench-{}'.format(i % 100), CALLS, 60)
+    return (time.perf_counter() - start) / CALLS * 1000 * 1000
+
+
+def _allowed_under_race(hit):
+    allowed = []
+
+    def run():
+        for _ in range(RATE):
+            allowed.append(hit('bench-race', RATE, 60)[0])
+
+    threads = [threading.Thread(target=run) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return allowed.count(True)
+
+
+def main():
+    print('{:>16} {:>16} {:>24}'.format('limiter', 'us per request', 'allowed of {} (rate {})'.format(
+        RATE * THREADS, RATE)))
+    try:
+        local_limiter = rate_limit.LocalLimiter(config.RATE_LIMIT_LOCAL_SIZE, config.RATE_LIMIT_LOCAL_TTL,
+                                                config.RATE_LIMIT_LOCAL_BATCH, config.RATE_LIMIT_LOCAL_SYNC_INTERVAL)
+        for name, hit in [('fixed window', _fixed_window_hit), ('sliding window', rate_limit.hit),
+                          ('local tier', local_limiter.hit)]:
+            _cleanup()
+            overhead = _overhead(hit)
+            allowed = _allowed_under_race(hit)
+            print('{:>16} {:>16.1f} {:>24}'.format(name, overhead, allowed))
+    finally:
+        _cleanup()
+
+
+if __name__ == '__main__':
+    main()
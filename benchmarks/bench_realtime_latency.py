@@ -0,0 +1,84 @@
+"""
+End-to-end latency of realtime events through Redis pub/sub and the realtime gateway.
+
+Run against the configured Redis, the gateway is started in process:
+    FLASK_ENV=test python -m benchmarks.bench_realtime_latency
+"""
+import json
+import socket
+import threading
+import time
+
+from main.libs import realtime
+from main.libs.gateway import Gateway
+
+SUBSCRIBERS = [1, 10, 100]
+EVENTS = 200
+CHANNEL_NAME = 'presence-room-0-bench'
+
+
+def _subscribe(port, user_id):
+    socket_id = '{}.{}'.format(user_id, int(time.time()))
+    query = 'socket_id={}&user_id={}&auth={}'.format(socket_id, user_id,
+                                                     realtime.sign(CHANNEL_NAME, socket_id, user_id))
+    connection = socket.create_connection(('127.0.0.1', port))
+    connection.sendall('GET /channels/{}?{} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(CHANNEL_NAME, query)
+                       .encode('utf-8'))
+
+    stream = connection.makefile('rb')
+    for line in stream:
+        if line.startswith(b'event: pusher_internal:subscription_succeeded'):
+            break
+    return connection, stream
+
+
+def _receive(stream, latencies):
+    received = 0
+    event = None
+    for line in stream:
+        if line.startswith(b'event: '):
+            event = line[len(b'event: '):].strip()
+        elif line.startswith(b'data: ') and event == b'bench':
+            latencies.append(time.time() - json.loads(line[len(b'data: '):].decode('utf-8'))['sent_at'])
+            received += 1
+            if received == EVENTS:
+                return
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def main():
+    gateway = Gateway()
+    threading.Thread(target=gateway.run, args=('127.0.0.1', 0), daemon=True).start()
+    gateway.ready.wait()
+    port = gateway.server.sockets[0].getsockname()[1]
+    backend = realtime.RedisBackend()
+
+    print('{:>12} {:>10} {:>10} {:>10}'.format('subscribers', 'p50 (ms)', 'p95 (ms)', 'max (ms)'))
+    for count in SUBSCRIBERS:
+        subscriptions = [_subscribe(port, user_id) for user_id in range(1, count + 1)]
+        latencies = []
+        receivers = [threading.Thread(target=_receive, args=(stream, latencies)) for _, stream in subscriptions]
+        for receiver in receivers:
+            receiver.start()
+
+        for _ in range(EVENTS):
+            backend.trigger(CHANNEL_NAME, 'bench', {'sent_at': time.time()})
+            time.sleep(0.001)
+
+        for receiver in receivers:
+            receiver.join()
+        for connection, _ in subscriptions:
+            connection.close()
+
+        print('{:>12} {:>10.2f} {:>10.2f} {:>10.2f}'.format(count,
+                                                            _percentile(latencies, 50) * 1000,
+                                                            _percentile(latencies, 95) * 1000,
+                                                            max(latencies) * 1000))
+
+
+if __name__ == '__main__':
+    main()
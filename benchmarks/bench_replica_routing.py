@@ -0,0 +1,117 @@
+"""
+Statements run on the primary for a read heavy room workload, with and without a read replica.
+
+The replica is a second engine on the configured database, so that both see the same rows.
+Rows are committed for the replica to see them, and deleted afterwards:
+    FLASK_ENV=test python -m benchmarks.bench_replica_routing
+"""
+import time
+
+from sqlalchemy import event
+
+from main import app, db
+from main.cfg import config
+from main.models.message import Message
+from main.models.room import Room
+from main.models.room_participant import RoomParticipant
+from main.models.user import User
+from main.utils.helpers import encode
+from main.utils.routing import REPLICA_BIND
+from main.enums import ParticipantStatus, RoomStatus
+from database import create_all
+
+USERS = 20
+# Users sending messages, their reads stay on the primary for REPLICA_LAG seconds
+WRITERS = 5
+REQUESTS = 500
+# One request in WRITE_EVERY sends a message
+WRITE_EVERY = 20
+
+test_app = app.test_client()
+
+
+def _setup_room():
+    suffix = int(time.time())
+    users = [User(name='Bench User', email='bench_replica_{}_{}@test.com'.format(suffix, i), password_hash='',
+                  status='active') for i in range(USERS)]
+    db.session.add_all(users)
+    db.session.flush()
+
+    room = Room(name='Bench Room', creator_id=users[0].id, fingerprint='rep{}'.format(suffix % 100000),
+                status=RoomStatus.ACTIVE)
+    db.session.add(room)
+    db.session.flush()
+
+    db.session.add_all([RoomParticipant(user_id=user.id, room_id=room.id, status=ParticipantStatus.IN)
+                        for user in users])
+    db.session.commit()
+    return room.id, [user.id for user in users]
+
+
+def _cleanup(room_id, user_ids):
+    db.session.remove()
+    Message.query.filter(Message.room_id == room_id).delete(synchronize_session=False)
+    RoomParticipant.query.filter(RoomParticipant.room_id == room_id).delete(synchronize_session=False)
+    Room.query.filter(Room.id == room_id).delete(synchronize_session=False)
+    User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def _request(i, room_id, tokens):
+    if i % WRITE_EVERY == 0:
+        # Writers take turns, messages are rate limited per user
+        headers = {'Authorization': 'Bearer {}'.format(tokens[i // WRITE_EVERY % WRITERS])}
+        return test_app.post('/api/messages', headers=headers, content_type='application/json',
+                             data='{{"room_id": {}, "content": "Hello"}}'.format(room_id))
+
+    headers = {'Authorization': 'Bearer {}'.format(tokens[i % len(tokens)])}
+    url = ['/api/rooms/{}', '/api/rooms/{}/messages', '/api/rooms'][i % 3].format(room_id)
+    return test_app.get(url, headers=headers)
+
+
+def _measure(room_id, tokens, binds):
+    app.config['SQLALCHEMY_BINDS'] = binds
+    counts = {'primary': 0, 'replica': 0}
+
+    def counter(name):
+        def count(*args):
+            counts[name] += 1
+        return count
+
+    engines = [('primary', db.engine)]
+    if binds:
+        engines.append(('replica', db.get_engine(app, bind=REPLICA_BIND)))
+    listeners = [(engine, counter(name)) for name, engine in engines]
+    for engine, listener in listeners:
+        event.listen(engine, 'before_cursor_execute', listener)
+
+    start = time.perf_counter()
+    for i in range(REQUESTS):
+        res = _request(i, room_id, tokens)
+        assert res.status_code == 200, res.data
+    elapsed = time.perf_counter() - start
+
+    for engine, listener in listeners:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return counts['primary'], counts['replica'], elapsed * 1000 / REQUESTS
+
+
+def main():
+    create_all()
+    # Events are published to Redis rather than sent to Pusher
+    config.REALTIME_BACKEND = 'redis'
+    room_id, user_ids = _setup_room()
+    tokens = [encode(User.query.get(user_id)) for user_id in user_ids]
+
+    print('{:>10} {:>12} {:>12} {:>16}'.format('replica', 'primary', 'replica', 'ms per request'))
+    try:
+        for binds in [None, {REPLICA_BIND: config.SQLALCHEMY_DATABASE_URI}]:
+            primary, replica, latency = _measure(room_id, tokens, binds)
+            print('{:>10} {:>12} {:>12} {:>16.2f}'.format('yes' if binds else 'no', primary, replica, latency))
+    finally:
+        app.config['SQLALCHEMY_BINDS'] = config.SQLALCHEMY_BINDS
+        _cleanup(room_id, user_ids)
+
+
+if __name__ == '__main__':
+    main()
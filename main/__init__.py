@@ -1,7 +1,6 @@
 import logging
 
-from flask import Flask, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, jsonify, g, request
 from sqlalchemy import MetaData
 from flask_cors import CORS
 from redis import Redis
@@ -9,6 +8,8 @@ import pusher
 
 from main.cfg import config
 from main.errors import Error
+from main.utils.routing import RoutingSQLAlchemy
+from main.libs import query_stats
 
 app = Flask(__name__)
 app.config.from_object(config)
@@ -20,7 +21,7 @@ _naming_convention = {
 }
 
 _metadata = MetaData(naming_convention=_naming_convention)
-db = SQLAlchemy(app=app, metadata=_metadata)
+db = RoutingSQLAlchemy(app=app, metadata=_metadata)
 
 CORS(app)
 redis = Redis.from_url(config.REDIS_URI)
@@ -29,7 +30,8 @@ pusher_client = pusher.Pusher(
   app_id=config.PUSHER_APP_ID,
   key=config.PUSHER_KEY,
   secret=config.PUSHER_SECRET,
-  cluster=config.PUSHER_CLUSTER
+  cluster=config.PUSHER_CLUSTER,
+  timeout=config.PUSHER_TIMEOUT
 )
 
 
@@ -41,6 +43,50 @@ def _register_subpackages():
 _register_subpackages()
 
 
+@app.before_request
+def start_query_stats():
+    if config.QUERY_STATS_ENABLED:
+        g.query_stats = query_stats.start()
+
+
+@app.after_request
+def report_query_stats(response):
+    """Registered before commit_session, so that queries of the commit are counted"""
+    stats = g.pop('query_stats', None)
+    if stats is None:
+        return response
+
+    query_stats.stop(stats)
+    if app.debug:
+        return query_stats.add_headers(response, stats)
+
+    query_stats.log(request, response, stats)
+    return response
+
+
+@app.teardown_request
+def stop_query_stats(exception):
+    # Requests failing before after_request
+    stats = g.pop('query_stats', None)
+    if stats is not None:
+        query_stats.stop(stats)
+
+
+@app.before_request
+def reset_session_routing():
+    """Reads are routed by what the current request wrote, see main.libs.replica"""
+    db.session.info.pop('wrote', None)
+    db.session.info.pop('user_id', None)
+
+
+@app.after_request
+def commit_session(response):
+    """Commit what is left of a successful request, so that its outbox events are sent"""
+    if response.status_code < 400:
+        db.session.commit()
+    return response
+
+
 @app.errorhandler(404)
 def handle_not_found(exception):
     """Handle an invalid endpoint"""
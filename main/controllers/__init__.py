@@ -1 +1 @@
-from . import user, room, message, pusher, video
+from . import metrics, user, room, message, pusher, video
@@ -1,28 +1,30 @@
 from flask import jsonify
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
 
 from main import db, app
+from main.cfg import config
 from main.errors import Error, StatusCode
 from main.utils.helpers import parse_request_args, access_token_required
-from main.models.room_participant import RoomParticipant
 from main.models.message import Message
 from main.schemas.message import MessageSchema
-from main.libs import pusher
-from main.enums import PusherEvent, ParticipantStatus
+from main.libs import outbox, message_history, membership
+from main.libs.rate_limit import rate_limited
+from main.libs.replica import use_replica
+from main.enums import PusherEvent
 
 
 @app.route('/api/messages', methods=['POST'])
 @parse_request_args(MessageSchema())
 @access_token_required
+@rate_limited(lambda user, args: 'message:{}'.format(user.id), config.MESSAGE_RATE_LIMIT, config.MESSAGE_RATE_WINDOW)
 def send_message(user, args):
     room_id = args['room_id']
 
-    participant = db.session.query(RoomParticipant).filter_by(room_id=args['room_id'], user_id=user.id).first()
-    if participant.status != ParticipantStatus.IN:
+    if not membership.is_online(room_id, user.id):
         raise Error(StatusCode.FORBIDDEN, message='Invalid room access')
 
     message = Message(user_id=user.id, **args)
     db.session.add(message)
-    db.session.commit()
 
     data = {
         'user_id': user.id,
@@ -30,9 +32,44 @@ def send_message(user, args):
         'room_id': room_id,
         'content': args['content']
     }
-    pusher.trigger(room_id, PusherEvent.NEW_MESSAGE, data)
+    # Committed with the message
+    outbox.add(room_id, PusherEvent.NEW_MESSAGE, data)
+    db.session.commit()
 
     return jsonify({
         'message': 'Message added successfully',
         'data': MessageSchema().dump(message).data
     }), 200
+
+
+class MessageHistorySchema(Schema):
+    before_id = fields.Integer()
+    after_id = fields.Integer()
+    limit = fields.Integer(missing=config.MESSAGE_PAGE_SIZE,
+                           validate=validate.Range(min=1, max=config.MESSAGE_PAGE_MAX_SIZE))
+
+    @validates_schema
+    def validate_cursor(self, data):
+        if data.get('before_id') is not None and data.get('after_id') is not None:
+            raise ValidationError('Only one of before_id and after_id can be used', 'before_id')
+
+
+@app.route('/api/rooms/<int:room_id>/messages', methods=['GET'])
+@access_token_required
+@parse_request_args(MessageHistorySchema())
+@use_replica
+def get_room_messages(room_id, user, args):
+    if not membership.is_member(room_id, user.id):
+        raise Error(StatusCode.FORBIDDEN, 'You are not allowed to access room information')
+
+    messages, has_more = message_history.get_message_page(room_id,
+                                                          before_id=args.get('before_id'),
+                                                          after_id=args.get('after_id'),
+                                                          limit=args['limit'])
+    return jsonify({
+        'message': 'Room messages',
+        'data': {
+            'messages': MessageSchema(many=True).dump(messages).data,
+            'has_more': has_more
+        }
+    }), 200
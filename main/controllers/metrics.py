@@ -0,0 +1,48 @@
+import hmac
+import time
+
+from flask import g, request, Response
+
+from main import app
+from main.cfg import config
+from main.errors import Error, StatusCode
+from main.libs import metrics
+
+
+def _endpoint():
+    # Requests not matching any route share one label
+    return request.endpoint or 'unmatched'
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started_at = time.perf_counter()
+    metrics.add_gauge('http_requests_in_progress', 1, endpoint=_endpoint(), method=request.method)
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Registered before commit_session, so that the commit counts in the latency"""
+    started_at = g.get('request_started_at')
+    if started_at is not None:
+        labels = dict(endpoint=_endpoint(), method=request.method)
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started_at, **labels)
+        metrics.incr('http_requests_total', status=response.status_code, **labels)
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exception):
+    if g.pop('request_started_at', None) is not None:
+        metrics.add_gauge('http_requests_in_progress', -1, endpoint=_endpoint(), method=request.method)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Metrics of all processes, in the Prometheus text format"""
+    if config.METRICS_TOKEN is not None:
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization, 'Bearer {}'.format(config.METRICS_TOKEN)):
+            raise Error(StatusCode.UNAUTHORIZED, 'Invalid metrics token')
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
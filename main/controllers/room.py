@@ -1,26 +1,28 @@
 from flask import jsonify
-from marshmallow import Schema, fields, validate
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
+from sqlalchemy.orm import joinedload
 
 from main import db, app 
+from main.cfg import config
 from main.errors import Error, StatusCode
 from main.utils.helpers import parse_request_args, access_token_required, create_fingerprint
 from main.models.room import Room
 from main.models.room_participant import RoomParticipant
-from main.models.message import Message
 from main.models.video import Video
-from main.models.vote import Vote
 from main.models.user import User
 from main.schemas.video import VideoSchema
 from main.schemas.room import RoomSchema
 from main.schemas.message import MessageSchema
-from main.enums import ParticipantStatus, PusherEvent, VideoStatus, RoomStatus, VoteStatus
+from main.enums import ParticipantStatus, PusherEvent, VideoStatus, RoomStatus
 from main.schemas.room_participant import RoomParticipantSchema
-from main.libs import pusher, video_engine
-from main.libs.rate_limit import RateLimit
+from main.libs import outbox, video_engine, message_history, playback, barrier, membership, room_events
+from main.libs.rate_limit import rate_limited
+from main.libs.replica import use_replica
 
 
 @app.route('/api/rooms', methods=['GET'])
 @access_token_required
+@use_replica
 def get_room_list(**kwargs):
     user = kwargs['user']
     user_rooms = db.session.query(Room).join(RoomParticipant).filter_by(user_id=user.id).all()
@@ -37,33 +39,76 @@ def get_room_info(user, room_id, **kwargs):
     if room is None:
         raise Error(StatusCode.BAD_REQUEST, 'Invalid room id')
 
-    participant = RoomParticipant.query.filter_by(room_id=room_id, user_id=user.id).one_or_none()
-
-    if not participant or participant.status == ParticipantStatus.DELETED:
+    if not membership.is_member(room_id, user.id):
         raise Error(StatusCode.FORBIDDEN, 'You are not allowed to access room information')
 
+    return jsonify({
+        'message': 'Room Information',
+        'data': _get_room_snapshot(room, user)
+    }), 200
+
+
+def _get_room_snapshot(room, user):
+    """
+    State of a room, up to date with events until seq.
+    Read from the primary, a lagging replica could miss changes of events until seq
+    """
+    # Read first, events sent while reading are applied again by clients
+    seq = room_events.get_last_seq(room.id)
+
     # Return list of online user
-    participants = db.session.query(RoomParticipant).filter_by(room_id=room_id, status=ParticipantStatus.IN).all()
-    messages = db.session.query(Message).filter_by(room_id=room_id).all()
-    videos = db.session.query(Video).filter_by(room_id=room_id).filter_by(status=VideoStatus.VOTING).all()
-
-    for video in videos:
-        user_vote = Vote.query \
-            .filter_by(video_id=video.id, user_id=user.id, status=VoteStatus.UPVOTE).one_or_none()
-        # Check if user has voted for available video
-        if user_vote:
-            setattr(video, 'is_voted', True)
-        else:
-            setattr(video, 'is_voted', False)
+    participants = db.session.query(RoomParticipant) \
+        .options(joinedload(RoomParticipant.user)) \
+        .filter_by(room_id=room.id, status=ParticipantStatus.IN) \
+        .all()
+    # Only the newest page of messages, older ones are loaded via /api/rooms/<id>/messages
+    messages, has_more_messages = message_history.get_message_page(room.id)
+    videos = db.session.query(Video).filter_by(room_id=room.id).filter_by(status=VideoStatus.VOTING).all()
+    # Check if user has voted for available videos
+    video_engine.set_is_voted(videos, user.id)
+
+    return {
+        'seq': seq,
+        'fingerprint': room.fingerprint,
+        'name': room.name,
+        'participants': RoomParticipantSchema(many=True).dump(participants).data,
+        'messages': MessageSchema(many=True).dump(messages).data,
+        'has_more_messages': has_more_messages,
+        'videos': VideoSchema(many=True).dump(videos).data
+    }
+
+
+class RoomEventsSchema(Schema):
+    since = fields.Integer(required=True, validate=validate.Range(min=0))
 
+
+@app.route('/api/rooms/<int:room_id>/events', methods=['GET'])
+@access_token_required
+@parse_request_args(RoomEventsSchema())
+def get_room_events(room_id, user, args):
+    """Events missed by a client since a sequence number, or a snapshot if they are no longer kept"""
+    if not membership.is_member(room_id, user.id):
+        raise Error(StatusCode.FORBIDDEN, 'You are not allowed to access room information')
+
+    events = room_events.get_events_since(room_id, args['since'])
+    if events is not None:
+        return jsonify({
+            'message': 'Room events',
+            'data': {
+                'seq': events[-1]['seq'] if events else args['since'],
+                'events': events,
+                'snapshot': None
+            }
+        }), 200
+
+    room = db.session.query(Room).filter_by(id=room_id).one()
+    snapshot = _get_room_snapshot(room, user)
     return jsonify({
-        'message': 'Room Information',
+        'message': 'Room snapshot',
         'data': {
-            'fingerprint': room.fingerprint,
-            'name': room.name,
-            'participants': RoomParticipantSchema(many=True).dump(participants).data,
-            'messages': MessageSchema(many=True).dump(messages).data,
-            'videos': VideoSchema(many=True).dump(videos).data
+            'seq': snapshot['seq'],
+            'events': None,
+            'snapshot': snapshot
         }
     }), 200
 
@@ -82,6 +127,7 @@ def create_room(user, **kwargs):
     creator_participant = RoomParticipant(user_id=user.id, room_id=new_room.id, status=ParticipantStatus.IN)
     db.session.add(creator_participant)
     db.session.commit()
+    membership.set_status(new_room.id, user.id, ParticipantStatus.IN)
 
     return jsonify({
         'message': 'New room is created',
@@ -112,6 +158,7 @@ def join_room_by_fingerprint(user, args):
         participant.status = ParticipantStatus.IN
 
     db.session.commit()
+    membership.set_status(room.id, user.id, ParticipantStatus.IN)
     return jsonify({
         'message': 'You have joined this room',
         'data': RoomSchema().dump(room).data
@@ -132,8 +179,7 @@ def add_participant_to_room(room_id, user, args):
         raise Error(StatusCode.BAD_REQUEST, 'Invalid room id')
 
     # Only room member can add new participant
-    checked_participant = db.session.query(RoomParticipant).filter_by(user_id=user.id, room_id=room_id).one_or_none()
-    if checked_participant is None or checked_participant.status == ParticipantStatus.DELETED:
+    if not membership.is_member(room_id, user.id):
         raise Error(StatusCode.FORBIDDEN, 'You\'re not allowed to add new member to this room')
 
     added_user = User.query.filter_by(email=args['email']).one_or_none()
@@ -144,7 +190,6 @@ def add_participant_to_room(room_id, user, args):
     if not is_participant:
         new_participant = RoomParticipant(user_id=user.id, room_id=room_id, status=ParticipantStatus.OUT)
         db.session.add(new_participant)
-        db.session.commit()
 
         notification = {
             "name": added_user.name,
@@ -152,7 +197,9 @@ def add_participant_to_room(room_id, user, args):
             "room": room_id
         }
 
-        pusher.trigger(room_id, PusherEvent.NEW_PARTICIPANT, notification)
+        outbox.add(room_id, PusherEvent.NEW_PARTICIPANT, notification)
+        db.session.commit()
+        membership.set_status(room_id, new_participant.user_id, new_participant.status)
 
         return jsonify({
             'message': 'New participant to the room is created',
@@ -160,8 +207,8 @@ def add_participant_to_room(room_id, user, args):
         }), 200
     elif is_participant.status == ParticipantStatus.OUT or is_participant.status == ParticipantStatus.DELETED:
         # User is re-added to this room
+        checked_participant = db.session.query(RoomParticipant).filter_by(user_id=user.id, room_id=room_id).one()
         checked_participant.status = ParticipantStatus.IN
-        db.session.commit()
 
         notification = {
             "name": user.name,
@@ -169,7 +216,9 @@ def add_participant_to_room(room_id, user, args):
             "room": room_id
         }
 
-        pusher.trigger(room_id, PusherEvent.NEW_PARTICIPANT, notification)
+        outbox.add(room_id, PusherEvent.NEW_PARTICIPANT, notification)
+        db.session.commit()
+        membership.set_status(room_id, checked_participant.user_id, ParticipantStatus.IN)
 
         return jsonify({
             'message': 'Participant is re-added to the room',
@@ -189,7 +238,6 @@ def delete_participant_in_room(room_id, **kwargs):
     deleted_participant = db.session.query(RoomParticipant).filter_by(user_id=user.id, room_id=room_id).first()
     if deleted_participant.status == ParticipantStatus.IN:
         deleted_participant.status = ParticipantStatus.DELETED
-        db.session.commit()
 
         notification = {
             "name": user.name,
@@ -197,7 +245,9 @@ def delete_participant_in_room(room_id, **kwargs):
             "room": room_id
         }
 
-        pusher.trigger(room_id, PusherEvent.DELETE_PARTICIPANT, notification)
+        outbox.add(room_id, PusherEvent.DELETE_PARTICIPANT, notification)
+        db.session.commit()
+        membership.set_status(room_id, user.id, ParticipantStatus.DELETED)
 
         return jsonify({
             'message': 'Participant deleted successfully'
@@ -217,7 +267,6 @@ def participant_exit_room(room_id, **kwargs):
     participant = db.session.query(RoomParticipant).filter_by(user_id=user.id, room_id=room_id).first()
     if participant.status == ParticipantStatus.IN:
         participant.status = ParticipantStatus.OUT
-        db.session.commit()
 
         notification = {
             "name": user.name,
@@ -225,7 +274,9 @@ def participant_exit_room(room_id, **kwargs):
             "room": room_id
         }
 
-        pusher.trigger(room_id, PusherEvent.EXIT_PARTICIPANT, notification)
+        outbox.add(room_id, PusherEvent.EXIT_PARTICIPANT, notification)
+        db.session.commit()
+        membership.set_status(room_id, user.id, ParticipantStatus.OUT)
 
         return jsonify({
             'message': 'Participant exited successfully'
@@ -240,15 +291,11 @@ class SongSchema(Schema):
 @app.route('/api/rooms/<int:room_id>/videos', methods=['GET'])
 @access_token_required
 @parse_request_args(SongSchema())
+@use_replica
 def get_song(room_id, user, args):
     type = args['type']
 
-    room_participant = RoomParticipant.query \
-        .filter(RoomParticipant.room_id == room_id) \
-        .filter(RoomParticipant.user_id == user.id) \
-        .one_or_none()
-
-    if not room_participant:
+    if membership.get_status(room_id, user.id) is None:
         raise Error(StatusCode.FORBIDDEN, message='You are not a member of this room')
 
     if type == 'next':
@@ -277,113 +324,91 @@ class MediaStatusUpdateSchema(Schema):
                                                                    VideoStatus.PAUSING, VideoStatus.PLAYING,
                                                                    VideoStatus.FINISHED]))
     video_time = fields.Float(required=True)
+    # Video which the status is reported for
+    video_id = fields.Integer()
+
+    @validates_schema
+    def validate_video_id(self, data):
+        # Readiness and finishing count for a video, a late report must not count for the next one
+        if data.get('status') in (VideoStatus.READY, VideoStatus.FINISHED) and data.get('video_id') is None:
+            raise ValidationError('Missing data for required field.', 'video_id')
+
+
+def _video_status_key(room_id, user, args):
+    """Only seeking and pausing, which interrupt everyone in the room, are limited"""
+    if args['status'] not in (VideoStatus.SEEKING, VideoStatus.PAUSING):
+        return None
+
+    return 'video-status:{}:{}'.format(room_id, user.id)
 
 
 @app.route('/api/rooms/<int:room_id>/videos', methods=['PUT'])
 @access_token_required
 @parse_request_args(MediaStatusUpdateSchema())
+@rate_limited(_video_status_key, config.VIDEO_STATUS_RATE_LIMIT, config.VIDEO_STATUS_RATE_WINDOW,
+              'You have been seeking or pausing too many times recently')
 def update_video_status(room_id, user, args):
     status = args['status']
 
-    room = Room.query.filter(Room.id == room_id).one()
+    current_video = video_engine.get_current_video(room_id)
 
     # Limit user from seeking or pausing video in a room
-    if not room.current_video:
+    if current_video is None:
         raise Error(StatusCode.BAD_REQUEST, 'There is no current media in this room')
 
-    meta_data = {
-        'room': room_id,
-        'video': room.current_video,
-        'user': user.id
-    }
-    rlimit = RateLimit(10, 3 * 60, meta_data)
-    if status in (VideoStatus.SEEKING, VideoStatus.PAUSING):
-        if rlimit.is_over_limit:
-            raise Error(StatusCode.FORBIDDEN, 'You have been seeking or pausing too many times recently')
-
-        rlimit.increase()
+    # Late reports of a previous video must not count for the current one
+    if args.get('video_id') is not None and args['video_id'] != current_video.id:
+        raise Error(StatusCode.CONFLICT, 'Video status is reported for a previous video')
 
     if status == VideoStatus.READY:
         # Only play video when all members are ready
-        room_member = RoomParticipant.query.filter(RoomParticipant.room_id == room_id) \
-                                            .filter(RoomParticipant.user_id == user.id) \
-                                            .one()
-        room_member.video_status = VideoStatus.READY
+        video_engine.set_user_video_status(room_id, user.id, VideoStatus.READY)
         res = {
             'message': 'Waiting for other members to be ready',
         }
-        if video_engine.check_all_user_have_same_video_status(room_id, VideoStatus.READY):
-            current_video = video_engine.get_current_video(room_id)
-            event_data = {
-                'event': VideoStatus.PLAYING,
-                'data': VideoSchema().dump(current_video).data
-            }
-            pusher.trigger(room_id, PusherEvent.VIDEO_STATUS_CHANGED, event_data)
+        if membership.is_online(room_id, user.id) and \
+                barrier.arrive(room_id, current_video.id, user.id, VideoStatus.READY):
             video_engine.set_online_users_video_status(room_id, VideoStatus.PLAYING)
-            room.status = VideoStatus.PLAYING
+            state = playback.update(room_id, status=VideoStatus.PLAYING)
+            outbox.add(room_id, PusherEvent.VIDEO_STATUS_CHANGED, playback.status_event(state, VideoStatus.PLAYING))
 
     if status == VideoStatus.PLAYING:
         # Force all members to play video
-        room.video_time = args['video_time']
-        room.status = status
+        state = playback.update(room_id, status=status, video_time=args['video_time'])
         video_engine.set_online_users_video_status(room_id, VideoStatus.PLAYING)
-        current_song = video_engine.get_current_video(room_id)
-        event_data = {
-            'event': VideoStatus.PLAYING,
-            'data': VideoSchema().dump(current_song).data
-        }
-        pusher.trigger(room_id, PusherEvent.VIDEO_STATUS_CHANGED, event_data)
+        outbox.add(room_id, PusherEvent.VIDEO_STATUS_CHANGED, playback.status_event(state, VideoStatus.PLAYING))
         res = {
             'message': 'Play video'
         }
     if status == VideoStatus.PAUSING:
         # Force all members to pause
-        room.video_time = args['video_time']
-        room.status = status
+        state = playback.update(room_id, status=status, video_time=args['video_time'])
         video_engine.set_online_users_video_status(room_id, VideoStatus.PAUSING)
-        current_song = video_engine.get_current_video(room_id)
-        event_data = {
-            'event': VideoStatus.PAUSING,
-            'data': VideoSchema().dump(current_song).data
-        }
-        pusher.trigger(room_id, PusherEvent.VIDEO_STATUS_CHANGED, event_data)
+        outbox.add(room_id, PusherEvent.VIDEO_STATUS_CHANGED, playback.status_event(state, VideoStatus.PAUSING))
         res = {
             'message': 'Pause video'
         }
     if status == VideoStatus.SEEKING:
         # If someone seek videos, pause video at that time, and wait for all members to be ready
-        room.video_time = args['video_time']
-        room.status = VideoStatus.PAUSING
+        state = playback.update(room_id, status=VideoStatus.PAUSING, video_time=args['video_time'])
         video_engine.set_online_users_video_status(room_id, VideoStatus.PAUSING)
-        current_song = video_engine.get_current_video(room_id)
-        event_data = {
-            'event': VideoStatus.SEEKING,
-            'data': VideoSchema().dump(current_song).data
-        }
-        pusher.trigger(room_id, PusherEvent.VIDEO_STATUS_CHANGED, event_data)
+        outbox.add(room_id, PusherEvent.VIDEO_STATUS_CHANGED, playback.status_event(state, VideoStatus.SEEKING))
         res = {
             'message': 'Seek video'
         }
     if status == VideoStatus.FINISHED:
-        room_member = RoomParticipant.query.filter(RoomParticipant.room_id == room_id) \
-            .filter(RoomParticipant.user_id == user.id) \
-            .one()
-
-        room.video_time = args['video_time']
-        room_member.video_status = VideoStatus.FINISHED
+        playback.update(room_id, video_time=args['video_time'])
+        video_engine.set_user_video_status(room_id, user.id, VideoStatus.FINISHED)
 
         # If all members are finished their current video, then choose next song to play
-        if video_engine.check_all_user_have_same_video_status(room_id, VideoStatus.FINISHED):
-            current_song = Video.query.filter(Video.id == room.current_video).one()
+        if membership.is_online(room_id, user.id) and \
+                barrier.arrive(room_id, current_video.id, user.id, VideoStatus.FINISHED):
+            current_song = Video.query.filter(Video.id == current_video.id).one()
             current_song.status = VideoStatus.FINISHED
 
             video_engine.set_online_users_video_status(room_id, VideoStatus.PAUSING)
             next_video = video_engine.set_current_video(room_id)
-            parsed_next_video = VideoSchema().dump(next_video).data
-            if parsed_next_video:
-                parsed_next_video['video_time'] = 0
-                parsed_next_video['status'] = VideoStatus.PAUSING
-            pusher.trigger(room_id, PusherEvent.PROCEED, parsed_next_video)
+            outbox.add(room_id, PusherEvent.PROCEED, playback.proceed_event(next_video))
 
         res = {
             'message': 'Wait for other member to finish their video'
@@ -1,9 +1,11 @@
 from flask import jsonify
 
 from main import db, app
+from main.cfg import config
 from main.errors import Error, StatusCode
 from main.utils import password as pw
 from main.utils.helpers import encode, parse_request_args
+from main.libs.rate_limit import rate_limited
 from main.models.user import User
 from main.schemas.user import UserSchema
 from main.enums import UserStatus
@@ -11,6 +13,8 @@ from main.enums import UserStatus
 
 @app.route('/api/login', methods=['POST'])
 @parse_request_args(UserSchema(exclude=['name']))
+@rate_limited(lambda args: 'login:{}'.format(args['email'].lower()),
+              config.LOGIN_RATE_LIMIT, config.LOGIN_RATE_WINDOW, 'Too many login attempts, please try again later')
 def login(args):
     user = db.session.query(User).filter_by(email=args['email']).one_or_none()
     if user is not None and pw.generate_hash(args['password'], user.password_salt) == user.password_hash:
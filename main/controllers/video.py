@@ -3,6 +3,7 @@ from sqlalchemy import func
 from marshmallow import Schema, fields, validate
 
 from main import db, app
+from main.cfg import config
 from main.errors import Error, StatusCode
 from main.utils.helpers import parse_request_args, access_token_required
 from main.models.room import Room
@@ -10,7 +11,9 @@ from main.models.room_participant import RoomParticipant
 from main.models.video import Video
 from main.models.vote import Vote
 from main.schemas.video import VideoSchema
-from main.libs import video_engine, pusher
+from main.libs import video_engine, video_queue, outbox, membership, vote_broadcast, playback
+from main.libs.rate_limit import rate_limited
+from main.libs.replica import use_replica
 from main.enums import VideoStatus, VoteStatus, ParticipantStatus, PusherEvent
 
 
@@ -21,6 +24,7 @@ class NextSongSchema(Schema):
 @app.route('/api/videos', methods=['GET'])
 @access_token_required
 @parse_request_args(NextSongSchema())
+@use_replica
 def get_next_song(user, args):
     room_id = args.get('room_id')
     room_participant = RoomParticipant.query \
@@ -46,6 +50,8 @@ def get_next_song(user, args):
 @app.route('/api/videos', methods=['POST'])
 @parse_request_args(VideoSchema())
 @access_token_required
+@rate_limited(lambda user, args: 'video-add:{}'.format(user.id),
+              config.VIDEO_ADD_RATE_LIMIT, config.VIDEO_ADD_RATE_WINDOW)
 def add_video(user, args):
     room_id = args['room_id']
     room = db.session.query(Room).filter_by(id=room_id).one_or_none()
@@ -53,10 +59,8 @@ def add_video(user, args):
     if room is None:
         raise Error(StatusCode.BAD_REQUEST, 'Invalid room id')
 
-    participant = db.session.query(RoomParticipant).filter_by(user_id=user.id, room_id=args['room_id']).first()
-
     # check whether user is in the room or not to add video
-    if not participant or participant.status != ParticipantStatus.IN:
+    if not membership.is_online(room_id, user.id):
         raise Error(StatusCode.FORBIDDEN, 'Not allow to add video')
 
     new_video = Video(**args, creator_id=user.id, total_vote=1, status=VideoStatus.VOTING)
@@ -64,22 +68,18 @@ def add_video(user, args):
     db.session.add(new_video)
     db.session.flush()
 
-    pusher.trigger(room_id, PusherEvent.NEW_VIDEO, VideoSchema().dump(new_video).data)
+    outbox.add(room_id, PusherEvent.NEW_VIDEO, VideoSchema().dump(new_video).data)
 
     new_vote = Vote(video_id=new_video.id, user_id=user.id, status=VoteStatus.UPVOTE)
     db.session.add(new_vote)
     db.session.commit()
+    video_queue.add(room_id, new_video.id, new_video.total_vote)
 
     # Play the newest proposed video if current_video is not set
-    if not room.current_video:
+    if video_engine.get_current_video(room_id) is None:
         new_video.status = VideoStatus.PLAYING
         current_video = video_engine.set_current_video(room_id, new_video.id)
-
-        parsed_current_video = VideoSchema().dump(current_video).data
-        parsed_current_video['video_time'] = 0
-        parsed_current_video['status'] = VideoStatus.PAUSING
-
-        pusher.trigger(room_id, PusherEvent.PROCEED, parsed_current_video)
+        outbox.add(room_id, PusherEvent.PROCEED, playback.proceed_event(current_video))
         video_engine.set_online_users_video_status(room_id, VideoStatus.PAUSING)
 
     return jsonify({
@@ -88,8 +88,14 @@ def add_video(user, args):
     })
 
 
+def _vote_key(user, **kwargs):
+    """Up and down votes of a user are limited together"""
+    return 'vote:{}'.format(user.id)
+
+
 @app.route('/api/videos/<int:video_id>/vote', methods=['POST'])
 @access_token_required
+@rate_limited(_vote_key, config.VOTE_RATE_LIMIT, config.VOTE_RATE_WINDOW)
 def up_vote(video_id, **kwargs):
     user = kwargs['user']
     video = db.session.query(Video).filter_by(id=video_id).one_or_none()
@@ -99,56 +105,32 @@ def up_vote(video_id, **kwargs):
     if video.status != VideoStatus.VOTING:
         raise Error(StatusCode.FORBIDDEN, 'Video cannot be voted')
 
-    room_id = video.room_id
-    participant = db.session.query(RoomParticipant).filter_by(user_id=user.id, room_id=room_id).one_or_none()
-
-    if not participant or participant.status != ParticipantStatus.IN:
+    if not membership.is_online(video.room_id, user.id):
         raise Error(StatusCode.FORBIDDEN, 'Video cannot be voted')
 
     # User is in the room that has that video to be able to vote
-    vote = db.session.query(Vote).filter_by(user_id=user.id, video_id=video.id).first()
-    if vote is None:
-        new_vote = Vote(user_id=user.id, video_id=video.id, status=VoteStatus.UPVOTE)
-        video.total_vote += 1
-        db.session.add(new_vote)
-        db.session.commit()
-
-        data = {
-            "name": user.name,
-            "id": video.id,
-            "total_vote": video.total_vote
-        }
-
-        pusher.trigger(video.room_id, PusherEvent.UP_VOTE, data)
-
-        return jsonify({
-            'message': 'Upvote successfully',
-            'data': VideoSchema().dump(video).data
-        })
-    if vote.status == VoteStatus.UPVOTE:
+    total_vote = video_engine.up_vote(video, user.id)
+    if total_vote is None:
         raise Error(StatusCode.FORBIDDEN, 'Already up-voted')
 
-    if vote.status == VoteStatus.DOWNVOTE:
-        vote.status = VoteStatus.UPVOTE
-        video.total_vote += 1
-        db.session.commit()
-
-        data = {
-            "name": user.name,
-            "id": video.id,
-            "total_vote": video.total_vote
-        }
+    data = {
+        "name": user.name,
+        "id": video.id,
+        "total_vote": total_vote
+    }
 
-        pusher.trigger(video.room_id, PusherEvent.UP_VOTE, data)
+    vote_broadcast.broadcast(video.room_id, PusherEvent.UP_VOTE, data)
+    db.session.commit()
 
-        return jsonify({
-            'message': 'Upvote successfully',
-            'data': VideoSchema().dump(video).data
-        })
+    return jsonify({
+        'message': 'Upvote successfully',
+        'data': VideoSchema().dump(video).data
+    })
 
 
 @app.route('/api/videos/<int:video_id>/vote', methods=['DELETE'])
 @access_token_required
+@rate_limited(_vote_key, config.VOTE_RATE_LIMIT, config.VOTE_RATE_WINDOW)
 def down_vote(video_id, **kwargs):
     user = kwargs['user']
     video = db.session.query(Video).filter_by(id=video_id).one_or_none()
@@ -158,29 +140,27 @@ def down_vote(video_id, **kwargs):
     if video.status != VideoStatus.VOTING:
         raise Error(StatusCode.FORBIDDEN, 'Not allow to vote')
 
-    participant = db.session.query(RoomParticipant).filter_by(user_id=user.id, room_id=video.room_id).first()
-    if participant.status == ParticipantStatus.IN:  # User is in the room that has that video to be able to vote
-        vote = db.session.query(Vote).filter_by(user_id=user.id, video_id=video.id).first()
-        if vote is None:
-            raise Error(StatusCode.FORBIDDEN, 'You have to up-vote first in order to down-vote')
-        if vote.status == VoteStatus.DOWNVOTE:
+    if membership.is_online(video.room_id, user.id):  # User is in the room that has that video to be able to vote
+        total_vote = video_engine.down_vote(video, user.id)
+        if total_vote is None:
+            vote = db.session.query(Vote).filter_by(user_id=user.id, video_id=video.id).first()
+            if vote is None:
+                raise Error(StatusCode.FORBIDDEN, 'You have to up-vote first in order to down-vote')
             raise Error(StatusCode.FORBIDDEN, 'Already down-voted')
-        if vote.status == VoteStatus.UPVOTE:
-            vote.status = VoteStatus.DOWNVOTE
-            video.total_vote -= 1
-            db.session.commit()
-            data = {
-                "name": user.name,
-                "id": video.id,
-                "total_vote": video.total_vote
-            }
 
-            pusher.trigger(video.room_id, PusherEvent.DOWN_VOTE, data)
+        data = {
+            "name": user.name,
+            "id": video.id,
+            "total_vote": total_vote
+        }
 
-            return jsonify({
-                'message': 'Down-voted successfully',
-                'data': VideoSchema().dump(video).data
-            })
+        vote_broadcast.broadcast(video.room_id, PusherEvent.DOWN_VOTE, data)
+        db.session.commit()
+
+        return jsonify({
+            'message': 'Down-voted successfully',
+            'data': VideoSchema().dump(video).data
+        })
 
 
 @app.route('/api/videos/<int:video_id>', methods=['DELETE'])
@@ -13,6 +13,7 @@ class PusherEvent:
     NEW_VIDEO = 'new_video'
     VIDEO_STATUS_CHANGED = 'video_status_changed'
     PROCEED = 'proceed'
+    VOTE_TOTALS = 'vote_totals'
 
 
 class ParticipantStatus: 
@@ -53,3 +54,24 @@ VideoActions = [
     VideoAction.PAUSE,
     VideoAction.SEEK
 ]
+
+
+class CircuitState:
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
+class TaskQueue:
+    # Playback sync, which should never wait behind other events
+    REALTIME_CRITICAL = 'realtime_critical'
+    # Chat, votes and other notifications
+    REALTIME_BULK = 'realtime_bulk'
+    BACKGROUND = 'background'
+
+
+TaskQueues = [
+    TaskQueue.REALTIME_CRITICAL,
+    TaskQueue.REALTIME_BULK,
+    TaskQueue.BACKGROUND
+]
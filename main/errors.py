@@ -21,4 +21,6 @@ class StatusCode:
     UNAUTHORIZED = 401
     FORBIDDEN = 403
     NOT_FOUND = 404
+    CONFLICT = 409
+    TOO_MANY_REQUESTS = 429
     INTERNAL_ERROR = 500
@@ -0,0 +1,60 @@
+from main import redis
+from main.cfg import config
+from main.models.room_participant import RoomParticipant
+from main.libs import playback
+from main.enums import ParticipantStatus, VideoStatus
+
+BARRIER_STATUSES = (VideoStatus.READY, VideoStatus.FINISHED)
+
+
+def _barrier_key(room_id, video_id, status):
+    """Set of users who have reported a status for a video"""
+    return '{}-barrier:{}:{}:{}'.format(config.REDIS_PREFIX, room_id, video_id, status)
+
+
+def _online_count_key(room_id):
+    return '{}-online-count:{}'.format(config.REDIS_PREFIX, room_id)
+
+
+def count_online_users(room_id):
+    count = redis.get(_online_count_key(room_id))
+    if count is None:
+        count = RoomParticipant.query \
+            .filter(RoomParticipant.room_id == room_id) \
+            .filter(RoomParticipant.status == ParticipantStatus.IN) \
+            .count()
+        redis.set(_online_count_key(room_id), count, ex=config.ONLINE_COUNT_TTL)
+
+    return int(count)
+
+
+def arrive(room_id, video_id, user_id, status):
+    """
+    Record that an online user has reached a status for a video
+    :return: whether all online users have reached that status
+    """
+    key = _barrier_key(room_id, video_id, status)
+    pipe = redis.pipeline()
+    pipe.sadd(key, user_id)
+    pipe.expire(key, config.BARRIER_TTL)
+    pipe.scard(key)
+    _, _, arrived = pipe.execute()
+
+    return arrived >= count_online_users(room_id)
+
+
+def reset(room_id, video_id):
+    """Forget all reported statuses for a video"""
+    redis.delete(*[_barrier_key(room_id, video_id, status) for status in BARRIER_STATUSES])
+
+
+def on_membership_changed(room_id, user_id):
+    """Called when a user joins or leaves a room, a user who left no longer counts towards the barrier"""
+    redis.delete(_online_count_key(room_id))
+
+    state = playback.get_state(room_id)
+    if state is not None and state.video_id is not None:
+        pipe = redis.pipeline()
+        for status in BARRIER_STATUSES:
+            pipe.srem(_barrier_key(room_id, state.video_id, status), user_id)
+        pipe.execute()
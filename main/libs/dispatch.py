@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+from main.cfg import config
+from main.libs import metrics
+
+
+class _TaskQueue(queue.Queue):
+    def drop_oldest(self, can_drop):
+        """
+        Remove the oldest queued item for which can_drop is true
+        :return: False if there is none
+        """
+        with self.mutex:
+            for item in self.queue:
+                if can_drop(item):
+                    self.queue.remove(item)
+                    self.unfinished_tasks -= 1
+                    if not self.unfinished_tasks:
+                        self.all_tasks_done.notify_all()
+                    self.not_full.notify()
+                    return True
+        return False
+
+
+class DispatchPool(object):
+    """
+    Bounded queue of tasks run by threads of the current process.
+    Tasks with a countdown wait in a timer thread, not in a worker, and are queued once due.
+    Queued and delayed tasks are kept in memory only, they are lost if the process exits.
+    :param when_full: 'block' waits up to block_timeout for room, 'drop_oldest' drops the oldest queued
+    droppable task, 'celery' gives up at once
+    :param delayed_size: maximum number of tasks waiting for their countdown, queue_size by default.
+    Once reached, droppable tasks with a countdown are dropped and others are given up
+    """
+
+    def __init__(self, workers, queue_size, when_full='celery', block_timeout=0, delayed_size=None):
+        self.queue = _TaskQueue(maxsize=queue_size)
+        self.when_full = when_full
+        self.block_timeout = block_timeout
+        self.delayed_size = queue_size if delayed_size is None else delayed_size
+        self.pid = os.getpid()
+        # Heap of (due time, order, item) of tasks with a countdown
+        self._delayed = []
+        self._order = itertools.count()
+        self._delayed_changed = threading.Condition()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        threading.Thread(target=self._queue_due, daemon=True).start()
+
+    def _work(self):
+        while True:
+            task, args, droppable = self.queue.get()
+            try:
+                task(*args)
+            except Exception:
+                logging.exception('Dispatched task failed')
+            finally:
+                self.queue.task_done()
+
+    def _queue_due(self):
+        while True:
+            with self._delayed_changed:
+                while not self._delayed or self._delayed[0][0] > time.time():
+                    self._delayed_changed.wait(self._delayed[0][0] - time.time() if self._delayed else None)
+                _, _, item = heapq.heappop(self._delayed)
+
+            # Delayed tasks were accepted already, wait for room rather than drop them
+            self.queue.put(item)
+
+    def submit(self, task, args=(), countdown=0, droppable=False):
+        """
+        :param droppable: whether 'drop_oldest' or a full delayed heap may drop the task. Tasks holding
+        a single-flight flag must not be dropped, later events wait for them to run
+        :return: False if the task could not be queued
+        """
+        item = (task, args, droppable)
+
+        if countdown > 0:
+            with self._delayed_changed:
+                if len(self._delayed) >= self.delayed_size:
+                    if not droppable:
+                        return False
+                    metrics.incr('event_dispatch_dropped_total')
+                    return True
+
+                heapq.heappush(self._delayed, (time.time() + countdown, next(self._order), item))
+                self._delayed_changed.notify()
+            return True
+
+        if self.when_full == 'drop_oldest':
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return True
+                except queue.Full:
+                    pass
+
+                if not self.queue.drop_oldest(lambda queued: queued[2]):
+                    return False
+                metrics.incr('event_dispatch_dropped_total')
+
+        try:
+            if self.when_full == 'block':
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            return False
+
+        return True
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        # uWSGI forks workers after loading the app, each of them starts its own threads
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = DispatchPool(config.EVENT_DISPATCH_WORKERS, config.EVENT_DISPATCH_QUEUE_SIZE,
+                                 when_full=config.EVENT_DISPATCH_WHEN_FULL,
+                                 block_timeout=config.EVENT_DISPATCH_BLOCK_TIMEOUT,
+                                 delayed_size=config.EVENT_DISPATCH_DELAYED_SIZE)
+        return _pool
+
+
+def apply_async(task, args=(), countdown=0, queue=None, droppable=False):
+    """
+    Run a Celery task of realtime events. In 'thread' dispatch mode, it is run by the
+    thread pool of the process, and by Celery only if the pool is full.
+    :param queue: Celery queue overriding the route of the task
+    :param droppable: whether the pool may drop the task when full, see DispatchPool.submit
+    """
+    if config.EVENT_DISPATCH_MODE == 'thread':
+        if _get_pool().submit(task, args, countdown, droppable):
+            metrics.incr('event_dispatch_total', mode='thread')
+            return
+
+        metrics.incr('event_dispatch_fallbacks_total')
+
+    metrics.incr('event_dispatch_total', mode='celery')
+    options = {'queue': queue} if queue else {}
+    task.apply_async(args, countdown=countdown, **options)
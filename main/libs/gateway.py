@@ -0,0 +1,180 @@
+"""
+Realtime gateway serving presence channels when REALTIME_BACKEND is 'redis'.
+
+Clients subscribe a channel with Server-Sent Events:
+    GET /channels/<channel_name>?socket_id=<socket id>&user_id=<user id>&auth=<signature>
+the signature being returned by /api/pusher/auth. Events published on Redis are
+forwarded to subscribers. Members of each channel are tracked by the gateway, which
+sends member_added/member_removed to subscribers and queues them like Pusher webhooks.
+
+Presence is kept in process, so one gateway serves all channels.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+
+from main import redis
+from main.cfg import config
+from main.libs import realtime, presence
+
+_SSE_HEADERS = (b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/event-stream\r\n'
+                b'Cache-Control: no-cache\r\n'
+                b'Access-Control-Allow-Origin: *\r\n'
+                b'\r\n')
+_FORBIDDEN = b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n'
+
+
+class Subscriber(object):
+    def __init__(self, channel_name, socket_id, user_id, writer):
+        self.channel_name = channel_name
+        self.socket_id = socket_id
+        self.user_id = user_id
+        self.writer = writer
+
+    def send(self, event, data):
+        self.writer.write('event: {}\ndata: {}\n\n'.format(event, json.dumps(data)).encode('utf-8'))
+
+
+def parse_subscription(request_line, writer):
+    """
+    Read a subscription from the request line of a client
+    :return: Subscriber or None if the request is invalid or not signed
+    """
+    try:
+        method, target, _ = request_line.decode('utf-8').split(' ', 2)
+    except ValueError:
+        return None
+
+    url = urlsplit(target)
+    if method != 'GET' or not url.path.startswith('/channels/'):
+        return None
+
+    channel_name = url.path[len('/channels/'):]
+    if not channel_name.startswith('presence-room-'):
+        return None
+
+    params = {name: values[0] for name, values in parse_qs(url.query).items()}
+    try:
+        socket_id, user_id, signature = params['socket_id'], int(params['user_id']), params['auth']
+    except (KeyError, ValueError):
+        return None
+
+    if not realtime.verify(channel_name, socket_id, user_id, signature):
+        return None
+
+    return Subscriber(channel_name, socket_id, user_id, writer)
+
+
+class Gateway(object):
+    def __init__(self):
+        self.loop = None
+        self.server = None
+        self.ready = threading.Event()
+        self.deliveries = itertools.count()
+        self.started = int(time.time() * 1000)
+        # Channel name to its subscribers, and to the number of subscribers of each user
+        self.subscribers = {}
+        self.members = {}
+
+    def join(self, subscriber):
+        """:return: presence events caused by the subscriber"""
+        channel_name = subscriber.channel_name
+        self.subscribers.setdefault(channel_name, set()).add(subscriber)
+        members = self.members.setdefault(channel_name, Counter())
+        members[subscriber.user_id] += 1
+
+        if members[subscriber.user_id] == 1:
+            return [{'name': 'member_added', 'channel': channel_name, 'user_id': subscriber.user_id}]
+        return []
+
+    def leave(self, subscriber):
+        """:return: presence events caused by the subscriber leaving"""
+        channel_name = subscriber.channel_name
+        self.subscribers[channel_name].discard(subscriber)
+        members = self.members[channel_name]
+        members[subscriber.user_id] -= 1
+
+        events = []
+        if members[subscriber.user_id] == 0:
+            del members[subscriber.user_id]
+            events.append({'name': 'member_removed', 'channel': channel_name, 'user_id': subscriber.user_id})
+
+        if not self.subscribers[channel_name]:
+            del self.subscribers[channel_name]
+            del self.members[channel_name]
+            events.append({'name': 'channel_vacated', 'channel': channel_name})
+
+        return events
+
+    def publish(self, channel_name, event, data):
+        for subscriber in list(self.subscribers.get(channel_name, ())):
+            # Drop clients which do not keep up, the buffer would grow without bound
+            if subscriber.writer.transport.get_write_buffer_size() > config.REALTIME_GATEWAY_MAX_BUFFER:
+                subscriber.writer.close()
+                continue
+
+            subscriber.send(event, data)
+
+    def _announce(self, events):
+        for event in events:
+            if event['name'] in ('member_added', 'member_removed'):
+                self.publish(event['channel'], 'pusher_internal:' + event['name'], {'user_id': event['user_id']})
+
+        if events:
+            delivery_id = '{}-{}'.format(self.started, next(self.deliveries))
+            self.loop.run_in_executor(None, presence.enqueue, delivery_id, events)
+
+    async def handle(self, reader, writer):
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+        subscriber = parse_subscription(request_line, writer)
+        if subscriber is None:
+            writer.write(_FORBIDDEN)
+            writer.close()
+            return
+
+        writer.write(_SSE_HEADERS)
+        events = self.join(subscriber)
+        subscriber.send('pusher_internal:subscription_succeeded', {
+            'presence': {'ids': list(self.members[subscriber.channel_name])}
+        })
+        self._announce(events)
+
+        try:
+            # Clients do not send anything after subscribing, reading returns once they are gone
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self._announce(self.leave(subscriber))
+            writer.close()
+
+    def _listen(self, pubsub):
+        """Forward Redis messages to subscribers, in a thread as redis-py blocks"""
+        prefix_length = len(realtime.pubsub_channel(''))
+        for message in pubsub.listen():
+            channel_name = message['channel'].decode('utf-8')[prefix_length:]
+            payload = json.loads(message['data'].decode('utf-8'))
+            self.loop.call_soon_threadsafe(self.publish, channel_name, payload['event'], payload['data'])
+
+    def run(self, host, port):
+        """Serve until the process is stopped"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(realtime.pubsub_channel('*'))
+        threading.Thread(target=self._listen, args=(pubsub,), daemon=True).start()
+
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, host, port))
+        self.ready.set()
+        self.loop.run_forever()
+
@@ -0,0 +1,59 @@
+from main import db, redis
+from main.cfg import config
+from main.models.room_participant import RoomParticipant
+from main.libs import barrier, replica
+from main.enums import ParticipantStatus
+
+# Cached for users who are not participants of the room
+_NOT_MEMBER = ''
+
+
+def _members_key(room_id):
+    """Hash of user id -> participant status of a room"""
+    return '{}-room-members:{}'.format(config.REDIS_PREFIX, room_id)
+
+
+def get_status(room_id, user_id):
+    """
+    Participant status of a user in a room, loaded from database on cache miss
+    :return: ParticipantStatus or None if user is not a participant
+    """
+    status = redis.hget(_members_key(room_id), user_id)
+    if status is not None:
+        return status.decode('utf-8') or None
+
+    # Cached for everyone, a lagging replica must not be read
+    with replica.primary():
+        participant = db.session.query(RoomParticipant.status) \
+            .filter(RoomParticipant.room_id == room_id) \
+            .filter(RoomParticipant.user_id == user_id) \
+            .one_or_none()
+    status = participant.status if participant else None
+
+    # Do not override a status which has been set since database was read
+    pipe = redis.pipeline()
+    pipe.hsetnx(_members_key(room_id), user_id, status or _NOT_MEMBER)
+    pipe.expire(_members_key(room_id), config.MEMBERSHIP_TTL)
+    pipe.execute()
+
+    return status
+
+
+def is_online(room_id, user_id):
+    return get_status(room_id, user_id) == ParticipantStatus.IN
+
+
+def is_member(room_id, user_id):
+    """Whether user can access the room, online or not"""
+    status = get_status(room_id, user_id)
+    return status is not None and status != ParticipantStatus.DELETED
+
+
+def set_status(room_id, user_id, status):
+    """Called after a participant status change is committed"""
+    pipe = redis.pipeline()
+    pipe.hset(_members_key(room_id), user_id, status)
+    pipe.expire(_members_key(room_id), config.MEMBERSHIP_TTL)
+    pipe.execute()
+
+    barrier.on_membership_changed(room_id, user_id)
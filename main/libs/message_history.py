@@ -0,0 +1,38 @@
+from sqlalchemy import desc
+from sqlalchemy.orm import joinedload
+
+from main.models.message import Message
+from main.cfg import config
+
+
+def get_message_page(room_id, before_id=None, after_id=None, limit=None):
+    """
+    Keyset-paginated message history of a room
+    :param before_id: return messages older than this id
+    :param after_id: return messages newer than this id
+    :param limit: page size, newest page is returned if no cursor is given
+    :return: (messages in ascending id order, whether more messages exist in that direction)
+    """
+    if limit is None:
+        limit = config.MESSAGE_PAGE_SIZE
+
+    query = Message.query \
+        .options(joinedload(Message.user)) \
+        .filter(Message.room_id == room_id)
+
+    if after_id is not None:
+        query = query.filter(Message.id > after_id).order_by(Message.id)
+    else:
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        query = query.order_by(desc(Message.id))
+
+    # Fetch one extra row to know whether another page exists
+    messages = query.limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    if after_id is None:
+        messages.reverse()
+
+    return messages, has_more
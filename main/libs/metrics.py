@@ -0,0 +1,211 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from main import redis
+from main.cfg import config
+
+_lock = threading.Lock()
+# Changes of counters not written to Redis yet, by name
+_pending = defaultdict(float)
+_last_flush = time.time()
+# Process of the thread flushing counters, uWSGI forks workers after loading the app
+_flusher_pid = None
+
+_gauges_lock = threading.Lock()
+# Parts of gauges kept by this process, by name
+_process_gauges = defaultdict(float)
+
+
+def _metrics_key():
+    """Hash of counters shared by all processes"""
+    return '{}-metrics'.format(config.REDIS_PREFIX)
+
+
+def _gauges_key():
+    """Hash of gauges shared by all processes"""
+    return '{}-metrics-gauges'.format(config.REDIS_PREFIX)
+
+
+def _process_gauges_key(process):
+    """Hash of the parts of gauges kept by a process, expiring if the process dies"""
+    return '{}-metrics-gauges:{}'.format(config.REDIS_PREFIX, process)
+
+
+def _current_process():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def metric_name(name, **labels):
+    """Prometheus style name, e.g. user_cache_requests_total{result="hit",tier="local"}"""
+    if not labels:
+        return name
+
+    label_str = ','.join('{}="{}"'.format(key, labels[key]) for key in sorted(labels))
+    return '{}{{{}}}'.format(name, label_str)
+
+
+def _start_flusher():
+    """Flush counters of idle processes too, every METRICS_FLUSH_INTERVAL seconds"""
+    global _flusher_pid
+
+    def run():
+        while True:
+            time.sleep(config.METRICS_FLUSH_INTERVAL)
+            try:
+                flush()
+            except Exception:
+                logging.exception('Failed to flush metrics')
+
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=run, daemon=True).start()
+
+
+def incr(name, amount=1, **labels):
+    """
+    Increase a counter. Counters are kept in process and added to the shared
+    counters in Redis every METRICS_FLUSH_INTERVAL seconds
+    """
+    global _last_flush
+
+    _start_flusher()
+    with _lock:
+        _pending[metric_name(name, **labels)] += amount
+        if time.time() - _last_flush < config.METRICS_FLUSH_INTERVAL:
+            return
+
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.time()
+
+    _write(pending)
+
+
+def observe(name, value, buckets=None, **labels):
+    """
+    Record a value in a histogram, kept as Prometheus style counters:
+    name_bucket{le="..."} per bucket, name_sum and name_count
+    :param buckets: upper bounds in ascending order, METRICS_LATENCY_BUCKETS by default
+    """
+    for bound in buckets or config.METRICS_LATENCY_BUCKETS:
+        if value <= bound:
+            incr(name + '_bucket', le=bound, **labels)
+    incr(name + '_bucket', le='+Inf', **labels)
+    incr(name + '_sum', value, **labels)
+    incr(name + '_count', **labels)
+
+
+def add_gauge(name, amount, **labels):
+    """
+    Add to the part of a gauge kept by this process, e.g. requests in progress.
+    Parts are written at once and expire after METRICS_PROCESS_TTL seconds unless refreshed,
+    so that those of killed processes go away. Gauges are the sum of the parts
+    """
+    _start_flusher()
+    with _gauges_lock:
+        _process_gauges[metric_name(name, **labels)] += amount
+        # Written under the lock, so that an older value never overwrites a newer one
+        _write_process_gauges()
+
+
+def _write_process_gauges():
+    if not _process_gauges:
+        return
+
+    key = _process_gauges_key(_current_process())
+    pipe = redis.pipeline(transaction=False)
+    pipe.hmset(key, dict(_process_gauges))
+    pipe.expire(key, config.METRICS_PROCESS_TTL)
+    pipe.execute()
+
+
+def _write(pending):
+    if not pending:
+        return
+
+    pipe = redis.pipeline(transaction=False)
+    for name, value in pending.items():
+        pipe.hincrbyfloat(_metrics_key(), name, value)
+    pipe.execute()
+
+
+@atexit.register
+def flush():
+    """Write pending counters, and refresh the gauges of this process"""
+    global _last_flush
+
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.time()
+
+    _write(pending)
+    with _gauges_lock:
+        _write_process_gauges()
+
+
+def get_counters(prefix=''):
+    """Counters aggregated across processes"""
+    flush()
+    counters = redis.hgetall(_metrics_key())
+    return {
+        name.decode('utf-8'): float(value)
+        for name, value in counters.items()
+        if name.decode('utf-8').startswith(prefix)
+    }
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge, written to Redis at once as gauges change rarely"""
+    redis.hset(_gauges_key(), metric_name(name, **labels), value)
+
+
+def get_gauges(prefix=''):
+    """Gauges set by any process, and the sum of the parts kept by each process"""
+    flush()
+    gauges = defaultdict(float)
+    for name, value in redis.hgetall(_gauges_key()).items():
+        gauges[name.decode('utf-8')] = float(value)
+    for key in redis.scan_iter(match=_process_gauges_key('*')):
+        for name, value in redis.hgetall(key).items():
+            gauges[name.decode('utf-8')] += float(value)
+
+    return {name: value for name, value in gauges.items() if name.startswith(prefix)}
+
+
+def _family(name, histograms):
+    """Metric a series belongs to, histogram series being named after it with a suffix"""
+    base = name.split('{')[0]
+    for suffix in ('_bucket', '_sum', '_count'):
+        if base.endswith(suffix) and base[:-len(suffix)] in histograms:
+            return base[:-len(suffix)]
+    return base
+
+
+def render():
+    """All metrics in the Prometheus text format"""
+    counters = get_counters()
+    gauges = get_gauges()
+    histograms = {name.split('{')[0][:-len('_bucket')] for name in counters
+                  if name.split('{')[0].endswith('_bucket') and 'le="' in name}
+
+    families = defaultdict(list)
+    types = {}
+    for series, kind in [(counters, 'counter'), (gauges, 'gauge')]:
+        for name, value in series.items():
+            family = _family(name, histograms)
+            families[family].append((name, value))
+            types[family] = 'histogram' if family in histograms else kind
+
+    lines = []
+    for family in sorted(families):
+        lines.append('# TYPE {} {}'.format(family, types[family]))
+        lines.extend('{} {}'.format(name, repr(value)) for name, value in sorted(families[family]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,130 @@
+import calendar
+import json
+import os
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from main import db, redis
+from main.cfg import config
+from main.models.outbox_event import OutboxEvent
+from main.libs.tasks import celery_app
+from main.libs import pusher, dispatch, room_events
+from main.enums import PusherEvent, TaskQueue
+
+# Playback sync events, relayed on their own so that they never wait behind chat, votes or participants
+CRITICAL_EVENTS = {PusherEvent.PROCEED, PusherEvent.VIDEO_STATUS_CHANGED}
+
+
+def add(room_id, event, data={}):
+    """
+    Record a realtime event in the current transaction.
+    It is sent once the transaction is committed, and never if it is rolled back.
+    """
+    pusher.count_event(room_id)
+    db.session.add(OutboxEvent(room_id=room_id, name=event, data=json.dumps(data)))
+    db.session.info.setdefault('outbox_pending', set()).add(event in CRITICAL_EVENTS)
+
+
+def _relay_key(critical):
+    """Set while a relay of critical or other events is scheduled or running"""
+    return '{}-outbox-relay:{}'.format(config.REDIS_PREFIX, 'critical' if critical else 'bulk')
+
+
+def _filter(critical):
+    names = OutboxEvent.__table__.c.name.in_(CRITICAL_EVENTS)
+    return names if critical else ~names
+
+
+def relay(critical=False):
+    """
+    Send committed events in order, grouped in batch calls per channel
+    :param critical: relay playback events, or all other events
+    :return: number of sent events
+    """
+    bind = db.session.get_bind()
+    table = OutboxEvent.__table__
+    count = 0
+
+    while True:
+        rows = bind.execute(
+            table.select().where(_filter(critical)).order_by(table.c.id).limit(config.OUTBOX_RELAY_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            return count
+
+        events_by_room = OrderedDict()
+        for row in rows:
+            events_by_room.setdefault(row.room_id, []).append({
+                'name': row.name,
+                'data': json.loads(row.data),
+                'queued_at': calendar.timegm(row.created.timetuple())
+            })
+
+        for room_id, events in events_by_room.items():
+            room_events.append(room_id, events)
+            pusher.send_batch(pusher.create_channel_name(room_id), events)
+
+        # Sent rows only, transactions committing lower ids meanwhile are relayed next round
+        bind.execute(table.delete().where(table.c.id.in_([row.id for row in rows])))
+        count += len(rows)
+
+        if len(rows) < config.OUTBOX_RELAY_BATCH_SIZE:
+            return count
+
+
+def _schedule_relay(critical=False):
+    if os.getenv('FLASK_ENV') == 'test':
+        return relay(critical)
+
+    if not redis.set(_relay_key(critical), 1, ex=config.OUTBOX_RELAY_TIMEOUT, nx=True):
+        return
+
+    if critical:
+        # Sent at once, on workers not busy with other events
+        dispatch.apply_async(_relay_critical_outbox, queue=TaskQueue.REALTIME_CRITICAL)
+    else:
+        dispatch.apply_async(_relay_outbox, countdown=config.PUSHER_BATCH_WINDOW)
+
+
+def _relay_and_reschedule(critical):
+    try:
+        relay(critical)
+    finally:
+        redis.delete(_relay_key(critical))
+
+    try:
+        # Events committed while relaying did not schedule a relay of their own
+        query = select([OutboxEvent.id]).where(_filter(critical)).limit(1)
+        if db.session.get_bind().execute(query).first() is not None:
+            _schedule_relay(critical)
+    finally:
+        db.session.remove()
+
+
+@celery_app.task
+def _relay_critical_outbox():
+    _relay_and_reschedule(critical=True)
+
+
+@celery_app.task
+def _relay_outbox():
+    _relay_and_reschedule(critical=False)
+
+
+@event.listens_for(Session, 'after_commit')
+def _relay_committed_events(session):
+    # Releasing a savepoint commits nothing yet
+    if session.transaction.nested:
+        return
+
+    # Critical events first, their relay is not delayed by a batch window
+    for critical in sorted(session.info.pop('outbox_pending', ()), reverse=True):
+        _schedule_relay(critical)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_events(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('outbox_pending', None)
@@ -0,0 +1,213 @@
+import datetime
+import os
+import time
+
+from main import db, redis
+from main.cfg import config
+from main.models.room import Room
+from main.models.video import Video
+from main.schemas.video import VideoSchema
+from main.libs.tasks import celery_app
+from main.libs import replica
+from main.enums import VideoStatus
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _state_key(room_id):
+    return '{}-playback:{}'.format(config.REDIS_PREFIX, room_id)
+
+
+def _dirty_key(room_id):
+    """Set while a write-behind of the room state is scheduled"""
+    return '{}-playback-dirty:{}'.format(config.REDIS_PREFIX, room_id)
+
+
+class PlaybackState:
+    """
+    Current video of a room. Video position is kept as an anchor: the video time
+    at a wall-clock timestamp, from which the current position is computed
+    """
+    def __init__(self, room_id, video_id=None, url=None, creator_id=None, total_vote=None,
+                 status=VideoStatus.PAUSING, anchor_time=0, anchored_at=None):
+        self.room_id = room_id
+        self.video_id = video_id
+        self.url = url
+        self.creator_id = creator_id
+        self.total_vote = total_vote
+        self.status = status
+        self.anchor_time = anchor_time
+        self.anchored_at = anchored_at if anchored_at is not None else time.time()
+
+    @property
+    def id(self):
+        return self.video_id
+
+    @property
+    def video_time(self):
+        if self.status == VideoStatus.PAUSING:
+            return self.anchor_time
+
+        return self.anchor_time + (time.time() - self.anchored_at)
+
+    def to_redis(self):
+        return {
+            'video_id': self.video_id or '',
+            'url': self.url or '',
+            'creator_id': self.creator_id or '',
+            'total_vote': self.total_vote or 0,
+            'status': self.status or '',
+            'anchor_time': self.anchor_time,
+            'anchored_at': self.anchored_at
+        }
+
+    @classmethod
+    def from_redis(cls, room_id, data):
+        data = {key.decode('utf-8'): value.decode('utf-8') for key, value in data.items()}
+        return cls(room_id,
+                   video_id=int(data['video_id']) if data['video_id'] else None,
+                   url=data['url'] or None,
+                   creator_id=int(data['creator_id']) if data['creator_id'] else None,
+                   total_vote=int(data['total_vote']),
+                   status=data['status'] or None,
+                   anchor_time=float(data['anchor_time']),
+                   anchored_at=float(data['anchored_at']))
+
+
+def _load_state(room_id):
+    """Read room state from database, None if the room does not exist"""
+    room = Room.query.filter(Room.id == room_id).one_or_none()
+    if room is None:
+        return None
+
+    anchored_at = room.video_time_updated or room.updated
+    state = PlaybackState(room_id,
+                          status=room.status,
+                          anchor_time=room.video_time or 0,
+                          anchored_at=(anchored_at - _EPOCH).total_seconds())
+
+    if room.current_video is not None:
+        video = Video.query.filter(Video.id == room.current_video).one()
+        state.video_id = video.id
+        state.url = video.url
+        state.creator_id = video.creator_id
+        state.total_vote = video.total_vote
+
+    return state
+
+
+def get_state(room_id):
+    """Playback state of a room, loaded from database on cache miss"""
+    data = redis.hgetall(_state_key(room_id))
+    if data:
+        return PlaybackState.from_redis(room_id, data)
+
+    # Cached for everyone, a lagging replica must not be read
+    with replica.primary():
+        state = _load_state(room_id)
+    if state is not None:
+        redis.hmset(_state_key(room_id), state.to_redis())
+
+    return state
+
+
+def _save_state(state):
+    redis.hmset(_state_key(state.room_id), state.to_redis())
+    _schedule_persist(state.room_id)
+    return state
+
+
+def set_video(room_id, video=None, status=VideoStatus.PAUSING, video_time=0):
+    """Change current video of a room"""
+    state = PlaybackState(room_id, status=status, anchor_time=video_time)
+    if video is not None:
+        state.video_id = video.id
+        state.url = video.url
+        state.creator_id = video.creator_id
+        state.total_vote = video.total_vote
+
+    return _save_state(state)
+
+
+def update(room_id, status=None, video_time=None):
+    """
+    Change status and/or position of current video.
+    Position stays where it is now if video_time is not given
+    """
+    state = get_state(room_id)
+    state.anchor_time = video_time if video_time is not None else state.video_time
+    state.anchored_at = time.time()
+    if status is not None:
+        state.status = status
+
+    return _save_state(state)
+
+
+def _compact_event(state, **fields):
+    """Video, status and position anchor of a room, from which clients compute the position"""
+    return dict(fields,
+                v=2,
+                video_id=state.video_id,
+                status=state.status,
+                anchor_time=state.anchor_time,
+                anchored_at=state.anchored_at)
+
+
+def status_event(state, event):
+    """
+    Data of a video status changed event, built from playback state without database reads.
+    Format 2 only carries what clients need to sync, format 1 is the full video
+    """
+    if config.PLAYBACK_EVENT_VERSION == 1:
+        return {
+            'event': event,
+            'data': VideoSchema().dump(state).data
+        }
+
+    return _compact_event(state, event=event)
+
+
+def proceed_event(state):
+    """Data of a proceed event, state is None when there is no next video"""
+    if config.PLAYBACK_EVENT_VERSION == 1:
+        return VideoSchema().dump(state).data if state is not None else {}
+
+    if state is None:
+        return {'v': 2, 'video_id': None}
+
+    return _compact_event(state, url=state.url)
+
+
+def persist_state(room_id):
+    """Write cached room state back to database"""
+    data = redis.hgetall(_state_key(room_id))
+    if not data:
+        return
+
+    state = PlaybackState.from_redis(room_id, data)
+    Room.query.filter(Room.id == room_id).update({
+        Room.current_video: state.video_id,
+        Room.status: state.status,
+        Room.video_time: state.anchor_time,
+        Room.video_time_updated: datetime.datetime.utcfromtimestamp(state.anchored_at)
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+@celery_app.task
+def _persist_state(room_id):
+    # Later changes schedule another write-behind
+    redis.delete(_dirty_key(room_id))
+    try:
+        persist_state(room_id)
+    finally:
+        db.session.remove()
+
+
+def _schedule_persist(room_id):
+    if os.getenv('FLASK_ENV') == 'test':
+        return persist_state(room_id)
+
+    # Changes within the delay are written together
+    if redis.set(_dirty_key(room_id), 1, ex=config.PLAYBACK_PERSIST_DELAY * 10, nx=True):
+        _persist_state.apply_async((room_id,), countdown=config.PLAYBACK_PERSIST_DELAY)
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from sqlalchemy import and_, case, tuple_
+
+from main import db, redis
+from main.cfg import config
+from main.models.room_participant import RoomParticipant
+from main.models.user import User
+from main.libs.tasks import celery_app
+from main.libs.pusher import parse_channel_name
+from main.libs import playback, membership, outbox
+from main.enums import VideoStatus, ParticipantStatus, PusherEvent
+
+_MEMBER_STATUSES = {
+    'member_added': ParticipantStatus.IN,
+    'member_removed': ParticipantStatus.OUT
+}
+
+_STATUS_EVENTS = {
+    ParticipantStatus.IN: PusherEvent.NEW_PARTICIPANT,
+    ParticipantStatus.OUT: PusherEvent.EXIT_PARTICIPANT
+}
+
+
+def _queue_key():
+    """Presence events waiting to be applied, in order"""
+    return '{}-presence-events'.format(config.REDIS_PREFIX)
+
+
+def _process_key():
+    """Set while processing of queued events is scheduled or running"""
+    return '{}-presence-process'.format(config.REDIS_PREFIX)
+
+
+def _attempts_key():
+    """Failed attempts to apply the batch at the head of the queue"""
+    return '{}-presence-attempts'.format(config.REDIS_PREFIX)
+
+
+def _delivery_key(delivery_id, index, event):
+    """Set once an event is queued, webhooks retried by Pusher carry the same events and time"""
+    return '{}-presence-delivery:{}:{}:{}:{}:{}'.format(config.REDIS_PREFIX, delivery_id, index, event['name'],
+                                                        event['channel'], event.get('user_id', ''))
+
+
+def enqueue(delivery_id, events):
+    """
+    Queue presence events from Pusher webhooks or from the realtime gateway
+    :param delivery_id: unique per delivery, time_ms of Pusher webhooks
+    """
+    pipe = redis.pipeline()
+    for index, event in enumerate(events):
+        pipe.set(_delivery_key(delivery_id, index, event), 1, ex=config.PRESENCE_DEDUPE_TTL, nx=True)
+    is_new = pipe.execute()
+
+    new_events = [json.dumps(event) for event, new in zip(events, is_new) if new]
+    if not new_events:
+        return
+
+    redis.rpush(_queue_key(), *new_events)
+    _schedule_processing()
+
+
+def _schedule_processing():
+    if os.getenv('FLASK_ENV') == 'test':
+        return process_queued_events()
+
+    if redis.set(_process_key(), 1, ex=config.PRESENCE_PROCESS_TIMEOUT, nx=True):
+        _process_queued_events.apply_async(countdown=config.PRESENCE_BATCH_WINDOW)
+
+
+def process_queued_events():
+    """Apply a batch of queued events, which stays at the head of the queue until it is applied"""
+    events = redis.lrange(_queue_key(), 0, config.PRESENCE_BATCH_SIZE - 1)
+    try:
+        apply_events([json.loads(event.decode('utf-8')) for event in events])
+    except Exception:
+        # Webhooks are acknowledged already, Pusher does not send them again
+        if redis.incr(_attempts_key()) < config.PRESENCE_MAX_ATTEMPTS:
+            raise
+        logging.exception('Dropping {} presence events after {} attempts'.format(len(events),
+                                                                                config.PRESENCE_MAX_ATTEMPTS))
+
+    # Only one processing runs at a time, and new events are pushed to the tail
+    pipe = redis.pipeline()
+    pipe.ltrim(_queue_key(), len(events), -1)
+    pipe.delete(_attempts_key())
+    pipe.execute()
+
+
+def apply_events(events):
+    """Apply presence events in order, only the last member event of a user in a room counts"""
+    statuses = OrderedDict()
+    vacated_room_ids = set()
+    for event in events:
+        room_id = parse_channel_name(event['channel'])
+        if room_id is None:
+            continue
+
+        room_id = int(room_id)
+        if event['name'] == 'channel_vacated':
+            vacated_room_ids.add(room_id)
+        elif event['name'] in _MEMBER_STATUSES:
+            statuses[(room_id, int(event['user_id']))] = _MEMBER_STATUSES[event['name']]
+            if event['name'] == 'member_added':
+                vacated_room_ids.discard(room_id)
+
+    for room_id in vacated_room_ids:
+        state = playback.get_state(room_id)
+        if state is not None and state.status == VideoStatus.PLAYING:
+            # Freeze video at its current position
+            playback.update(room_id, status=VideoStatus.PAUSING)
+
+    if statuses:
+        _apply_member_statuses(statuses)
+
+
+def _apply_member_statuses(statuses):
+    """
+    Update participants of a batch with one query
+    :param statuses: dict of (room id, user id) -> ParticipantStatus
+    """
+    participants = db.session.query(RoomParticipant.room_id, RoomParticipant.user_id, RoomParticipant.status,
+                                    User.name, User.email) \
+        .join(User, User.id == RoomParticipant.user_id) \
+        .filter(tuple_(RoomParticipant.room_id, RoomParticipant.user_id).in_(list(statuses))) \
+        .all()
+
+    changed = [(participant, statuses[(participant.room_id, participant.user_id)]) for participant in participants
+               if participant.status not in (ParticipantStatus.DELETED,
+                                             statuses[(participant.room_id, participant.user_id)])]
+    if not changed:
+        return
+
+    new_status = case([
+        (and_(RoomParticipant.room_id == participant.room_id, RoomParticipant.user_id == participant.user_id), status)
+        for participant, status in changed
+    ])
+    db.session.query(RoomParticipant) \
+        .filter(tuple_(RoomParticipant.room_id, RoomParticipant.user_id)
+                .in_([(participant.room_id, participant.user_id) for participant, _ in changed])) \
+        .filter(RoomParticipant.status != ParticipantStatus.DELETED) \
+        .update({RoomParticipant.status: new_status}, synchronize_session=False)
+
+    for participant, status in changed:
+        outbox.add(participant.room_id, _STATUS_EVENTS[status], {
+            'user_id': participant.user_id,
+            'name': participant.name,
+            'email': participant.email
+        })
+    db.session.commit()
+
+    for participant, status in changed:
+        membership.set_status(participant.room_id, participant.user_id, status)
+
+
+@celery_app.task
+def _process_queued_events():
+    try:
+        process_queued_events()
+    except Exception:
+        logging.exception('Failed to apply presence events')
+    finally:
+        redis.delete(_process_key())
+        db.session.remove()
+
+    # Events queued while processing, beyond the batch size, or of a failed batch
+    if redis.llen(_queue_key()):
+        _schedule_processing()
@@ -1,9 +1,14 @@
+import json
 import logging
 import os
+import time
+from collections import OrderedDict
 
-from main import pusher_client
+from main import pusher_client, redis
 from main.libs.tasks import celery_app
+from main.libs import metrics, realtime, dispatch, room_events
 from main.cfg import config
+from main.enums import PusherEvent, CircuitState
 
 
 def create_channel_name(room_id):
@@ -23,13 +28,7 @@ def parse_channel_name(channel_name):
 
 def authenticate(request, account):
     try:
-        auth = pusher_client.authenticate(
-            channel=request.form['channel_name'],
-            socket_id=request.form['socket_id'],
-            custom_data={
-                'user_id': account.id
-            }
-        )
+        auth = realtime.get_backend().authenticate(request.form['channel_name'], request.form['socket_id'], account.id)
     except Exception:
         logging.exception('Pusher authentication exception')
         return None
@@ -37,19 +36,268 @@ def authenticate(request, account):
     return auth
 
 
+# Not worth retrying, newer events carry newer counts
+LOW_PRIORITY_EVENTS = {PusherEvent.UP_VOTE, PusherEvent.DOWN_VOTE, PusherEvent.VOTE_TOTALS}
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker shared by all processes through Redis.
+    It opens after PUSHER_BREAKER_FAILURES consecutive failures and rejects calls for
+    PUSHER_BREAKER_RESET_TIMEOUT seconds. Then one probe call is let through, which closes
+    the circuit if it succeeds or opens it again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def _key(self, suffix):
+        return '{}-circuit:{}:{}'.format(config.REDIS_PREFIX, self.name, suffix)
+
+    def get_state(self):
+        is_open, is_tripped = redis.mget([self._key('open'), self._key('tripped')])
+        if is_open:
+            return CircuitState.OPEN
+        if is_tripped:
+            return CircuitState.HALF_OPEN
+        return CircuitState.CLOSED
+
+    def allow(self):
+        state = self.get_state()
+        if state == CircuitState.HALF_OPEN:
+            # Only one caller probes
+            return bool(redis.set(self._key('probe'), 1, ex=config.PUSHER_TIMEOUT * 2, nx=True))
+
+        return state == CircuitState.CLOSED
+
+    def record_success(self):
+        pipe = redis.pipeline()
+        pipe.delete(self._key('failures'))
+        pipe.delete(self._key('tripped'))
+        pipe.delete(self._key('probe'))
+        _, was_tripped, _ = pipe.execute()
+
+        if was_tripped:
+            metrics.set_gauge('circuit_state', CircuitState.CLOSED, circuit=self.name)
+
+    def record_failure(self):
+        pipe = redis.pipeline()
+        pipe.incr(self._key('failures'))
+        pipe.expire(self._key('failures'), config.PUSHER_BREAKER_RESET_TIMEOUT)
+        pipe.get(self._key('tripped'))
+        failures, _, is_tripped = pipe.execute()
+
+        if is_tripped or failures >= config.PUSHER_BREAKER_FAILURES:
+            self.open()
+
+    def open(self):
+        pipe = redis.pipeline()
+        pipe.set(self._key('open'), 1, ex=config.PUSHER_BREAKER_RESET_TIMEOUT)
+        pipe.set(self._key('tripped'), 1)
+        pipe.delete(self._key('probe'))
+        pipe.delete(self._key('failures'))
+        pipe.execute()
+
+        metrics.incr('circuit_opened_total', circuit=self.name)
+        metrics.set_gauge('circuit_state', CircuitState.OPEN, circuit=self.name)
+
+
+breaker = CircuitBreaker('pusher')
+
+
+def _retry_key():
+    """Events which could not be sent, oldest first"""
+    return '{}-pusher-retry'.format(config.REDIS_PREFIX)
+
+
+def _retry_flag_key():
+    """Set while a retry is scheduled or running"""
+    return '{}-pusher-retry-scheduled'.format(config.REDIS_PREFIX)
+
+
+def _defer(channel_name, events):
+    """Queue events for a retry, low priority ones are dropped"""
+    retried = []
+    for event in events:
+        if event['name'] in LOW_PRIORITY_EVENTS:
+            metrics.incr('pusher_events_shed_total', event=event['name'])
+        else:
+            retried.append(json.dumps({'channel': channel_name, 'event': event}))
+
+    if not retried:
+        return
+
+    pipe = redis.pipeline()
+    pipe.rpush(_retry_key(), *retried)
+    pipe.ltrim(_retry_key(), -config.PUSHER_RETRY_QUEUE_SIZE, -1)
+    length, _ = pipe.execute()
+
+    metrics.incr('pusher_events_deferred_total', len(retried))
+    if length > config.PUSHER_RETRY_QUEUE_SIZE:
+        metrics.incr('pusher_retry_queue_dropped_total', length - config.PUSHER_RETRY_QUEUE_SIZE)
+
+    _schedule_retry()
+
+
+def _schedule_retry():
+    # Tests retry explicitly
+    if os.getenv('FLASK_ENV') == 'test':
+        return
+
+    if redis.set(_retry_flag_key(), 1, ex=config.PUSHER_FLUSH_TIMEOUT, nx=True):
+        dispatch.apply_async(_retry_events, countdown=config.PUSHER_RETRY_DELAY)
+
+
+def retry_events():
+    """Send deferred events which are not too old, grouped per channel"""
+    pipe = redis.pipeline()
+    pipe.lrange(_retry_key(), 0, config.PUSHER_RETRY_QUEUE_SIZE - 1)
+    pipe.ltrim(_retry_key(), config.PUSHER_RETRY_QUEUE_SIZE, -1)
+    entries, _ = pipe.execute()
+
+    now = time.time()
+    events = OrderedDict()
+    for entry in entries:
+        entry = json.loads(entry.decode('utf-8'))
+        if now - entry['event']['queued_at'] > config.PUSHER_RETRY_MAX_AGE:
+            metrics.incr('pusher_events_expired_total', event=entry['event']['name'])
+            continue
+        events.setdefault(entry['channel'], []).append(entry['event'])
+
+    for channel_name, channel_events in events.items():
+        send_batch(channel_name, channel_events)
+
+
 @celery_app.task
-def _trigger_pusher(channel_name, event, data):
+def _retry_events():
     try:
-        pusher_client.trigger(channel_name, event, data)
+        retry_events()
+    finally:
+        redis.delete(_retry_flag_key())
+
+    if redis.llen(_retry_key()):
+        _schedule_retry()
+
+
+def _deliver(channel_name, events, send):
+    """
+    Send events through the circuit breaker, deferring them if it is open or sending fails
+    :param send: function sending the events
+    :return: True if events are sent
+    """
+    if not breaker.allow():
+        _defer(channel_name, events)
+        return False
+
+    started_at = time.perf_counter()
+    try:
+        send()
     except Exception:
         logging.exception('Pusher exception occurs')
+        metrics.observe('pusher_request_duration_seconds', time.perf_counter() - started_at, result='failure')
+        metrics.incr('pusher_send_failures_total')
+        breaker.record_failure()
+        _defer(channel_name, events)
+        return False
+
+    metrics.observe('pusher_request_duration_seconds', time.perf_counter() - started_at, result='success')
+    breaker.record_success()
+    return True
+
+
+@celery_app.task
+def _trigger_pusher(channel_name, event, data):
+    _deliver(channel_name, [{'name': event, 'data': data, 'queued_at': time.time()}],
+             lambda: realtime.get_backend().trigger(channel_name, event, data))
+
+
+def _buffer_key(channel_name):
+    """Events of a channel waiting to be sent, in order"""
+    return '{}-pusher-buffer:{}'.format(config.REDIS_PREFIX, channel_name)
+
+
+def _flush_key(channel_name):
+    """Set while a flush of the channel is scheduled or running"""
+    return '{}-pusher-flush:{}'.format(config.REDIS_PREFIX, channel_name)
+
+
+def _schedule_flush(channel_name):
+    # Only one flush per channel at a time, so that events are sent in order
+    if redis.set(_flush_key(channel_name), 1, ex=config.PUSHER_FLUSH_TIMEOUT, nx=True):
+        dispatch.apply_async(_flush_channel, (channel_name,), countdown=config.PUSHER_BATCH_WINDOW)
+
+
+def send_batch(channel_name, events):
+    """
+    Send events of a channel with as few batch calls as possible
+    :param events: list of dict with name, data and queued_at
+    """
+    now = time.time()
+    for i in range(0, len(events), config.PUSHER_BATCH_SIZE):
+        batch = events[i:i + config.PUSHER_BATCH_SIZE]
+        if not _deliver(channel_name, batch, lambda: realtime.get_backend().trigger_batch(channel_name, batch)):
+            continue
+
+        metrics.incr('pusher_batches_total')
+        metrics.incr('pusher_batched_events_total', len(batch))
+        metrics.incr('pusher_calls_saved_total', len(batch) - 1)
+
+    metrics.incr('pusher_queue_delay_seconds_total', sum(now - event['queued_at'] for event in events))
+
+
+@celery_app.task
+def _flush_channel(channel_name):
+    pipe = redis.pipeline()
+    pipe.lrange(_buffer_key(channel_name), 0, -1)
+    pipe.delete(_buffer_key(channel_name))
+    events, _ = pipe.execute()
+
+    try:
+        send_batch(channel_name, [json.loads(event.decode('utf-8')) for event in events])
+    finally:
+        redis.delete(_flush_key(channel_name))
+
+    # Events buffered while sending did not schedule a flush of their own
+    if redis.llen(_buffer_key(channel_name)):
+        _schedule_flush(channel_name)
+
+
+def _event_rate_key(room_id, second):
+    return '{}-room-event-rate:{}:{}'.format(config.REDIS_PREFIX, room_id, second)
+
+
+def count_event(room_id):
+    """Count an event towards the event rate of its room"""
+    key = _event_rate_key(room_id, int(time.time()))
+    pipe = redis.pipeline()
+    pipe.incr(key)
+    pipe.expire(key, 2)
+    pipe.execute()
+
+
+def get_event_rate(room_id):
+    """Events per second triggered in a room, over the current or the last second"""
+    second = int(time.time())
+    counts = redis.mget([_event_rate_key(room_id, second), _event_rate_key(room_id, second - 1)])
+    return max(int(count or 0) for count in counts)
 
 
 def trigger(room_id, event, data={}):
+    count_event(room_id)
+    events = [{'name': event, 'data': data}]
+    room_events.append(room_id, events)
+    data = events[0]['data']
+
     if os.getenv('FLASK_ENV') == 'test':
         return _trigger_pusher(create_channel_name(room_id), event, data)
 
-    return _trigger_pusher.delay(create_channel_name(room_id), event, data)
+    if not config.PUSHER_BATCH_WINDOW:
+        return dispatch.apply_async(_trigger_pusher, (create_channel_name(room_id), event, data), droppable=True)
+
+    # Buffer events of a channel for a short window and send them together
+    channel_name = create_channel_name(room_id)
+    redis.rpush(_buffer_key(channel_name), json.dumps({'name': event, 'data': data, 'queued_at': time.time()}))
+    _schedule_flush(channel_name)
 
 
 def read_pusher_webhook(request):
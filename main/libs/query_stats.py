@@ -0,0 +1,101 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from main.cfg import config
+
+# Collectors of the current thread, innermost last
+_local = threading.local()
+
+
+class QueryStats:
+    """Queries run while collecting, statements being counted by their SQL with placeholders"""
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.statements = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    @property
+    def duplicates(self):
+        """Statements run at least QUERY_STATS_DUPLICATE_THRESHOLD times, likely N+1 queries"""
+        return {statement: count for statement, count in self.statements.items()
+                if count >= config.QUERY_STATS_DUPLICATE_THRESHOLD}
+
+    def to_dict(self):
+        return {
+            'queries': self.count,
+            'db_time_ms': round(self.duration * 1000, 2),
+            'duplicates': [{'statement': statement, 'count': count}
+                           for statement, count in self.duplicates.items()]
+        }
+
+
+def _collectors():
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+
+def start():
+    """Collect queries of the current thread until stop()"""
+    stats = QueryStats()
+    _collectors().append(stats)
+    return stats
+
+
+def stop(stats):
+    collectors = _collectors()
+    if stats in collectors:
+        collectors.remove(stats)
+
+
+@contextmanager
+def collect():
+    stats = start()
+    try:
+        yield stats
+    finally:
+        stop(stats)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _collectors():
+        conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info.get('query_started_at')
+    if not started_at:
+        return
+
+    duration = time.perf_counter() - started_at.pop()
+    for stats in _collectors():
+        stats.record(statement, duration)
+
+
+def add_headers(response, stats):
+    """Expose query stats of a request in response headers, for debugging"""
+    response.headers['X-Query-Count'] = stats.count
+    response.headers['X-Query-Time-Ms'] = '{:.2f}'.format(stats.duration * 1000)
+    response.headers['X-Query-Duplicates'] = sum(stats.duplicates.values())
+    return response
+
+
+def log(request, response, stats):
+    """Write query stats of a request as a JSON log line, as a warning if N+1 queries are suspected"""
+    data = dict(stats.to_dict(), method=request.method, path=request.path, status=response.status_code)
+    level = logging.WARNING if data['duplicates'] else logging.INFO
+    logging.log(level, 'request_queries %s', json.dumps(data))
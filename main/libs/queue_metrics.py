@@ -0,0 +1,31 @@
+import time
+
+from redis import Redis
+
+from main.cfg import config
+from main.libs.tasks import celery_app
+from main.libs import metrics
+from main.enums import TaskQueues
+
+# Celery keeps messages of a queue in a Redis list named after it
+_broker = Redis.from_url(config.CELERY_BROKER)
+
+
+def get_queue_depths():
+    pipe = _broker.pipeline(transaction=False)
+    for queue in TaskQueues:
+        pipe.llen(queue)
+    return dict(zip(TaskQueues, pipe.execute()))
+
+
+@celery_app.task
+def report_queue_metrics():
+    """Record queue depths, and send a probe through each queue to measure its latency"""
+    for queue, depth in get_queue_depths().items():
+        metrics.set_gauge('celery_queue_depth', depth, queue=queue)
+        _probe_queue_latency.apply_async((queue, time.time()), queue=queue)
+
+
+@celery_app.task
+def _probe_queue_latency(queue, sent_at):
+    metrics.set_gauge('celery_queue_latency_seconds', time.time() - sent_at, queue=queue)
@@ -1,41 +1,216 @@
+import logging
+import os
+import random
+import threading
+import time
+from functools import wraps
+
 from main.cfg import config
 from main import redis
+from main.errors import Error, StatusCode
+from main.libs import metrics
+from main.libs.user_cache import LocalCache
+
+# Sliding window log: timestamps of the hits within the window, checked and added in one call.
+# KEYS: hits. ARGV: now and window in milliseconds, rate, number of hits, unique prefix for their members,
+# 1 to record hits over the rate too. Returns the number of hits within the rate, and milliseconds
+# before the next hit is allowed if some were not
+_HIT_SCRIPT = redis.register_script("""
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local rate = tonumber(ARGV[3])
+local hits = tonumber(ARGV[4])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local allowed = math.max(0, math.min(hits, rate - redis.call('ZCARD', KEYS[1])))
+local recorded = allowed
+if ARGV[6] == '1' then
+    recorded = hits
+end
+for i = 1, recorded do
+    redis.call('ZADD', KEYS[1], now, ARGV[5] .. ':' .. i)
+end
+if recorded > 0 then
+    redis.call('PEXPIRE', KEYS[1], window)
+end
+if allowed == hits then
+    return {allowed, 0}
+end
+local freed = redis.call('ZRANGE', KEYS[1], -rate, -rate, 'WITHSCORES')
+if rate == 0 or #freed == 0 then
+    return {allowed, window}
+end
+return {allowed, tonumber(freed[2]) + window - now}
+""")
+
+
+def _key(name):
+    return '{}-rate-limit:{}'.format(config.REDIS_PREFIX, name)
 
 
-class RateLimit:
-    def __init__(self, rate, duration, meta_data=None):
-        """
-        Inititate rate limit instance
-        :param rate: maximum rate
-        :param duration: time in seconds
-        :param meta_data: dict
-        """
-        if rate < 0:
-            raise ValueError('Rate cannot be less than zero')
+def _record(name, rate, window, hits=1, force=False):
+    """
+    Record hits in the shared sliding window, as many as the rate allows
+    :param force: record all hits, even over the rate
+    :return: tuple of the number of hits within the rate and seconds before the next one is allowed
+    """
+    now = int(time.time() * 1000)
+    allowed, retry_after = _HIT_SCRIPT(keys=[_key(name)],
+                                      args=[now, int(window * 1000), rate, hits,
+                                            '{}:{}'.format(now, random.random()), int(force)])
+    return allowed, retry_after / 1000
 
+
+class _Bucket:
+    def __init__(self, rate, window, now):
         self.rate = rate
+        self.window = window
+        self.tokens = rate
+        self.updated = now
+        # Hits allowed locally and not recorded in Redis yet
+        self.pending = 0
+        self.synced_at = 0
+        self.blocked_until = 0
+
+
+class LocalLimiter:
+    """
+    Per-process token buckets in front of the shared sliding window.
+    A bucket holds rate tokens and refills at rate per window, so a caller is only rejected
+    without Redis when this process alone saw more than the rate allows, or when Redis rejected
+    it and its retry time is not over. Allowed hits are recorded in Redis in batches of up to
+    batch hits, and pending ones every sync_interval seconds even if the caller sends no more.
+
+    Accuracy: a process lets at most batch - 1 hits of a caller through before Redis sees them, so up to
+    rate + processes * (batch - 1) hits get through within a window. No caller is rejected under the rate.
+    """
+    def __init__(self, size, ttl, batch, sync_interval):
+        self.batch = batch
+        self.sync_interval = sync_interval
+        self._buckets = LocalCache(size, ttl)
+        # Buckets with pending hits by name, kept until synced even if evicted from the cache
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+
+    def _start_flusher(self):
+        """Sync pending hits of idle callers too, every sync_interval seconds"""
+        def run():
+            while True:
+                time.sleep(self.sync_interval)
+                try:
+                    self.flush()
+                except Exception:
+                    logging.exception('Failed to sync rate limit hits')
+
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=run, daemon=True).start()
+
+    def _sync(self, name, bucket, hits):
+        """Record hits which were let through already, all of them count"""
+        allowed, retry_after = _record(name, bucket.rate, bucket.window, hits, force=True)
+        if allowed == hits:
+            return True, 0
+
+        with self._lock:
+            bucket.blocked_until = time.time() + retry_after
+        return False, retry_after
+
+    def flush(self):
+        """Record pending hits not synced within the last sync_interval seconds"""
+        now = time.time()
+        with self._lock:
+            due = [(name, bucket, bucket.pending) for name, bucket in self._pending.items()
+                   if now - bucket.synced_at >= self.sync_interval]
+            for name, bucket, _ in due:
+                del self._pending[name]
+                bucket.pending = 0
+                bucket.synced_at = now
+
+        for name, bucket, hits in due:
+            self._sync(name, bucket, hits)
+
+    def hit(self, name, rate, window):
+        self._start_flusher()
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._pending.get(name) or _Bucket(rate, window, now)
+                self._buckets.set(name, bucket)
+            bucket.rate = rate
+            bucket.window = window
+
+            if bucket.blocked_until > now:
+                metrics.incr('rate_limit_requests_total', tier='local', result='rejected')
+                return False, bucket.blocked_until - now
+
+            bucket.tokens = min(rate, bucket.tokens + (now - bucket.updated) * rate / window)
+            bucket.updated = now
+            if bucket.tokens < 1:
+                metrics.incr('rate_limit_requests_total', tier='local', result='rejected')
+                return False, (1 - bucket.tokens) * window / max(rate, 1)
+
+            bucket.tokens -= 1
+            bucket.pending += 1
+            if bucket.pending < self.batch and now - bucket.synced_at < self.sync_interval:
+                self._pending[name] = bucket
+                metrics.incr('rate_limit_requests_total', tier='local', result='allowed')
+                return True, 0
+
+            hits = bucket.pending
+            self._pending.pop(name, None)
+            bucket.pending = 0
+            bucket.synced_at = now
+
+        allowed, retry_after = self._sync(name, bucket, hits)
+        metrics.incr('rate_limit_requests_total', tier='redis', result='allowed' if allowed else 'rejected')
+        return allowed, retry_after
+
+
+_local_limiter = LocalLimiter(config.RATE_LIMIT_LOCAL_SIZE, config.RATE_LIMIT_LOCAL_TTL,
+                              config.RATE_LIMIT_LOCAL_BATCH, config.RATE_LIMIT_LOCAL_SYNC_INTERVAL)
+
+
+def hit(name, rate, window):
+    """
+    Count a hit if fewer than rate hits were counted within the last window seconds.
+    With RATE_LIMIT_LOCAL_ENABLED, hits go through the local tier first, see LocalLimiter
+    :param name: what is limited, e.g. user and action
+    :return: tuple of whether the hit is allowed and seconds before the next one is, 0 if it is
+    """
+    if rate < 0:
+        raise ValueError('Rate cannot be less than zero')
+
+    if window < 0:
+        raise ValueError('Rate duration cannot be less than zero')
+
+    if config.RATE_LIMIT_LOCAL_ENABLED:
+        return _local_limiter.hit(name, rate, window)
 
-        if duration < 0:
-            raise ValueError('Rate duration cannot be less than zero')
+    allowed, retry_after = _record(name, rate, window)
+    return allowed == 1, retry_after
 
-        self.duration = duration
-        self.meta_data = meta_data
 
-        self.key = '{}'.format(config.REDIS_PREFIX)
-        for key, value in meta_data.items():
-            self.key = self.key + '-{}:{}'.format(key, value)
+def rate_limited(key_fn, rate, window, message='Too many requests, please try again later'):
+    """
+    Limit calls of a view to rate per sliding window of seconds.
+    Apply it below access_token_required and parse_request_args, so that key_fn gets user and args.
+    :param key_fn: function of the view arguments returning what is limited, or None not to limit the call
+    """
+    def rate_limited_decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            name = key_fn(**kwargs)
+            if name is not None:
+                allowed, retry_after = hit(name, rate, window)
+                if not allowed:
+                    raise Error(StatusCode.TOO_MANY_REQUESTS, message, {'retry_after': retry_after})
 
-    @property
-    def is_over_limit(self):
-        current_value = redis.get(self.key)
-        if current_value is None:
-            return False
+            return f(*args, **kwargs)
 
-        return int(current_value) > self.rate
+        return decorated_function
 
-    def increase(self):
-        current_value = redis.get(self.key)
-        if current_value is None:
-            redis.set(self.key, 1, self.duration)
-        else:
-            redis.incr(self.key)
+    return rate_limited_decorator
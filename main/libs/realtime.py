@@ -0,0 +1,79 @@
+import hashlib
+import hmac
+import json
+
+from main import pusher_client, redis
+from main.cfg import config
+
+
+class PusherBackend(object):
+    """Events are sent to the hosted Pusher service"""
+
+    def trigger(self, channel_name, event, data):
+        pusher_client.trigger(channel_name, event, data)
+
+    def trigger_batch(self, channel_name, events):
+        """
+        :param events: list of dict with name and data
+        """
+        pusher_client.trigger_batch([
+            {'channel': channel_name, 'name': event['name'], 'data': event['data']}
+            for event in events
+        ])
+
+    def authenticate(self, channel_name, socket_id, user_id):
+        return pusher_client.authenticate(
+            channel=channel_name,
+            socket_id=socket_id,
+            custom_data={
+                'user_id': user_id
+            }
+        )
+
+
+class RedisBackend(object):
+    """Events are published with Redis pub/sub, and served to clients by the realtime gateway"""
+
+    def trigger(self, channel_name, event, data):
+        redis.publish(pubsub_channel(channel_name), encode_message(event, data))
+
+    def trigger_batch(self, channel_name, events):
+        pipe = redis.pipeline(transaction=False)
+        for event in events:
+            pipe.publish(pubsub_channel(channel_name), encode_message(event['name'], event['data']))
+        pipe.execute()
+
+    def authenticate(self, channel_name, socket_id, user_id):
+        return {
+            'auth': sign(channel_name, socket_id, user_id),
+            'channel_data': json.dumps({'user_id': user_id})
+        }
+
+
+_backends = {
+    'pusher': PusherBackend(),
+    'redis': RedisBackend()
+}
+
+
+def get_backend():
+    return _backends[config.REALTIME_BACKEND]
+
+
+def pubsub_channel(channel_name):
+    """Redis pub/sub channel of a presence channel"""
+    return '{}-realtime:{}'.format(config.REDIS_PREFIX, channel_name)
+
+
+def encode_message(event, data):
+    return json.dumps({'event': event, 'data': data})
+
+
+def sign(channel_name, socket_id, user_id):
+    """Signature allowing a socket to subscribe a channel as a user"""
+    message = '{}:{}:{}'.format(socket_id, channel_name, user_id).encode('utf-8')
+    return hmac.new(config.SECRET_KEY.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def verify(channel_name, socket_id, user_id, signature):
+    return hmac.compare_digest(sign(channel_name, socket_id, user_id), signature)
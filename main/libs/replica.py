@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from main import db, redis
+from main.cfg import config
+
+
+def _recent_write_key(user_id):
+    """Set while the replica may not have the writes of a user yet"""
+    return '{}-db-recent-write:{}'.format(config.REDIS_PREFIX, user_id)
+
+
+def has_recent_write(user_id):
+    return bool(redis.exists(_recent_write_key(user_id)))
+
+
+def use_replica(f):
+    """
+    Send reads of a view to the replica, unless its user wrote within the last REPLICA_LAG seconds.
+    Reads go back to the primary as soon as the view writes.
+    Apply it below access_token_required, so that the user is known
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user = kwargs.get('user')
+        if not db.session().has_replica() or (user is not None and has_recent_write(user.id)):
+            return f(*args, **kwargs)
+
+        db.session.info['use_replica'] = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            db.session.info.pop('use_replica', None)
+
+    return decorated_function
+
+
+@contextmanager
+def primary():
+    """Read from the primary, for reads filling caches shared by all requests"""
+    use = db.session.info.pop('use_replica', None)
+    try:
+        yield
+    finally:
+        if use:
+            db.session.info['use_replica'] = use
+
+
+@event.listens_for(Session, 'after_commit')
+def _remember_write(session):
+    user_id = session.info.get('user_id')
+    if session.info.get('wrote') and user_id is not None and session.has_replica():
+        redis.set(_recent_write_key(user_id), 1, ex=config.REPLICA_LAG)
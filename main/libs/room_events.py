@@ -0,0 +1,76 @@
+import json
+
+from main import redis
+from main.cfg import config
+
+# Numbers events of a room and appends them to its stream, the sequence number being the entry id.
+# KEYS: sequence, stream. ARGV: max length, ttl, then name and data of each event
+_APPEND_SCRIPT = redis.register_script("""
+local count = (#ARGV - 2) / 2
+local first = redis.call('INCRBY', KEYS[1], count) - count + 1
+for i = 0, count - 1 do
+    redis.call('XADD', KEYS[2], 'MAXLEN', ARGV[1], (first + i) .. '-0', 'name', ARGV[3 + 2 * i], 'data', ARGV[4 + 2 * i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return first
+""")
+
+
+def _seq_key(room_id):
+    """Sequence number of the last event of a room"""
+    return '{}-room-seq:{}'.format(config.REDIS_PREFIX, room_id)
+
+
+def _stream_key(room_id):
+    """Last ROOM_EVENTS_MAXLEN events of a room"""
+    return '{}-room-events:{}'.format(config.REDIS_PREFIX, room_id)
+
+
+def append(room_id, events):
+    """
+    Number events of a room in order and keep them for clients catching up.
+    The sequence number is added to the data of each event.
+    :param events: list of dict with name and data
+    """
+    if not events:
+        return
+
+    args = [config.ROOM_EVENTS_MAXLEN, config.ROOM_EVENTS_TTL]
+    for event in events:
+        args += [event['name'], json.dumps(event['data'])]
+    first = _APPEND_SCRIPT(keys=[_seq_key(room_id), _stream_key(room_id)], args=args)
+
+    for seq, event in enumerate(events, first):
+        event['data'] = dict(event['data'], seq=seq)
+
+
+def get_last_seq(room_id):
+    seq = redis.get(_seq_key(room_id))
+    return int(seq) if seq is not None else 0
+
+
+def get_events_since(room_id, since):
+    """
+    Events of a room after a sequence number
+    :return: list of dict with seq, name and data, or None if some of them are no longer kept
+    """
+    last_seq = get_last_seq(room_id)
+    if since == last_seq:
+        return []
+    if since > last_seq:
+        # Sequence was reset after the room was idle
+        return None
+
+    events = []
+    for entry_id, fields in redis.xrange(_stream_key(room_id), min='{}-0'.format(since + 1)):
+        seq = int(entry_id.decode('utf-8').split('-')[0])
+        events.append({
+            'seq': seq,
+            'name': fields[b'name'].decode('utf-8'),
+            'data': dict(json.loads(fields[b'data'].decode('utf-8')), seq=seq)
+        })
+
+    if not events or events[0]['seq'] != since + 1:
+        return None
+    return events
@@ -1,9 +1,71 @@
 from __future__ import absolute_import, unicode_literals
 
+import time
+
 from celery import Celery
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_process_shutdown
+from kombu import Queue
 
 from main.cfg import config
+from main.enums import TaskQueue, TaskQueues
+from main.libs import metrics
 
 celery_app = Celery('TaskQueue',
-                    broker=config.CELERY_BROKER)
+                    broker=config.CELERY_BROKER,
+                    include=['main.libs.queue_metrics'])
 celery_app.conf.broker_transport_options = {'visibility_timeout': 10800}
+
+# Each queue is consumed by its own workers, see run_celery.sh
+celery_app.conf.task_queues = [Queue(name) for name in TaskQueues]
+celery_app.conf.task_default_queue = TaskQueue.BACKGROUND
+celery_app.conf.task_routes = {
+    # Single-flight tasks carrying playback events
+    'main.libs.outbox._relay_critical_outbox': {'queue': TaskQueue.REALTIME_CRITICAL},
+    'main.libs.pusher._retry_events': {'queue': TaskQueue.REALTIME_CRITICAL},
+    'main.libs.outbox._relay_outbox': {'queue': TaskQueue.REALTIME_BULK},
+    'main.libs.pusher._trigger_pusher': {'queue': TaskQueue.REALTIME_BULK},
+    'main.libs.pusher._flush_channel': {'queue': TaskQueue.REALTIME_BULK},
+    'main.libs.vote_broadcast._flush_vote_totals': {'queue': TaskQueue.REALTIME_BULK},
+    'main.libs.presence._process_queued_events': {'queue': TaskQueue.REALTIME_BULK},
+    'main.libs.playback._persist_state': {'queue': TaskQueue.BACKGROUND},
+    'main.libs.queue_metrics.*': {'queue': TaskQueue.BACKGROUND},
+}
+celery_app.conf.beat_schedule = {
+    'report-queue-metrics': {
+        'task': 'main.libs.queue_metrics.report_queue_metrics',
+        'schedule': config.QUEUE_METRICS_INTERVAL
+    }
+}
+
+# Start of the tasks running in this process, by task id
+_started_at = {}
+
+
+@before_task_publish.connect
+def _add_sent_at(headers=None, **kwargs):
+    """Send the publish time with the message, for the worker to measure how long it was queued"""
+    if headers is not None:
+        headers['sent_at'] = time.time()
+
+
+@task_prerun.connect
+def _start_task_metrics(task_id=None, task=None, **kwargs):
+    _started_at[task_id] = time.perf_counter()
+    sent_at = getattr(task.request, 'sent_at', None)
+    if sent_at is not None:
+        # Clocks of web and worker hosts are compared, keep them in sync
+        metrics.observe('celery_task_queue_seconds', max(0, time.time() - sent_at), task=task.name)
+
+
+@task_postrun.connect
+def _record_task_metrics(task_id=None, task=None, state=None, **kwargs):
+    started_at = _started_at.pop(task_id, None)
+    if started_at is not None:
+        metrics.observe('celery_task_duration_seconds', time.perf_counter() - started_at, task=task.name)
+    metrics.incr('celery_tasks_total', task=task.name, state=state)
+
+
+@worker_process_shutdown.connect
+def _flush_metrics(**kwargs):
+    # Pool processes exit without running atexit handlers
+    metrics.flush()
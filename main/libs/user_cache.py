@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from main import db, redis
+from main.cfg import config
+from main.models.user import User
+from main.libs import metrics
+
+
+class CachedUser:
+    """Lightweight authenticated user, with the fields controllers use"""
+    def __init__(self, id, name, email, status):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.status = status
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(id=user.id, name=user.name, email=user.email, status=user.status)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'email': self.email,
+            'status': self.status
+        }
+
+
+class LocalCache:
+    """Per-process LRU cache whose entries expire after ttl seconds"""
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local_cache = LocalCache(config.USER_CACHE_LOCAL_SIZE, config.USER_CACHE_LOCAL_TTL)
+
+
+def _user_key(user_id):
+    return '{}-user:{}'.format(config.REDIS_PREFIX, user_id)
+
+
+def _version_key(user_id):
+    """Counter of invalidations of a user, a fill started before one of them is not written"""
+    return '{}-user-version:{}'.format(config.REDIS_PREFIX, user_id)
+
+
+# Cache a user only if it was not invalidated since the fill read its version.
+# KEYS: user, version. ARGV: version read before the row, data, ttl. Returns 1 if cached
+_FILL_SCRIPT = redis.register_script("""
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+""")
+
+
+def get_user(user_id):
+    """
+    Look up a user in the local cache, then Redis, then database
+    :return: CachedUser or None if user does not exist
+    """
+    user = _local_cache.get(user_id)
+    if user is not None:
+        metrics.incr('user_cache_requests_total', tier='local', result='hit')
+        return user
+    metrics.incr('user_cache_requests_total', tier='local', result='miss')
+
+    data = redis.get(_user_key(user_id))
+    if data is not None:
+        metrics.incr('user_cache_requests_total', tier='redis', result='hit')
+        user = CachedUser(**json.loads(data.decode('utf-8')))
+    else:
+        metrics.incr('user_cache_requests_total', tier='redis', result='miss')
+        # Read before the row, so that a commit invalidating it in between is noticed
+        version = redis.get(_version_key(user_id)) or b'0'
+        account = db.session.query(User).filter_by(id=user_id).one_or_none()
+        if account is None:
+            return None
+
+        user = CachedUser.from_model(account)
+        if not _FILL_SCRIPT(keys=[_user_key(user_id), _version_key(user_id)],
+                            args=[version, json.dumps(user.to_dict()), config.USER_CACHE_TTL]):
+            # The row may be stale, leave it to the next lookup
+            return user
+
+    _local_cache.set(user_id, user)
+    return user
+
+
+def invalidate(user_id):
+    """
+    Drop a user from this process and from Redis, and stop fills which read the row before.
+    Local caches of other processes expire within USER_CACHE_LOCAL_TTL
+    """
+    _local_cache.delete(user_id)
+    pipe = redis.pipeline()
+    pipe.incr(_version_key(user_id))
+    # Outlives any fill in progress
+    pipe.expire(_version_key(user_id), config.USER_CACHE_TTL)
+    pipe.delete(_user_key(user_id))
+    pipe.execute()
+
+
+def clear_local_cache():
+    _local_cache.clear()
+
+
+def get_stats():
+    """Hit and miss counters of both tiers"""
+    return metrics.get_counters(prefix='user_cache_')
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _mark_user_changed(mapper, connection, user):
+    object_session(user).info.setdefault('changed_user_ids', set()).add(user.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    # Invalidate after commit, so that a concurrent request cannot cache the old row again
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_changed_users(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('changed_user_ids', None)
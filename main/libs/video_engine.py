@@ -1,85 +1,166 @@
-import datetime
-
-from sqlalchemy import desc
+from sqlalchemy.exc import IntegrityError
 
 from main.models.room_participant import RoomParticipant
 from main.models.video import Video
-from main.models.room import Room
-from main.enums import VideoStatus, ParticipantStatus
+from main.models.vote import Vote
+from main.enums import VideoStatus, ParticipantStatus, VoteStatus
+from main.libs import video_queue, playback, barrier, replica
 from main import db
 
 
 def get_next_video(room_id):
-    next_video = Video.query \
-        .filter(Video.room_id == room_id) \
-        .filter(Video.status == VideoStatus.VOTING) \
-        .order_by(desc(Video.total_vote)) \
-        .first()
+    # Videos missing on a lagging replica would be dropped from the shared queue
+    with replica.primary():
+        while True:
+            video_id = video_queue.get_next_video_id(room_id)
+            if video_id is None:
+                return None
 
-    return next_video
+            next_video = Video.query.get(video_id)
+            if next_video is not None and next_video.room_id == room_id and next_video.status == VideoStatus.VOTING:
+                return next_video
 
+            # Video is no longer voted, drop it from the queue and try again
+            video_queue.remove(room_id, video_id)
 
-def get_current_video(room_id):
-    # Calculate time difference since last update
-    room = Room.query.filter(Room.id == room_id).one_or_none()
-    if room.current_video is None:
+
+def set_is_voted(videos, user_id):
+    """
+    Set `is_voted` attribute of every video in the list with one query
+    :param videos: list of videos
+    :param user_id: user who views the videos
+    """
+    if not videos:
+        return videos
+
+    video_ids = [video.id for video in videos]
+    voted_video_ids = db.session.query(Vote.video_id) \
+        .filter(Vote.user_id == user_id) \
+        .filter(Vote.status == VoteStatus.UPVOTE) \
+        .filter(Vote.video_id.in_(video_ids)) \
+        .all()
+    voted_video_ids = {row.video_id for row in voted_video_ids}
+
+    for video in videos:
+        setattr(video, 'is_voted', video.id in voted_video_ids)
+
+    return videos
+
+
+def _change_vote(video, user_id, from_status, to_status):
+    """Change an existing vote, return whether this request made the change"""
+    changed = Vote.query \
+        .filter(Vote.user_id == user_id) \
+        .filter(Vote.video_id == video.id) \
+        .filter(Vote.status == from_status) \
+        .update({Vote.status: to_status}, synchronize_session=False)
+
+    return changed == 1
+
+
+def _lock_video(video):
+    """
+    Lock the video row before touching its votes. Inserting a vote takes a shared lock on the video
+    for the foreign key check, two votes upgrading it for the total vote would deadlock
+    """
+    db.session.query(Video.id).filter(Video.id == video.id).with_for_update().one()
+
+
+def _increase_total_vote(video, amount):
+    """Increase total vote in SQL so that concurrent votes are not lost, return the new total"""
+    Video.query \
+        .filter(Video.id == video.id) \
+        .update({Video.total_vote: Video.total_vote + amount}, synchronize_session=False)
+
+    return db.session.query(Video.total_vote).filter(Video.id == video.id).scalar()
+
+
+def up_vote(video, user_id):
+    """
+    Up-vote a video, the unique (user_id, video_id) vote row guards against double counting.
+    The caller commits, with the vote event
+    :return: new total vote, or None if user has already up-voted
+    """
+    _lock_video(video)
+    # Insert first, a conditional update on a missing row would take a gap lock
+    try:
+        with db.session.begin_nested():
+            db.session.add(Vote(user_id=user_id, video_id=video.id, status=VoteStatus.UPVOTE))
+    except IntegrityError:
+        # User has voted before, only a down-vote can be turned into an up-vote
+        if not _change_vote(video, user_id, VoteStatus.DOWNVOTE, VoteStatus.UPVOTE):
+            return None
+
+    total_vote = _increase_total_vote(video, 1)
+    video_queue.increase_vote_on_commit(video.room_id, video.id, 1)
+    return total_vote
+
+
+def down_vote(video, user_id):
+    """
+    Down-vote a video which user has up-voted. The caller commits, with the vote event
+    :return: new total vote, or None if user has no up-vote on the video
+    """
+    _lock_video(video)
+    if not _change_vote(video, user_id, VoteStatus.UPVOTE, VoteStatus.DOWNVOTE):
         return None
 
-    if room.status == VideoStatus.PAUSING:
-        current_video_time = room.video_time
-    else:
-        time_diff = (datetime.datetime.utcnow() - room.updated).total_seconds()
-        current_video_time = room.video_time + time_diff
+    total_vote = _increase_total_vote(video, -1)
+    video_queue.increase_vote_on_commit(video.room_id, video.id, -1)
+    return total_vote
 
-    current_video = Video.query.filter(Video.id == room.current_video).one_or_none()
-    current_video.status = room.status
-    setattr(current_video, 'video_time', current_video_time)
-    return current_video
+
+def get_current_video(room_id):
+    """Current video of a room with its status and position, served from cached playback state"""
+    state = playback.get_state(room_id)
+    if state is None or state.video_id is None:
+        return None
+
+    return state
 
 
 def set_current_video(room_id, current_video_id=None, video_time=0, status=VideoStatus.PAUSING):
     """
     Set current video for a room
     """
+    current_video = None
     if current_video_id is None:
-        next_video = get_next_video(room_id)
-        if next_video is not None:
-            next_video.status = VideoStatus.PLAYING
-            current_video_id = next_video.id
-
-    room = Room.query.filter(Room.id == room_id).one_or_none()
-    room.current_video = current_video_id
-    room.video_time = video_time
-    room.status = status
+        current_video = get_next_video(room_id)
+        if current_video is not None:
+            current_video.status = VideoStatus.PLAYING
+    else:
+        current_video = Video.query.get(current_video_id)
     db.session.commit()
 
-    current_video = get_current_video(room_id)
-    return current_video
+    if current_video is not None:
+        video_queue.remove(room_id, current_video.id)
 
+    state = playback.set_video(room_id, current_video, status=status, video_time=video_time)
+    return state if state.video_id is not None else None
 
-def check_all_user_have_same_video_status(room_id, status):
-    not_ready_users = RoomParticipant.query \
-                        .filter(RoomParticipant.room_id == room_id) \
-                        .filter(RoomParticipant.status == ParticipantStatus.IN) \
-                        .filter(RoomParticipant.video_status != status) \
-                        .all()
 
-    if not len(not_ready_users):
-        return True
-
-    return False
+def set_user_video_status(room_id, user_id, status):
+    RoomParticipant.query \
+        .filter(RoomParticipant.room_id == room_id) \
+        .filter(RoomParticipant.user_id == user_id) \
+        .update({RoomParticipant.video_status: status}, synchronize_session=False)
 
 
 def set_online_users_video_status(room_id, status):
-    online_users = RoomParticipant.query \
-                        .filter(RoomParticipant.room_id == room_id) \
-                        .filter(RoomParticipant.status == ParticipantStatus.IN) \
-                        .all()
-
-    if not len(online_users):
-        return
+    """
+    Set video status of all online users in a room
+    :return: number of updated users
+    """
+    # Statuses reported so far are overridden for everyone
+    state = playback.get_state(room_id)
+    if state is not None and state.video_id is not None:
+        barrier.reset(room_id, state.video_id)
 
-    for user in online_users:
-        user.video_status = status
+    # One UPDATE whatever the room size
+    updated = RoomParticipant.query \
+        .filter(RoomParticipant.room_id == room_id) \
+        .filter(RoomParticipant.status == ParticipantStatus.IN) \
+        .update({RoomParticipant.video_status: status}, synchronize_session=False)
 
     db.session.commit()
+    return updated
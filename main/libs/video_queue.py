@@ -0,0 +1,114 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from main import db, redis
+from main.cfg import config
+from main.libs import replica
+from main.models.video import Video
+from main.enums import VideoStatus
+
+
+def _queue_key(room_id):
+    """Sorted set of VOTING videos of a room, scored by total vote"""
+    return '{}-video-queue:{}'.format(config.REDIS_PREFIX, room_id)
+
+
+def _built_key(room_id):
+    """Marks that the queue has been loaded, an empty sorted set cannot be told apart from a missing one"""
+    return '{}-video-queue-built:{}'.format(config.REDIS_PREFIX, room_id)
+
+
+def _load_scores(room_id):
+    with replica.primary():
+        videos = db.session.query(Video.id, Video.total_vote) \
+            .filter(Video.room_id == room_id) \
+            .filter(Video.status == VideoStatus.VOTING) \
+            .all()
+
+    return {str(video.id): video.total_vote or 0 for video in videos}
+
+
+def rebuild(room_id):
+    """Reload the queue of a room from database"""
+    scores = _load_scores(room_id)
+
+    pipe = redis.pipeline()
+    pipe.delete(_queue_key(room_id))
+    if scores:
+        pipe.zadd(_queue_key(room_id), scores)
+    pipe.set(_built_key(room_id), 1)
+    pipe.execute()
+
+    return scores
+
+
+def get_next_video_id(room_id):
+    """Id of the most voted video, the queue is rebuilt on cache miss"""
+    if not redis.exists(_built_key(room_id)):
+        rebuild(room_id)
+
+    video_ids = redis.zrevrange(_queue_key(room_id), 0, 0)
+    if not video_ids:
+        return None
+
+    return int(video_ids[0])
+
+
+def add(room_id, video_id, total_vote):
+    redis.zadd(_queue_key(room_id), {video_id: total_vote})
+
+
+def increase_vote(room_id, video_id, amount=1):
+    # XX: videos which are not in the queue are picked up by the next rebuild
+    redis.zadd(_queue_key(room_id), {video_id: amount}, xx=True, incr=True)
+
+
+def increase_vote_on_commit(room_id, video_id, amount=1):
+    """Increase the score once the current transaction is committed, and never if it is rolled back"""
+    db.session.info.setdefault('video_queue_votes', []).append((room_id, video_id, amount))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed_votes(session):
+    # Releasing a savepoint commits nothing yet
+    if session.transaction.nested:
+        return
+
+    for room_id, video_id, amount in session.info.pop('video_queue_votes', ()):
+        increase_vote(room_id, video_id, amount)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_votes(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('video_queue_votes', None)
+
+
+def remove(room_id, video_id):
+    redis.zrem(_queue_key(room_id), video_id)
+
+
+def find_drift(room_id):
+    """
+    Compare the cached queue of a room with database
+    :return: dict of video ids missing from cache, stale in cache and with mismatched votes
+    """
+    db_scores = _load_scores(room_id)
+    cached_scores = {
+        video_id.decode('utf-8'): int(score)
+        for video_id, score in redis.zrange(_queue_key(room_id), 0, -1, withscores=True)
+    }
+
+    return {
+        'missing': sorted(int(video_id) for video_id in db_scores.keys() - cached_scores.keys()),
+        'stale': sorted(int(video_id) for video_id in cached_scores.keys() - db_scores.keys()),
+        'mismatched': {
+            int(video_id): {'db': db_scores[video_id], 'cache': cached_scores[video_id]}
+            for video_id in db_scores.keys() & cached_scores.keys()
+            if db_scores[video_id] != cached_scores[video_id]
+        }
+    }
+
+
+def is_built(room_id):
+    return bool(redis.exists(_built_key(room_id)))
@@ -0,0 +1,67 @@
+import os
+
+from main import db, redis
+from main.cfg import config
+from main.models.video import Video
+from main.libs import pusher, outbox, dispatch
+from main.libs.tasks import celery_app
+from main.enums import PusherEvent
+
+
+def _changed_videos_key(room_id):
+    """Videos whose vote count changed since the last vote totals event"""
+    return '{}-vote-changed:{}'.format(config.REDIS_PREFIX, room_id)
+
+
+def _flush_key(room_id):
+    return '{}-vote-flush:{}'.format(config.REDIS_PREFIX, room_id)
+
+
+def is_coalescing(room_id):
+    """Vote counts of a room are coalesced once its event rate passes the threshold"""
+    return config.VOTE_COALESCE_ENABLED and pusher.get_event_rate(room_id) >= config.VOTE_COALESCE_THRESHOLD
+
+
+def broadcast(room_id, event, data):
+    """
+    Send an UP_VOTE/DOWN_VOTE event, or in a busy room, collapse vote count
+    changes within VOTE_COALESCE_WINDOW into one VOTE_TOTALS event
+    """
+    if not is_coalescing(room_id):
+        return outbox.add(room_id, event, data)
+
+    redis.sadd(_changed_videos_key(room_id), data['id'])
+    if redis.set(_flush_key(room_id), 1, ex=config.VOTE_COALESCE_WINDOW * 10, nx=True):
+        if os.getenv('FLASK_ENV') == 'test':
+            return flush_vote_totals(room_id)
+
+        dispatch.apply_async(_flush_vote_totals, (room_id,), countdown=config.VOTE_COALESCE_WINDOW)
+
+
+def flush_vote_totals(room_id):
+    redis.delete(_flush_key(room_id))
+    pipe = redis.pipeline()
+    pipe.smembers(_changed_videos_key(room_id))
+    pipe.delete(_changed_videos_key(room_id))
+    video_ids, _ = pipe.execute()
+    if not video_ids:
+        return
+
+    # Read counts when sending, so that the latest ones are broadcast
+    videos = db.session.query(Video.id, Video.total_vote) \
+        .filter(Video.id.in_([int(video_id) for video_id in video_ids])) \
+        .order_by(Video.id) \
+        .all()
+
+    data = {
+        'videos': [{'id': video.id, 'total_vote': video.total_vote} for video in videos]
+    }
+    pusher.trigger(room_id, PusherEvent.VOTE_TOTALS, data)
+
+
+@celery_app.task
+def _flush_vote_totals(room_id):
+    try:
+        flush_vote_totals(room_id)
+    finally:
+        db.session.remove()
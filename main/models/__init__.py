@@ -4,5 +4,6 @@ __all__ = [
     'room_participant',
     'message',
     'video',
-    'vote'
+    'vote',
+    'outbox_event'
 ]
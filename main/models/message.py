@@ -4,6 +4,9 @@ from main.models.base import TimestampMixin
 
 class Message(db.Model, TimestampMixin):
     __tablename__ = 'messages'
+    __table_args__ = (
+        db.Index('ix_messages_room_id_id', 'room_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
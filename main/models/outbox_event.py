@@ -0,0 +1,15 @@
+from main import db
+from main.models.base import TimestampMixin
+
+
+class OutboxEvent(db.Model, TimestampMixin):
+    """Realtime event committed with the transaction which caused it, waiting to be relayed"""
+    __tablename__ = 'outbox_events'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    room_id = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(50), nullable=False)
+    data = db.Column(db.Text(collation='utf8mb4_unicode_ci'), nullable=False)
+
+    def __init__(self, *args, **kwargs):
+        super(OutboxEvent, self).__init__(*args, **kwargs)
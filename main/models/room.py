@@ -5,12 +5,17 @@ from main.models.video import Video
 
 class Room(db.Model, TimestampMixin):
     __tablename__ = 'rooms'
+    __table_args__ = (
+        db.UniqueConstraint('fingerprint', name='uq_rooms_fingerprint'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(50))
     creator_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     current_video = db.Column(db.Integer, db.ForeignKey(Video.id), nullable=True)
     video_time = db.Column(db.Float, nullable=True)
+    # When video_time was set, so that unrelated room updates do not move the video position
+    video_time_updated = db.Column(db.DateTime, nullable=True)
     fingerprint = db.Column(db.String(50))
     status = db.Column(db.String(50))
 
@@ -4,6 +4,9 @@ from main.models.base import TimestampMixin
 
 class RoomParticipant(db.Model, TimestampMixin):
     __tablename__ = 'room_participants'
+    __table_args__ = (
+        db.Index('ix_room_participants_room_id_status_video_status', 'room_id', 'status', 'video_status'),
+    )
 
     id = db.Column(db.Integer, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
@@ -4,6 +4,9 @@ from main.models.base import TimestampMixin
 
 class Video(db.Model, TimestampMixin):
     __tablename__ = 'videos'
+    __table_args__ = (
+        db.Index('ix_videos_room_id_status_total_vote', 'room_id', 'status', 'total_vote'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     creator_id = db.Column(db.Integer, db.ForeignKey('users.id'))
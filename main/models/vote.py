@@ -4,6 +4,10 @@ from main.models.base import TimestampMixin
 
 class Vote(db.Model, TimestampMixin):
     __tablename__ = 'votes'
+    __table_args__ = (
+        # A user has at most one vote per video
+        db.UniqueConstraint('user_id', 'video_id', name='uq_votes_user_id_video_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     video_id = db.Column(db.Integer, db.ForeignKey('videos.id'))
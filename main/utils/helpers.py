@@ -10,7 +10,7 @@ from flask import request
 from main import db
 from main.cfg import config
 from main.errors import Error, StatusCode
-from main.models.user import User
+from main.libs import user_cache
 
 
 def encode(account):
@@ -77,11 +77,13 @@ def access_token_required(f):
         # Decode the token which has been passed in the request headers
         token = decode(authorization[len('Bearer '):])
 
-        account = db.session.query(User).filter_by(id=token['sub']).one_or_none()
+        account = user_cache.get_user(token['sub'])
 
         if not account:
             raise Error(StatusCode.UNAUTHORIZED, 'Unauthorized')
 
+        # Writes of the user are tracked for reads from the replica
+        db.session.info['user_id'] = account.id
         kwargs['user'] = account
         return f(*args, **kwargs)
 
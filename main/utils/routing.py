@@ -0,0 +1,47 @@
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql import Select
+
+# Key of the read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending reads to the replica while session.info['use_replica'] is set.
+    Flushes, writes and locking reads go to the primary, and so do all reads once the session wrote
+    """
+    def __init__(self, db, **options):
+        self._db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def has_replica(self):
+        return REPLICA_BIND in (self.app.config['SQLALCHEMY_BINDS'] or {})
+
+    def _get_replica(self):
+        return self._db.get_engine(self.app, bind=REPLICA_BIND)
+
+    def get_bind(self, mapper=None, clause=None):
+        is_read = isinstance(clause, Select) and clause._for_update_arg is None
+        if self._flushing or (clause is not None and not is_read):
+            self.info['wrote'] = True
+
+        if is_read and self.info.get('use_replica') and not self.info.get('wrote') and self.has_replica():
+            return self._get_replica()
+
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy with pool pre-ping and a session routing reads to a replica"""
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        if info.drivername.startswith('sqlite'):
+            # SQLite connections are not kept in a sized pool
+            for key in ('pool_size', 'max_overflow', 'pool_timeout'):
+                options.pop(key, None)
+
+        options['pool_pre_ping'] = app.config['SQLALCHEMY_POOL_PRE_PING']
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
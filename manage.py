@@ -3,6 +3,10 @@ from flask_migrate import Migrate, MigrateCommand
 
 from main import app, models
 from main import db
+from main.models.room import Room
+from main.cfg import config
+from main.libs import video_queue, gateway
+from main.enums import RoomStatus
 from database import drop_all, create_all
 
 
@@ -28,5 +32,34 @@ def drop_tables():
     drop_all()
 
 
+@manager.option('-f', '--fix', dest='fix', action='store_true', default=False,
+                help='Rebuild queues which drifted from database')
+def reconcile_video_queues(fix=False):
+    """Find drift between cached video queues and database"""
+    # Status of a room becomes its playback status once it plays a video
+    room_ids = [room.id for room in db.session.query(Room.id).filter(Room.status != RoomStatus.DELETED)]
+    drifted = 0
+    for room_id in room_ids:
+        if not video_queue.is_built(room_id):
+            continue
+
+        drift = video_queue.find_drift(room_id)
+        if not any(drift.values()):
+            continue
+
+        drifted += 1
+        print('Room {}: {}'.format(room_id, drift))
+        if fix:
+            video_queue.rebuild(room_id)
+
+    print('{} of {} rooms drifted'.format(drifted, len(room_ids)))
+
+
+@manager.command
+def run_realtime_gateway():
+    """Serve realtime events to clients when REALTIME_BACKEND is 'redis'"""
+    gateway.Gateway().run(config.REALTIME_GATEWAY_HOST, config.REALTIME_GATEWAY_PORT)
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,50 @@
+"""add indexes for hot query paths
+
+Revision ID: 3b9d2f1c7a4e
+Revises: 6254a3fc92c6
+Create Date: 2026-10-18 09:12:41.517302
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d2f1c7a4e'
+down_revision = '6254a3fc92c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Remove duplicated rows which would violate the new unique constraints,
+    # keeping the oldest vote and renaming colliding room fingerprints
+    op.execute('DELETE v1 FROM votes v1 '
+               'JOIN votes v2 ON v1.user_id = v2.user_id AND v1.video_id = v2.video_id AND v1.id > v2.id')
+    # Total votes counted the deleted duplicates
+    op.execute("UPDATE videos v SET total_vote = "
+               "(SELECT COUNT(*) FROM votes WHERE votes.video_id = v.id AND votes.status = 'upvote')")
+    op.execute('UPDATE rooms r1 '
+               'JOIN rooms r2 ON r1.fingerprint = r2.fingerprint AND r1.id > r2.id '
+               'SET r1.fingerprint = CONCAT(r1.fingerprint, r1.id)')
+
+    op.create_index('ix_videos_room_id_status_total_vote', 'videos', ['room_id', 'status', 'total_vote'])
+    op.create_unique_constraint('uq_votes_user_id_video_id', 'votes', ['user_id', 'video_id'])
+    op.create_index('ix_messages_room_id_id', 'messages', ['room_id', 'id'])
+    op.create_index('ix_room_participants_room_id_status_video_status', 'room_participants',
+                    ['room_id', 'status', 'video_status'])
+    op.create_unique_constraint('uq_rooms_fingerprint', 'rooms', ['fingerprint'])
+
+
+def downgrade():
+    # MySQL drops the implicit foreign key indexes once the composite indexes cover them,
+    # so recreate single-column ones before dropping the composite indexes
+    op.create_index('ix_videos_room_id', 'videos', ['room_id'])
+    op.create_index('ix_votes_user_id', 'votes', ['user_id'])
+    op.create_index('ix_messages_room_id', 'messages', ['room_id'])
+    op.create_index('ix_room_participants_room_id', 'room_participants', ['room_id'])
+
+    op.drop_constraint('uq_rooms_fingerprint', 'rooms', type_='unique')
+    op.drop_index('ix_room_participants_room_id_status_video_status', table_name='room_participants')
+    op.drop_index('ix_messages_room_id_id', table_name='messages')
+    op.drop_constraint('uq_votes_user_id_video_id', 'votes', type_='unique')
+    op.drop_index('ix_videos_room_id_status_total_vote', table_name='videos')
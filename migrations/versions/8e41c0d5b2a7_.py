@@ -0,0 +1,25 @@
+"""add rooms.video_time_updated
+
+Revision ID: 8e41c0d5b2a7
+Revises: 3b9d2f1c7a4e
+Create Date: 2026-10-18 11:03:27.240815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e41c0d5b2a7'
+down_revision = '3b9d2f1c7a4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('rooms', sa.Column('video_time_updated', sa.DateTime(), nullable=True))
+    op.execute('UPDATE rooms SET video_time_updated = updated WHERE current_video IS NOT NULL')
+
+
+def downgrade():
+    op.drop_column('rooms', 'video_time_updated')
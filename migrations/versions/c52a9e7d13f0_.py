@@ -0,0 +1,32 @@
+"""add outbox_events
+
+Revision ID: c52a9e7d13f0
+Revises: 8e41c0d5b2a7
+Create Date: 2026-10-18 15:21:09.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52a9e7d13f0'
+down_revision = '8e41c0d5b2a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox_events',
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('updated', sa.DateTime(), nullable=False),
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('room_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('data', sa.Text(collation='utf8mb4_unicode_ci'), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_outbox_events'))
+    )
+
+
+def downgrade():
+    op.drop_table('outbox_events')
@@ -1 +1,15 @@
-celery -A tasks worker --app=main.libs.tasks --loglevel=DEBUG
\ No newline at end of file
+#!/bin/bash
+
+# One worker per queue, so that playback sync never waits behind chat or background jobs.
+# Realtime workers fetch one message at a time, a prefetched message would wait behind a slow one.
+celery worker --app=main.libs.tasks --loglevel=DEBUG -n critical@%h -Q realtime_critical \
+  --concurrency=${CELERY_CRITICAL_CONCURRENCY:-4} --prefetch-multiplier=1 -O fair &
+celery worker --app=main.libs.tasks --loglevel=DEBUG -n bulk@%h -Q realtime_bulk \
+  --concurrency=${CELERY_BULK_CONCURRENCY:-8} --prefetch-multiplier=1 -O fair &
+celery worker --app=main.libs.tasks --loglevel=DEBUG -n background@%h -Q background \
+  --concurrency=${CELERY_BACKGROUND_CONCURRENCY:-2} --prefetch-multiplier=4 &
+celery beat --app=main.libs.tasks --loglevel=DEBUG &
+
+# Stop the container if any of them exits
+wait -n
+exit $?
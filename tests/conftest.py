@@ -1,9 +1,11 @@
 import os
 import sys
+from contextlib import contextmanager
 
 import pytest
 
-from main import db as _db, app as _app
+from main import db as _db, app as _app, redis as _redis, pusher_client
+from main.libs import user_cache, query_stats, metrics
 from database import drop_all, create_all
 
 if os.getenv('FLASK_ENV') != 'test':
@@ -52,3 +54,54 @@ def session(request):
 
     request.addfinalizer(teardown)
     return session
+
+
+@pytest.fixture(scope='function', autouse=True)
+def cache(request):
+    """Clear cached state, testing database ids are reused between runs"""
+    def clear():
+        # Metrics of earlier tests still in process are written first
+        metrics.flush()
+        _redis.flushdb()
+        user_cache.clear_local_cache()
+
+    clear()
+    request.addfinalizer(clear)
+    return _redis
+
+
+@pytest.fixture
+def max_queries():
+    """
+    Fail when a block runs more queries than allowed, e.g.
+        with max_queries(5):
+            get_data('/api/rooms')
+    """
+    @contextmanager
+    def check(limit):
+        with query_stats.collect() as stats:
+            yield stats
+
+        assert stats.count <= limit, '{} queries run, at most {} expected:\n{}'.format(
+            stats.count, limit, '\n'.join('{} x {}'.format(count, statement)
+                                          for statement, count in stats.statements.most_common()))
+
+    return check
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Record batch calls instead of sending them to Pusher"""
+    calls = []
+    monkeypatch.setattr(pusher_client, 'trigger_batch', lambda batch: calls.append(batch))
+    return calls
+
+
+@pytest.fixture
+def events(monkeypatch):
+    """Record sent events as (name, data) instead of sending them to Pusher"""
+    calls = []
+    monkeypatch.setattr(pusher_client, 'trigger', lambda channel, event, data: calls.append((event, data)))
+    monkeypatch.setattr(pusher_client, 'trigger_batch',
+                        lambda batch: calls.extend((event['name'], event['data']) for event in batch))
+    return calls
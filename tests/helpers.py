@@ -3,6 +3,12 @@ import json
 
 from main import app
 from main.models.user import User
+from main.models.room import Room
+from main.models.room_participant import RoomParticipant
+from main.models.video import Video
+from main.models.vote import Vote
+from main.enums import RoomStatus, ParticipantStatus, VideoStatus, VoteStatus
+from main.utils.helpers import encode, create_fingerprint
 
 
 def random_id():
@@ -29,6 +35,43 @@ def setup_user(session, email=None, password='123456', name='Testing User'):
     return user
 
 
+def setup_room(session, creator, name='Testing Room'):
+    """Set up a room with its creator as an online participant"""
+    room = Room(name=name, creator_id=creator.id, fingerprint=create_fingerprint(), status=RoomStatus.ACTIVE)
+    session.add(room)
+    session.commit()
+    setup_participant(session, room, creator)
+    return room
+
+
+def setup_participant(session, room, user, status=ParticipantStatus.IN):
+    participant = RoomParticipant(user_id=user.id, room_id=room.id, status=status)
+    session.add(participant)
+    session.commit()
+    return participant
+
+
+def setup_video(session, room, creator, status=VideoStatus.VOTING, total_vote=1,
+                url='https://www.youtube.com/watch?v=dQw4w9WgXcQ'):
+    """Set up a video proposed by its creator, who up-votes it"""
+    video = Video(room_id=room.id, creator_id=creator.id, url=url, total_vote=total_vote, status=status)
+    session.add(video)
+    session.commit()
+    setup_vote(session, video, creator)
+    return video
+
+
+def setup_vote(session, video, user, status=VoteStatus.UPVOTE):
+    vote = Vote(video_id=video.id, user_id=user.id, status=status)
+    session.add(vote)
+    session.commit()
+    return vote
+
+
+def create_token(user):
+    return encode(user)
+
+
 test_app = app.test_client()
 
 
@@ -0,0 +1,73 @@
+from main.libs import barrier, video_engine
+from main.models.room_participant import RoomParticipant
+from main.enums import VideoStatus, ParticipantStatus
+from tests.helpers import setup_user, setup_room, setup_participant, setup_video, put_data, create_token
+
+
+def _setup_playing_room(session, user_count=3):
+    users = [setup_user(session) for _ in range(user_count)]
+    room = setup_room(session, users[0])
+    for user in users[1:]:
+        setup_participant(session, room, user)
+    video = setup_video(session, room, users[0])
+    video_engine.set_current_video(room.id, video.id)
+    return room, video, users
+
+
+class TestBarrier:
+    def test_all_users_arrive(self, session):
+        room, video, users = _setup_playing_room(session)
+
+        assert not barrier.arrive(room.id, video.id, users[0].id, VideoStatus.READY)
+        assert not barrier.arrive(room.id, video.id, users[1].id, VideoStatus.READY)
+        # Repeated reports are counted once
+        assert not barrier.arrive(room.id, video.id, users[1].id, VideoStatus.READY)
+        assert barrier.arrive(room.id, video.id, users[2].id, VideoStatus.READY)
+
+    def test_barriers_are_per_video_and_status(self, session):
+        room, video, users = _setup_playing_room(session, user_count=2)
+
+        assert not barrier.arrive(room.id, video.id, users[0].id, VideoStatus.READY)
+        assert not barrier.arrive(room.id, video.id + 1, users[1].id, VideoStatus.READY)
+        assert not barrier.arrive(room.id, video.id, users[1].id, VideoStatus.FINISHED)
+
+    def test_reset(self, session):
+        room, video, users = _setup_playing_room(session, user_count=2)
+
+        barrier.arrive(room.id, video.id, users[0].id, VideoStatus.READY)
+        video_engine.set_online_users_video_status(room.id, VideoStatus.PAUSING)
+        assert not barrier.arrive(room.id, video.id, users[1].id, VideoStatus.READY)
+
+    def test_user_leaves(self, session):
+        room, video, users = _setup_playing_room(session)
+
+        barrier.arrive(room.id, video.id, users[0].id, VideoStatus.READY)
+        barrier.arrive(room.id, video.id, users[1].id, VideoStatus.READY)
+
+        participant = RoomParticipant.query \
+            .filter_by(room_id=room.id, user_id=users[1].id).one()
+        participant.status = ParticipantStatus.OUT
+        session.commit()
+        barrier.on_membership_changed(room.id, users[1].id)
+
+        assert not barrier.arrive(room.id, video.id, users[0].id, VideoStatus.READY)
+        assert barrier.arrive(room.id, video.id, users[2].id, VideoStatus.READY)
+
+
+class TestVideoStatusReports:
+    def test_report_without_video_is_rejected(self, session):
+        room, video, users = _setup_playing_room(session, user_count=2)
+
+        res = put_data('/api/rooms/{}/videos'.format(room.id), {'status': VideoStatus.READY, 'video_time': 0},
+                       token=create_token(users[0]))
+        assert res.status_code == 400
+        assert not barrier.arrive(room.id, video.id, users[1].id, VideoStatus.READY)
+
+    def test_report_of_previous_video_is_rejected(self, session):
+        room, video, users = _setup_playing_room(session, user_count=2)
+
+        res = put_data('/api/rooms/{}/videos'.format(room.id),
+                       {'status': VideoStatus.FINISHED, 'video_time': 0, 'video_id': video.id - 1},
+                       token=create_token(users[0]))
+        assert res.status_code == 409
+        assert not barrier.arrive(room.id, video.id, users[1].id, VideoStatus.FINISHED)
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from main.cfg import config
+from main.libs import dispatch, metrics
+
+
+class FakeTask(object):
+    """Celery task recording how it is run"""
+
+    def __init__(self, block=None):
+        self.block = block
+        self.ran = []
+        self.sent = []
+
+    def __call__(self, *args):
+        if self.block is not None:
+            self.block.wait(5)
+        self.ran.append(args)
+
+    def apply_async(self, args=(), countdown=None):
+        self.sent.append(args)
+
+
+@pytest.fixture
+def thread_mode(monkeypatch):
+    monkeypatch.setattr(config, 'EVENT_DISPATCH_MODE', 'thread')
+
+
+def _busy_pool(when_full, block_timeout=0, droppable=False):
+    """Pool with its only worker busy and a full queue"""
+    release = threading.Event()
+    busy = FakeTask(block=release)
+    pool = dispatch.DispatchPool(1, 1, when_full=when_full, block_timeout=block_timeout)
+    pool.submit(busy, ('running',))
+    while pool.queue.qsize():
+        pass
+    pool.submit(busy, ('queued',), droppable=droppable)
+    return pool, busy, release
+
+
+class TestDispatch:
+    def test_celery_mode_sends_to_celery(self):
+        task = FakeTask()
+        dispatch.apply_async(task, (1,))
+        assert task.sent == [(1,)]
+        assert task.ran == []
+
+    def test_thread_mode_runs_in_process(self, thread_mode):
+        task = FakeTask()
+        dispatch.apply_async(task, (1,))
+        dispatch._get_pool().queue.join()
+        assert task.ran == [(1,)]
+        assert task.sent == []
+
+    def test_full_queue_falls_back_to_celery(self, thread_mode, monkeypatch):
+        pool, busy, release = _busy_pool('celery')
+        monkeypatch.setattr(dispatch, '_get_pool', lambda: pool)
+        before = metrics.get_counters(prefix='event_dispatch_fallbacks_total').get('event_dispatch_fallbacks_total', 0)
+
+        task = FakeTask()
+        dispatch.apply_async(task, (1,))
+        assert task.sent == [(1,)]
+        assert metrics.get_counters(prefix='event_dispatch_fallbacks_total')['event_dispatch_fallbacks_total'] == \
+            before + 1
+
+        release.set()
+        pool.queue.join()
+        assert busy.ran == [('running',), ('queued',)]
+
+    def test_drop_oldest_keeps_newest(self):
+        pool, busy, release = _busy_pool('drop_oldest', droppable=True)
+        task = FakeTask()
+        assert pool.submit(task, (1,))
+
+        release.set()
+        pool.queue.join()
+        assert busy.ran == [('running',)]
+        assert task.ran == [(1,)]
+
+    def test_single_flight_tasks_are_not_dropped(self):
+        pool, busy, release = _busy_pool('drop_oldest')
+        assert not pool.submit(FakeTask(), (1,), droppable=True)
+
+        release.set()
+        pool.queue.join()
+        assert busy.ran == [('running',), ('queued',)]
+
+    def test_countdown_does_not_hold_a_worker(self):
+        pool = dispatch.DispatchPool(1, 10)
+        delayed = FakeTask()
+        task = FakeTask()
+        pool.submit(delayed, (1,), countdown=0.2)
+        pool.submit(task, (2,))
+
+        pool.queue.join()
+        assert task.ran == [(2,)]
+        assert delayed.ran == []
+
+        time.sleep(0.3)
+        pool.queue.join()
+        assert delayed.ran == [(1,)]
+
+    def test_delayed_tasks_are_capped(self):
+        pool = dispatch.DispatchPool(1, 10, delayed_size=1)
+        assert pool.submit(FakeTask(), (1,), countdown=60)
+
+        # Single-flight tasks fall back to Celery, droppable ones are dropped
+        assert not pool.submit(FakeTask(), (2,), countdown=60)
+        assert pool.submit(FakeTask(), (3,), countdown=60, droppable=True)
+        assert len(pool._delayed) == 1
+        assert metrics.get_counters(prefix='event_dispatch_dropped_total')['event_dispatch_dropped_total'] == 1
+
+    def test_block_gives_up_after_timeout(self):
+        pool, busy, release = _busy_pool('block', block_timeout=0.01)
+        assert not pool.submit(FakeTask(), (1,))
+        release.set()
@@ -0,0 +1,46 @@
+from main.libs import membership
+from main.models.room_participant import RoomParticipant
+from main.enums import ParticipantStatus
+from tests.helpers import put_data, setup_user, setup_room, setup_participant, create_token
+
+
+class TestMembership:
+    def test_get_status_from_database(self, session):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        setup_participant(session, room, user, status=ParticipantStatus.OUT)
+
+        assert membership.get_status(room.id, creator.id) == ParticipantStatus.IN
+        assert membership.get_status(room.id, user.id) == ParticipantStatus.OUT
+        assert membership.get_status(room.id, 123456) is None
+
+    def test_get_status_from_cache(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        assert membership.is_online(room.id, user.id)
+
+        # Database is not read again
+        RoomParticipant.query.filter_by(room_id=room.id, user_id=user.id).delete()
+        session.commit()
+        assert membership.is_online(room.id, user.id)
+
+    def test_non_member_is_cached_until_status_is_set(self, session):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        assert not membership.is_member(room.id, user.id)
+
+        setup_participant(session, room, user)
+        membership.set_status(room.id, user.id, ParticipantStatus.IN)
+        assert membership.is_online(room.id, user.id)
+
+    def test_exit_room_updates_status(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        assert membership.is_online(room.id, user.id)
+
+        res = put_data('/api/rooms/{}/users'.format(room.id), {}, token=create_token(user))
+        assert res.status_code == 200
+        assert membership.get_status(room.id, user.id) == ParticipantStatus.OUT
+        assert membership.is_member(room.id, user.id)
@@ -0,0 +1,81 @@
+import json
+
+from main.models.message import Message
+from main.enums import ParticipantStatus
+from tests.helpers import get_data, setup_user, setup_room, setup_participant, create_token
+
+
+def _setup_messages(session, room, user, count):
+    messages = [Message(user_id=user.id, room_id=room.id, content='Message {}'.format(i)) for i in range(count)]
+    session.add_all(messages)
+    session.commit()
+    return messages
+
+
+class TestMessageHistory:
+    def test_get_newest_page(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        messages = _setup_messages(session, room, user, 5)
+
+        res = get_data('/api/rooms/{}/messages?limit=3'.format(room.id), token=create_token(user))
+        assert res.status_code == 200
+
+        res_data = json.loads(res.data)['data']
+        assert [m['id'] for m in res_data['messages']] == [m.id for m in messages[-3:]]
+        assert res_data['has_more'] is True
+
+    def test_get_page_before_cursor(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        messages = _setup_messages(session, room, user, 5)
+
+        url = '/api/rooms/{}/messages?before_id={}&limit=3'.format(room.id, messages[2].id)
+        res = get_data(url, token=create_token(user))
+        assert res.status_code == 200
+
+        res_data = json.loads(res.data)['data']
+        assert [m['id'] for m in res_data['messages']] == [messages[0].id, messages[1].id]
+        assert res_data['has_more'] is False
+
+    def test_get_page_after_cursor(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        messages = _setup_messages(session, room, user, 5)
+
+        url = '/api/rooms/{}/messages?after_id={}&limit=2'.format(room.id, messages[1].id)
+        res = get_data(url, token=create_token(user))
+        assert res.status_code == 200
+
+        res_data = json.loads(res.data)['data']
+        assert [m['id'] for m in res_data['messages']] == [messages[2].id, messages[3].id]
+        assert res_data['has_more'] is True
+
+    def test_get_page_with_both_cursors(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+
+        url = '/api/rooms/{}/messages?before_id=10&after_id=1'.format(room.id)
+        res = get_data(url, token=create_token(user))
+        assert res.status_code == 400
+
+    def test_room_info_only_contains_newest_page(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        _setup_messages(session, room, user, 60)
+
+        res = get_data('/api/rooms/{}'.format(room.id), token=create_token(user))
+        assert res.status_code == 200
+
+        res_data = json.loads(res.data)['data']
+        assert len(res_data['messages']) == 50
+        assert res_data['has_more_messages'] is True
+
+    def test_get_messages_of_deleted_participant(self, session):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        setup_participant(session, room, user, status=ParticipantStatus.DELETED)
+
+        res = get_data('/api/rooms/{}/messages'.format(room.id), token=create_token(user))
+        assert res.status_code == 403
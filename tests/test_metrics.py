@@ -0,0 +1,130 @@
+import time
+from collections import defaultdict
+
+import pytest
+from celery.signals import task_prerun
+
+from main import app, pusher_client, redis
+from main.cfg import config
+from main.libs import metrics, pusher, tasks
+from tests.helpers import get_data, setup_user, create_token
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+class TestHistogram:
+    def test_buckets_are_cumulative(self):
+        metrics.observe('test_duration_seconds', 0.3, buckets=(0.1, 0.5, 1), route='a')
+        metrics.observe('test_duration_seconds', 0.05, buckets=(0.1, 0.5, 1), route='a')
+
+        counters = metrics.get_counters(prefix='test_duration_seconds')
+        assert counters['test_duration_seconds_bucket{le="0.1",route="a"}'] == 1
+        assert counters['test_duration_seconds_bucket{le="0.5",route="a"}'] == 2
+        assert counters['test_duration_seconds_bucket{le="1",route="a"}'] == 2
+        assert counters['test_duration_seconds_bucket{le="+Inf",route="a"}'] == 2
+        assert counters['test_duration_seconds_count{route="a"}'] == 2
+        assert counters['test_duration_seconds_sum{route="a"}'] == pytest.approx(0.35)
+
+    def test_render(self, monkeypatch):
+        monkeypatch.setattr(metrics, '_process_gauges', defaultdict(float))
+        metrics.observe('test_duration_seconds', 0.3, buckets=(0.1,))
+        metrics.incr('test_events_total', kind='a')
+        metrics.add_gauge('test_in_progress', 2)
+
+        lines = metrics.render().splitlines()
+        assert '# TYPE test_duration_seconds histogram' in lines
+        assert 'test_duration_seconds_bucket{le="+Inf"} 1.0' in lines
+        assert 'test_duration_seconds_count 1.0' in lines
+        assert '# TYPE test_events_total counter' in lines
+        assert 'test_events_total{kind="a"} 1.0' in lines
+        assert '# TYPE test_in_progress gauge' in lines
+        assert 'test_in_progress 2.0' in lines
+
+
+class TestGauges:
+    def test_process_gauges_are_written_at_once(self, monkeypatch):
+        monkeypatch.setattr(metrics, '_process_gauges', defaultdict(float))
+        metrics.add_gauge('test_in_progress', 1)
+
+        key = metrics._process_gauges_key(metrics._current_process())
+        assert redis.hgetall(key) == {b'test_in_progress': b'1.0'}
+        # Parts of killed processes expire
+        assert 0 < redis.ttl(key) <= config.METRICS_PROCESS_TTL
+
+    def test_parts_are_summed(self, monkeypatch):
+        monkeypatch.setattr(metrics, '_process_gauges', defaultdict(float))
+        metrics.add_gauge('test_in_progress', 2)
+        redis.hset(metrics._process_gauges_key('other:1'), 'test_in_progress', 3)
+
+        assert metrics.get_gauges(prefix='test_')['test_in_progress'] == 5
+
+    def test_flush_at_worker_shutdown(self):
+        metrics.incr('test_events_total')
+        tasks._flush_metrics()
+        assert redis.hget(metrics._metrics_key(), 'test_events_total') == b'1'
+
+
+class TestRequestMetrics:
+    def test_requests_are_recorded_per_endpoint(self, session):
+        token = create_token(setup_user(session))
+        assert get_data('/api/rooms', token=token).status_code == 200
+        assert get_data('/api/missing').status_code == 404
+
+        counters = metrics.get_counters(prefix='http_')
+        assert counters['http_requests_total{endpoint="get_room_list",method="GET",status="200"}'] == 1
+        assert counters['http_requests_total{endpoint="unmatched",method="GET",status="404"}'] == 1
+        assert counters['http_request_duration_seconds_count{endpoint="get_room_list",method="GET"}'] == 1
+        assert metrics.get_gauges()['http_requests_in_progress{endpoint="get_room_list",method="GET"}'] == 0
+
+    def test_metrics_endpoint(self, client):
+        client.get('/api/missing')
+
+        res = client.get('/metrics')
+        assert res.status_code == 200
+        assert res.mimetype == 'text/plain'
+        assert 'http_requests_total{endpoint="unmatched",method="GET",status="404"} 1.0' in res.get_data(True)
+
+    def test_metrics_token(self, client, monkeypatch):
+        monkeypatch.setattr(config, 'METRICS_TOKEN', 'secret')
+
+        assert client.get('/metrics').status_code == 401
+        assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+
+class TestTaskMetrics:
+    def test_task_duration(self):
+        pusher._retry_events.apply()
+
+        counters = metrics.get_counters(prefix='celery_')
+        name = pusher._retry_events.name
+        assert counters['celery_tasks_total{{state="SUCCESS",task="{}"}}'.format(name)] == 1
+        assert counters['celery_task_duration_seconds_count{{task="{}"}}'.format(name)] == 1
+
+    def test_queue_lag(self):
+        task = pusher._retry_events
+        task.push_request(sent_at=time.time() - 3)
+        try:
+            task_prerun.send(sender=task, task_id='lag', task=task)
+        finally:
+            task.pop_request()
+            tasks._started_at.pop('lag', None)
+
+        counters = metrics.get_counters(prefix='celery_task_queue_seconds')
+        assert counters['celery_task_queue_seconds_count{{task="{}"}}'.format(task.name)] == 1
+        assert counters['celery_task_queue_seconds_sum{{task="{}"}}'.format(task.name)] >= 3
+        assert 'celery_task_queue_seconds_bucket{{le="2.5",task="{}"}}'.format(task.name) not in counters
+        assert counters['celery_task_queue_seconds_bucket{{le="5",task="{}"}}'.format(task.name)] == 1
+
+
+class TestPusherMetrics:
+    def test_call_latency(self, monkeypatch):
+        monkeypatch.setattr(config, 'REALTIME_BACKEND', 'pusher')
+        monkeypatch.setattr(pusher_client, 'trigger', lambda channel_name, event, data: None)
+
+        pusher._trigger_pusher(pusher.create_channel_name(1), 'event', {})
+
+        counters = metrics.get_counters(prefix='pusher_request_duration_seconds')
+        assert counters['pusher_request_duration_seconds_count{result="success"}'] == 1
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from main.libs import outbox
+from main.models.outbox_event import OutboxEvent
+from main.enums import PusherEvent
+from tests.helpers import post_data, setup_user, setup_room, setup_participant, setup_video, \
+    create_token
+
+
+@pytest.fixture
+def transactions(request):
+    """Names of the models inserted by each committed transaction"""
+    committed = []
+    inserted = set()
+
+    def after_flush(session, flush_context):
+        inserted.update(type(instance).__name__ for instance in session.new)
+
+    def after_commit(session):
+        if session.transaction.nested:
+            return
+        committed.append(set(inserted))
+        inserted.clear()
+
+    event.listen(Session, 'after_flush', after_flush)
+    event.listen(Session, 'after_commit', after_commit)
+
+    def teardown():
+        event.remove(Session, 'after_flush', after_flush)
+        event.remove(Session, 'after_commit', after_commit)
+
+    request.addfinalizer(teardown)
+    return committed
+
+
+class TestOutbox:
+    def test_events_are_sent_after_commit(self, session, batches):
+        outbox.add(1, 'first', {'index': 0})
+        outbox.add(2, 'other', {'index': 1})
+        outbox.add(1, 'second', {'index': 2})
+        session.flush()
+        assert batches == []
+
+        session.commit()
+        assert [[event['name'] for event in batch] for batch in batches] == [['first', 'second'], ['other']]
+        assert OutboxEvent.query.count() == 0
+
+    def test_rolled_back_events_are_not_sent(self, session, batches):
+        session.begin_nested()
+        outbox.add(1, 'event', {})
+        session.flush()
+        session.rollback()
+
+        session.commit()
+        assert batches == []
+        assert OutboxEvent.query.count() == 0
+
+    def test_failed_request_emits_nothing(self, session, batches, monkeypatch):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        token = create_token(user)
+
+        def fail(**kwargs):
+            raise Exception('Failure after the new video event is recorded')
+
+        monkeypatch.setattr('main.controllers.video.Vote', fail)
+        res = post_data('/api/videos', {'room_id': room.id, 'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'},
+                        token=token)
+
+        assert res.status_code == 500
+        assert batches == []
+        assert OutboxEvent.query.count() == 0
+
+    def test_successful_request_emits_after_commit(self, session, batches):
+        user = setup_user(session)
+        room = setup_room(session, user)
+
+        res = post_data('/api/messages', {'room_id': room.id, 'content': 'Hello'}, token=create_token(user))
+
+        assert res.status_code == 200
+        assert [event['name'] for batch in batches for event in batch] == [PusherEvent.NEW_MESSAGE]
+        assert json.loads(res.data)['data']['content'] == 'Hello'
+
+    def test_events_are_committed_with_their_write(self, session, batches, transactions):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user)
+        voter = setup_user(session)
+        setup_participant(session, room, voter)
+        del transactions[:]
+
+        res = post_data('/api/messages', {'room_id': room.id, 'content': 'Hello'}, token=create_token(user))
+        assert res.status_code == 200
+        assert {'Message', 'OutboxEvent'} in transactions
+
+        res = post_data('/api/videos/{}/vote'.format(video.id), {}, token=create_token(voter))
+        assert res.status_code == 200
+        assert {'Vote', 'OutboxEvent'} in transactions
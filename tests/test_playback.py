@@ -0,0 +1,115 @@
+import json
+import time
+import timeit
+
+from main import redis
+from main.cfg import config
+from main.libs import playback, video_engine
+from main.models.room import Room
+from main.enums import VideoStatus, PusherEvent
+from tests.helpers import setup_user, setup_room, setup_video, put_data, create_token
+
+
+class TestPlayback:
+    def test_room_without_video(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        assert video_engine.get_current_video(room.id) is None
+
+    def test_set_current_video(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user)
+
+        current_video = video_engine.set_current_video(room.id, video.id, video_time=10)
+        assert current_video.id == video.id
+        assert current_video.url == video.url
+        assert current_video.status == VideoStatus.PAUSING
+        assert current_video.video_time == 10
+
+        # State is written behind to database
+        session.refresh(room)
+        assert room.current_video == video.id
+        assert room.video_time == 10
+
+    def test_playing_video_time_moves(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user)
+        video_engine.set_current_video(room.id, video.id, video_time=10, status=VideoStatus.PLAYING)
+
+        time.sleep(0.1)
+        assert video_engine.get_current_video(room.id).video_time > 10
+
+        playback.update(room.id, status=VideoStatus.PAUSING)
+        paused_time = video_engine.get_current_video(room.id).video_time
+        time.sleep(0.1)
+        assert video_engine.get_current_video(room.id).video_time == paused_time
+
+    def test_load_state_on_cache_miss(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user)
+        video_engine.set_current_video(room.id, video.id, video_time=10)
+        redis.flushdb()
+
+        # Unrelated room update must not move the video position
+        room = Room.query.get(room.id)
+        room.name = 'Renamed Room'
+        session.commit()
+
+        current_video = video_engine.get_current_video(room.id)
+        assert current_video.id == video.id
+        assert current_video.video_time == 10
+
+
+class TestPlaybackEvents:
+    def test_compact_status_event(self, session, events):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user)
+        video_engine.set_current_video(room.id, video.id)
+
+        res = put_data('/api/rooms/{}/videos'.format(room.id), {'status': VideoStatus.SEEKING, 'video_time': 42},
+                       token=create_token(user))
+        assert res.status_code == 200
+
+        name, data = events[-1]
+        assert name == PusherEvent.VIDEO_STATUS_CHANGED
+        assert set(data) == {'v', 'event', 'video_id', 'status', 'anchor_time', 'anchored_at', 'seq'}
+        assert data['event'] == VideoStatus.SEEKING
+        assert data['video_id'] == video.id
+        assert data['status'] == VideoStatus.PAUSING
+        assert data['anchor_time'] == 42
+
+    def test_full_video_with_version_1(self, session, monkeypatch):
+        monkeypatch.setattr(config, 'PLAYBACK_EVENT_VERSION', 1)
+        user = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user)
+        state = video_engine.set_current_video(room.id, video.id, video_time=10)
+
+        data = playback.status_event(state, VideoStatus.PAUSING)
+        assert data['data']['url'] == video.url
+        assert data['data']['video_time'] == 10
+        assert playback.proceed_event(state)['url'] == video.url
+        assert playback.proceed_event(None) == {}
+
+    def test_compact_events_are_smaller_and_cheaper(self, session, monkeypatch):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user)
+        state = video_engine.set_current_video(room.id, video.id, video_time=10)
+
+        def measure(version):
+            monkeypatch.setattr(config, 'PLAYBACK_EVENT_VERSION', version)
+            size = len(json.dumps(playback.status_event(state, VideoStatus.PAUSING)))
+            cost = timeit.timeit(lambda: playback.status_event(state, VideoStatus.PAUSING), number=1000)
+            return size, cost
+
+        full_size, full_cost = measure(1)
+        compact_size, compact_cost = measure(2)
+        summary = 'compact: {} bytes in {:.1f} us, full: {} bytes in {:.1f} us'.format(
+            compact_size, compact_cost * 1000, full_size, full_cost * 1000)
+        assert compact_size < full_size, summary
+        assert compact_cost < full_cost, summary
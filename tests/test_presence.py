@@ -0,0 +1,105 @@
+import pytest
+
+from main.cfg import config
+from main.libs import presence, membership
+from main.models.room_participant import RoomParticipant
+from main.enums import ParticipantStatus, PusherEvent
+from tests.helpers import setup_user, setup_room, setup_participant
+
+
+def _member_event(name, room, user):
+    return {'name': name, 'channel': 'presence-room-{}-'.format(room.id), 'user_id': str(user.id)}
+
+
+def _status(room, user):
+    return RoomParticipant.query.filter_by(room_id=room.id, user_id=user.id).one().status
+
+
+class TestPresence:
+    def test_flapping_member_is_collapsed(self, session, events):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        setup_participant(session, room, user, status=ParticipantStatus.IN)
+
+        presence.enqueue(1, [
+            _member_event('member_removed', room, user),
+            _member_event('member_added', room, user),
+            _member_event('member_removed', room, user),
+        ])
+
+        assert _status(room, user) == ParticipantStatus.OUT
+        assert membership.get_status(room.id, user.id) == ParticipantStatus.OUT
+        assert [name for name, _ in events] == [PusherEvent.EXIT_PARTICIPANT]
+
+    def test_unchanged_member_sends_nothing(self, session, events):
+        user = setup_user(session)
+        room = setup_room(session, user)
+
+        presence.enqueue(1, [
+            _member_event('member_removed', room, user),
+            _member_event('member_added', room, user),
+        ])
+
+        assert _status(room, user) == ParticipantStatus.IN
+        assert [name for name, _ in events] == []
+
+    def test_batch_updates_many_members(self, session, events):
+        creator = setup_user(session)
+        room = setup_room(session, creator)
+        users = [setup_user(session) for _ in range(3)]
+        deleted = setup_user(session)
+        for user in users:
+            setup_participant(session, room, user, status=ParticipantStatus.OUT)
+        setup_participant(session, room, deleted, status=ParticipantStatus.DELETED)
+
+        presence.enqueue(1, [_member_event('member_added', room, user) for user in users + [deleted]])
+
+        assert [_status(room, user) for user in users] == [ParticipantStatus.IN] * 3
+        assert _status(room, deleted) == ParticipantStatus.DELETED
+        assert [name for name, _ in events] == [PusherEvent.NEW_PARTICIPANT] * 3
+
+    def test_retried_webhook_is_ignored(self, session, events):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        setup_participant(session, room, user, status=ParticipantStatus.OUT)
+        webhook_events = [_member_event('member_added', room, user)]
+
+        presence.enqueue(1000, webhook_events)
+        participant = RoomParticipant.query.filter_by(room_id=room.id, user_id=user.id).one()
+        participant.status = ParticipantStatus.OUT
+        session.commit()
+
+        presence.enqueue(1000, webhook_events)
+        assert _status(room, user) == ParticipantStatus.OUT
+        assert [name for name, _ in events] == [PusherEvent.NEW_PARTICIPANT]
+
+    def test_failed_batch_is_retried(self, session, events, monkeypatch):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        setup_participant(session, room, user, status=ParticipantStatus.OUT)
+        apply_events = presence.apply_events
+
+        def fail(events):
+            raise Exception('Database is down')
+
+        monkeypatch.setattr(presence, 'apply_events', fail)
+        with pytest.raises(Exception):
+            presence.enqueue(1, [_member_event('member_added', room, user)])
+        assert _status(room, user) == ParticipantStatus.OUT
+
+        monkeypatch.setattr(presence, 'apply_events', apply_events)
+        presence.process_queued_events()
+        assert _status(room, user) == ParticipantStatus.IN
+        assert [name for name, _ in events] == [PusherEvent.NEW_PARTICIPANT]
+
+    def test_failing_batch_is_dropped(self, session, cache, monkeypatch):
+        monkeypatch.setattr(config, 'PRESENCE_MAX_ATTEMPTS', 2)
+        monkeypatch.setattr(presence, 'apply_events', lambda events: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            presence.enqueue(1, [{'name': 'member_added', 'channel': 'presence-room-1-', 'user_id': '1'}])
+
+        presence.process_queued_events()
+        assert cache.llen(presence._queue_key()) == 0
@@ -0,0 +1,134 @@
+import time
+
+import pytest
+
+from main import pusher_client
+from main.cfg import config
+from main.libs import pusher, metrics
+from main.enums import PusherEvent, CircuitState
+
+
+@pytest.fixture
+def failing(monkeypatch):
+    """Pusher fails every call"""
+    def fail(batch):
+        raise Exception('Pusher is down')
+
+    monkeypatch.setattr(pusher_client, 'trigger_batch', fail)
+
+
+@pytest.fixture
+def batching(monkeypatch):
+    """Buffer events as outside of tests, recording scheduled flushes"""
+    scheduled = []
+    monkeypatch.setenv('FLASK_ENV', 'development')
+    monkeypatch.setattr(pusher._flush_channel, 'apply_async', lambda args, countdown: scheduled.append(args))
+    return scheduled
+
+
+class TestBatchDispatch:
+    def test_events_are_buffered_with_one_flush(self, batching):
+        for i in range(3):
+            pusher.trigger(1, 'event', {'index': i})
+
+        assert batching == [(pusher.create_channel_name(1),)]
+
+    def test_flush_sends_in_order_and_in_batches(self, batching, batches):
+        for i in range(25):
+            pusher.trigger(1, 'event', {'index': i})
+        before = metrics.get_counters(prefix='pusher_')
+
+        pusher._flush_channel(pusher.create_channel_name(1))
+
+        assert [len(batch) for batch in batches] == [10, 10, 5]
+        assert [event['data']['index'] for batch in batches for event in batch] == list(range(25))
+        assert {event['channel'] for batch in batches for event in batch} == {pusher.create_channel_name(1)}
+
+        after = metrics.get_counters(prefix='pusher_')
+        assert after['pusher_batches_total'] - before.get('pusher_batches_total', 0) == 3
+        assert after['pusher_calls_saved_total'] - before.get('pusher_calls_saved_total', 0) == 22
+
+    def test_flush_reschedules_for_late_events(self, batching, batches, monkeypatch):
+        channel_name = pusher.create_channel_name(1)
+        pusher.trigger(1, 'event', {'index': 0})
+
+        def send_and_receive(channel, events):
+            pusher.trigger(1, 'event', {'index': 1})
+
+        monkeypatch.setattr(pusher, 'send_batch', send_and_receive)
+        pusher._flush_channel(channel_name)
+        assert batching == [(channel_name,), (channel_name,)]
+
+    def test_channels_are_buffered_separately(self, batching, batches):
+        pusher.trigger(1, 'event', {'room': 1})
+        pusher.trigger(2, 'event', {'room': 2})
+
+        pusher._flush_channel(pusher.create_channel_name(1))
+        assert [event['data'] for batch in batches for event in batch] == [{'room': 1, 'seq': 1}]
+
+
+def _event(name, queued_at=None):
+    return {'name': name, 'data': {}, 'queued_at': queued_at or time.time()}
+
+
+def _retry_queue(cache):
+    return cache.lrange(pusher._retry_key(), 0, -1)
+
+
+class TestCircuitBreaker:
+    def test_failures_open_the_circuit(self, failing, cache):
+        channel_name = pusher.create_channel_name(1)
+        for _ in range(config.PUSHER_BREAKER_FAILURES):
+            assert pusher.breaker.get_state() == CircuitState.CLOSED
+            pusher.send_batch(channel_name, [_event(PusherEvent.PROCEED)])
+
+        assert pusher.breaker.get_state() == CircuitState.OPEN
+        assert metrics.get_gauges()['circuit_state{circuit="pusher"}'] == CircuitState.OPEN
+        assert len(_retry_queue(cache)) == config.PUSHER_BREAKER_FAILURES
+
+    def test_open_circuit_sheds_low_priority_events(self, batches, cache):
+        pusher.breaker.open()
+        pusher.send_batch(pusher.create_channel_name(1), [_event(PusherEvent.UP_VOTE),
+                                                         _event(PusherEvent.VIDEO_STATUS_CHANGED)])
+
+        assert batches == []
+        assert len(_retry_queue(cache)) == 1
+        assert metrics.get_counters()['pusher_events_shed_total{event="up_vote"}'] >= 1
+
+    def test_half_open_circuit_lets_one_probe_through(self, batches, cache):
+        pusher.breaker.open()
+        cache.delete(pusher.breaker._key('open'))
+        assert pusher.breaker.get_state() == CircuitState.HALF_OPEN
+
+        assert pusher.breaker.allow()
+        assert not pusher.breaker.allow()
+        pusher.breaker.record_success()
+        assert pusher.breaker.get_state() == CircuitState.CLOSED
+
+    def test_failed_probe_opens_the_circuit(self, failing, cache):
+        pusher.breaker.open()
+        cache.delete(pusher.breaker._key('open'))
+
+        pusher.send_batch(pusher.create_channel_name(1), [_event(PusherEvent.PROCEED)])
+        assert pusher.breaker.get_state() == CircuitState.OPEN
+
+    def test_deferred_events_are_retried(self, batches, cache):
+        channel_name = pusher.create_channel_name(1)
+        pusher.breaker.open()
+        pusher.send_batch(channel_name, [_event(PusherEvent.PROCEED),
+                                         _event(PusherEvent.VIDEO_STATUS_CHANGED, queued_at=time.time() - 3600)])
+
+        # Reset timeout is over, the retry probes the circuit
+        cache.delete(pusher.breaker._key('open'))
+        pusher.retry_events()
+
+        assert [[event['name'] for event in batch] for batch in batches] == [[PusherEvent.PROCEED]]
+        assert _retry_queue(cache) == []
+        assert pusher.breaker.get_state() == CircuitState.CLOSED
+
+    def test_retry_queue_is_bounded(self, cache, monkeypatch):
+        monkeypatch.setattr(config, 'PUSHER_RETRY_QUEUE_SIZE', 3)
+        pusher.breaker.open()
+        pusher.send_batch(pusher.create_channel_name(1), [_event(PusherEvent.PROCEED) for _ in range(5)])
+
+        assert len(_retry_queue(cache)) == 3
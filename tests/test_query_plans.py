@@ -0,0 +1,121 @@
+import re
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from main.controllers.room import _get_room_snapshot
+from main.libs import video_engine, video_queue, message_history, barrier
+from main.models.user import User
+from main.models.video import Video
+from main.enums import VideoStatus, ParticipantStatus
+from tests.helpers import setup_user, setup_room, setup_participant, setup_video, post_data, create_token
+
+
+@contextmanager
+def capture(table, where=''):
+    """
+    Collect statements run on a table and their parameters, from the same engine event as query stats
+    :param where: text which collected statements contain, e.g. a filter on a column
+    """
+    pattern = re.compile(r'^(SELECT\b.*\bFROM|UPDATE|DELETE FROM) {}\b'.format(table), re.DOTALL)
+    queries = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if pattern.search(statement) and where in statement:
+            queries.append((statement, parameters))
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        yield queries
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+
+
+def explain(session, statement, parameters):
+    """Run EXPLAIN on a statement as it was sent to the database and return its plan rows"""
+    return [dict(row) for row in session.connection().execute('EXPLAIN {}'.format(statement), parameters)]
+
+
+def assert_no_full_scan(session, queries, table, index):
+    assert queries, 'No statement run on {}'.format(table)
+    for statement, parameters in queries:
+        plan = explain(session, statement, parameters)
+        # Derived tables, e.g. of count queries, are read whole by design
+        for row in plan:
+            if row['table'].startswith('<derived'):
+                continue
+            assert row['type'] != 'ALL', 'Full table scan on {}: {}\n{}'.format(row['table'], row, statement)
+
+        table_rows = [row for row in plan if row['table'] == table]
+        assert table_rows and table_rows[0]['key'] == index, \
+            'Expected index {}, got {}\n{}'.format(index, table_rows, statement)
+
+
+def _setup_rooms(session, count=5, videos_per_room=5):
+    rooms = []
+    for _ in range(count):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        setup_participant(session, room, user, status=ParticipantStatus.OUT)
+        for i in range(videos_per_room):
+            setup_video(session, room, creator, total_vote=i)
+        rooms.append(room)
+    return rooms
+
+
+class TestHotQueryPlans:
+    def test_load_video_queue(self, session):
+        room = _setup_rooms(session)[0]
+        with capture('videos') as queries:
+            video_queue.rebuild(room.id)
+        assert_no_full_scan(session, queries, 'videos', 'ix_videos_room_id_status_total_vote')
+
+    def test_get_room_videos(self, session):
+        room = _setup_rooms(session)[0]
+        user = User.query.get(room.creator_id)
+        with capture('videos', where='videos.room_id = ') as queries:
+            _get_room_snapshot(room, user)
+        assert_no_full_scan(session, queries, 'videos', 'ix_videos_room_id_status_total_vote')
+
+    def test_change_vote(self, session):
+        room = _setup_rooms(session)[0]
+        video = Video.query.filter_by(room_id=room.id).first()
+        with capture('votes') as queries:
+            video_engine.down_vote(video, setup_user(session).id)
+        assert_no_full_scan(session, queries, 'votes', 'uq_votes_user_id_video_id')
+
+    def test_set_is_voted(self, session):
+        room = _setup_rooms(session)[0]
+        videos = Video.query.filter_by(room_id=room.id).all()
+        with capture('votes') as queries:
+            video_engine.set_is_voted(videos, room.creator_id)
+        assert_no_full_scan(session, queries, 'votes', 'uq_votes_user_id_video_id')
+
+    def test_get_message_page(self, session):
+        room = _setup_rooms(session)[0]
+        with capture('messages') as queries:
+            message_history.get_message_page(room.id, before_id=1000)
+        assert_no_full_scan(session, queries, 'messages', 'ix_messages_room_id_id')
+
+    def test_count_online_users(self, session):
+        room = _setup_rooms(session)[0]
+        with capture('room_participants') as queries:
+            barrier.count_online_users(room.id)
+        assert_no_full_scan(session, queries, 'room_participants',
+                            'ix_room_participants_room_id_status_video_status')
+
+    def test_set_online_users_video_status(self, session):
+        room = _setup_rooms(session)[0]
+        with capture('room_participants') as queries:
+            video_engine.set_online_users_video_status(room.id, VideoStatus.PAUSING)
+        assert_no_full_scan(session, queries, 'room_participants',
+                            'ix_room_participants_room_id_status_video_status')
+
+    def test_get_room_by_fingerprint(self, session):
+        room = _setup_rooms(session)[0]
+        token = create_token(setup_user(session))
+        with capture('rooms', where='rooms.fingerprint = ') as queries:
+            post_data('/api/rooms/fingerprint', {'fingerprint': room.fingerprint}, token=token)
+        assert_no_full_scan(session, queries, 'rooms', 'uq_rooms_fingerprint')
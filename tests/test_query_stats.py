@@ -0,0 +1,149 @@
+import json
+import logging
+
+import pytest
+
+from main import app
+from main.libs import query_stats, video_engine
+from main.models.message import Message
+from main.models.room import Room
+from main.models.user import User
+from main.models.video import Video
+from main.enums import VideoStatus
+from tests.helpers import get_data, post_data, put_data, delete_data, setup_user, setup_room, setup_participant, setup_video, \
+    create_token
+
+ROOM_SIZE = 10
+
+
+@pytest.fixture
+def room(session):
+    """Room with ROOM_SIZE participants, each proposing a video and sending a message, and its creator's token"""
+    creator = setup_user(session)
+    room = setup_room(session, creator)
+    for _ in range(ROOM_SIZE):
+        user = setup_user(session)
+        setup_participant(session, room, user)
+        setup_video(session, room, user)
+        session.add(Message(user_id=user.id, room_id=room.id, content='Hello'))
+    session.commit()
+    return room, create_token(creator)
+
+
+class TestQueryStats:
+    def test_queries_are_counted(self, session):
+        with query_stats.collect() as stats:
+            for _ in range(5):
+                Room.query.filter(Room.id == 1).all()
+            Message.query.all()
+
+        assert stats.count == 6
+        assert stats.duration > 0
+        assert list(stats.duplicates.values()) == [5]
+
+    def test_headers_in_debug(self, session, room, monkeypatch):
+        room, token = room
+        monkeypatch.setattr(app, 'debug', True)
+        res = get_data('/api/rooms/{}'.format(room.id), token=token)
+
+        assert int(res.headers['X-Query-Count']) > 0
+        assert float(res.headers['X-Query-Time-Ms']) > 0
+        assert res.headers['X-Query-Duplicates'] == '0'
+
+    def test_log_line(self, session, room, caplog):
+        room, token = room
+        caplog.set_level(logging.INFO)
+        get_data('/api/rooms/{}'.format(room.id), token=token)
+
+        line, = [record.getMessage() for record in caplog.records if record.getMessage().startswith('request_queries')]
+        data = json.loads(line[len('request_queries '):])
+        assert data['path'] == '/api/rooms/{}'.format(room.id)
+        assert data['status'] == 200
+        assert data['queries'] > 0
+        assert data['duplicates'] == []
+
+
+class TestEndpointQueries:
+    """Budgets of queries per request. Writes include the outbox relay, run in the request in tests"""
+    def test_room_list(self, session, room, max_queries):
+        room, token = room
+        with max_queries(2):
+            assert get_data('/api/rooms', token=token).status_code == 200
+
+    def test_room_info(self, session, room, max_queries):
+        room, token = room
+        url = '/api/rooms/{}'.format(room.id)
+        with max_queries(7):
+            assert get_data(url, token=token).status_code == 200
+
+    def test_room_messages(self, session, room, max_queries):
+        room, token = room
+        url = '/api/rooms/{}/messages'.format(room.id)
+        with max_queries(3):
+            assert get_data(url, token=token).status_code == 200
+
+    def test_send_message(self, session, room, max_queries):
+        room, token = room
+        data = {'room_id': room.id, 'content': 'Hello'}
+        with max_queries(8):
+            assert post_data('/api/messages', data, token=token).status_code == 200
+
+    def test_video_status(self, session, room, max_queries):
+        room, token = room
+        video_engine.set_current_video(room.id)
+        url = '/api/rooms/{}/videos'.format(room.id)
+        with max_queries(6):
+            assert put_data(url, {'status': VideoStatus.PAUSING, 'video_time': 1}, token=token).status_code == 200
+
+    def test_up_vote(self, session, room, max_queries):
+        room, token = room
+        video = Video.query.filter_by(room_id=room.id).first()
+        with max_queries(13):
+            assert post_data('/api/videos/{}/vote'.format(video.id), {}, token=token).status_code == 200
+
+    def test_down_vote(self, session, room, max_queries):
+        room, token = room
+        video = Video.query.filter_by(room_id=room.id).first()
+        post_data('/api/videos/{}/vote'.format(video.id), {}, token=token)
+        with max_queries(10):
+            assert delete_data('/api/videos/{}/vote'.format(video.id), token=token).status_code == 200
+
+    def test_add_video(self, session, room, max_queries):
+        room, token = room
+        data = {'room_id': room.id, 'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'}
+        with max_queries(18):
+            assert post_data('/api/videos', data, token=token).status_code == 200
+
+    def test_exit_and_rejoin(self, session, room, max_queries):
+        room, token = room
+        creator = User.query.get(room.creator_id)
+        url = '/api/rooms/{}/users'.format(room.id)
+        with max_queries(8):
+            assert put_data(url, {}, token=token).status_code == 200
+        with max_queries(11):
+            assert post_data(url, {'email': creator.email}, token=token).status_code == 200
+
+    def test_leave(self, session, room, max_queries):
+        room, token = room
+        with max_queries(9):
+            assert delete_data('/api/rooms/{}/users'.format(room.id), token=token).status_code == 200
+
+    def test_room_events(self, session, room, max_queries):
+        room, token = room
+        post_data('/api/messages', {'room_id': room.id, 'content': 'Hello'}, token=token)
+        url = '/api/rooms/{}/events?since='.format(room.id)
+        # Missed events are replayed from Redis
+        with max_queries(0):
+            assert get_data(url + '0', token=token).status_code == 200
+        # A sequence number which is no longer kept gets a snapshot
+        with max_queries(5):
+            assert get_data(url + '1000', token=token).status_code == 200
+
+    def test_get_song(self, session, room, max_queries):
+        room, token = room
+        video_engine.set_current_video(room.id)
+        url = '/api/rooms/{}/videos?type='.format(room.id)
+        with max_queries(2):
+            assert get_data(url + 'current', token=token).status_code == 200
+        with max_queries(1):
+            assert get_data(url + 'next', token=token).status_code == 200
@@ -0,0 +1,146 @@
+import json
+import threading
+
+import pytest
+
+from main.cfg import config
+from main.libs import rate_limit, video_engine
+from main.libs.rate_limit import LocalLimiter
+from main.enums import VideoStatus
+from tests.helpers import post_data, put_data, setup_user, setup_room, setup_video, create_token
+
+
+@pytest.fixture
+def redis_calls(monkeypatch):
+    """Count calls of the shared limiter"""
+    calls = []
+    record = rate_limit._record
+
+    def count(*args, **kwargs):
+        calls.append(args)
+        return record(*args, **kwargs)
+
+    monkeypatch.setattr(rate_limit, '_record', count)
+    return calls
+
+
+def _workers(count, batch=5):
+    return [LocalLimiter(size=100, ttl=60, batch=batch, sync_interval=60) for _ in range(count)]
+
+
+class TestRateLimit:
+    def test_hits_over_rate_are_rejected(self):
+        assert [rate_limit.hit('test', 3, 60)[0] for _ in range(5)] == [True, True, True, False, False]
+
+        allowed, retry_after = rate_limit.hit('test', 3, 60)
+        assert not allowed
+        assert 59 < retry_after <= 60
+
+    def test_window_slides(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(rate_limit.time, 'time', lambda: now[0])
+
+        assert rate_limit.hit('test', 2, 10)[0]
+        now[0] += 6
+        assert rate_limit.hit('test', 2, 10)[0]
+        assert not rate_limit.hit('test', 2, 10)[0]
+
+        # Only the first hit left the window
+        now[0] += 5
+        assert rate_limit.hit('test', 2, 10)[0]
+        assert not rate_limit.hit('test', 2, 10)[0]
+
+    def test_concurrent_hits_do_not_exceed_rate(self):
+        results = []
+
+        def hit():
+            for _ in range(10):
+                results.append(rate_limit.hit('test', 25, 60)[0])
+
+        threads = [threading.Thread(target=hit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results.count(True) == 25
+
+    def test_login_is_limited_per_email(self, session):
+        setup_user(session, email='limited@test.com')
+        for _ in range(config.LOGIN_RATE_LIMIT):
+            res = post_data('/api/login', {'email': 'limited@test.com', 'password': 'wrong1'})
+            assert res.status_code == 401
+
+        res = post_data('/api/login', {'email': 'limited@test.com', 'password': '123456'})
+        assert res.status_code == 429
+        assert json.loads(res.data)['error_data']['retry_after'] > 0
+
+        res = post_data('/api/login', {'email': 'other@test.com', 'password': '123456'})
+        assert res.status_code == 401
+
+    def test_only_seeking_and_pausing_are_limited(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user)
+        video_engine.set_current_video(room.id, video.id)
+        token = create_token(user)
+        url = '/api/rooms/{}/videos'.format(room.id)
+
+        for _ in range(config.VIDEO_STATUS_RATE_LIMIT):
+            assert put_data(url, {'status': VideoStatus.PAUSING, 'video_time': 1}, token=token).status_code == 200
+
+        assert put_data(url, {'status': VideoStatus.SEEKING, 'video_time': 1}, token=token).status_code == 429
+        assert put_data(url, {'status': VideoStatus.PLAYING, 'video_time': 1}, token=token).status_code == 200
+
+
+class TestLocalLimiter:
+    def test_hits_are_synced_in_batches(self, redis_calls, cache):
+        worker, = _workers(1)
+        assert all(worker.hit('test', 100, 60)[0] for _ in range(50))
+
+        # First hit learns the shared state, then every fifth
+        assert len(redis_calls) == 1 + 49 // 5
+        assert cache.zcard(rate_limit._key('test')) == 1 + 45
+
+    def test_rejected_caller_is_rejected_locally(self, redis_calls):
+        worker, = _workers(1)
+        results = [worker.hit('test', 10, 60) for _ in range(100)]
+
+        assert [allowed for allowed, _ in results].count(True) <= 10 + 5
+        assert len(redis_calls) <= 1 + 15 // 5
+        assert all(0 < retry_after <= 60 for allowed, retry_after in results if not allowed)
+
+    def test_accuracy_across_workers(self):
+        workers = _workers(4)
+        allowed = [workers[i % 4].hit('test', 20, 60)[0] for i in range(400)]
+
+        assert 20 <= allowed.count(True) <= 20 + 4 * (5 - 1)
+
+    def test_caller_under_rate_is_never_rejected(self):
+        workers = _workers(4)
+        assert all(workers[i % 4].hit('test', 20, 60)[0] for i in range(20))
+
+        # Shared state is only learnt on the next sync, but the limit is then enforced
+        allowed = [workers[i % 4].hit('test', 20, 60)[0] for i in range(100)]
+        assert allowed.count(True) <= 4 * 5
+
+    def test_pending_hits_are_synced_without_new_hits(self, cache, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(rate_limit.time, 'time', lambda: now[0])
+        worker, = _workers(1)
+        assert all(worker.hit('test', 100, 600)[0] for _ in range(3))
+        assert cache.zcard(rate_limit._key('test')) == 1
+
+        # Only hits not synced within the interval are sent
+        worker.flush()
+        assert cache.zcard(rate_limit._key('test')) == 1
+        now[0] += 60
+        worker.flush()
+        assert cache.zcard(rate_limit._key('test')) == 3
+
+    def test_enabled_by_config(self, monkeypatch, redis_calls):
+        monkeypatch.setattr(config, 'RATE_LIMIT_LOCAL_ENABLED', True)
+        monkeypatch.setattr(rate_limit, '_local_limiter', _workers(1)[0])
+
+        assert all(rate_limit.hit('test', 10, 60)[0] for _ in range(3))
+        assert len(redis_calls) == 1
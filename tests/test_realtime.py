@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from main.cfg import config
+from main.libs import realtime, presence
+from main.libs.gateway import Gateway, Subscriber, parse_subscription
+from main.models.room_participant import RoomParticipant
+from main.enums import ParticipantStatus
+from tests.helpers import test_app, setup_user, setup_room, setup_participant, create_token
+
+
+@pytest.fixture
+def redis_backend(monkeypatch):
+    monkeypatch.setattr(config, 'REALTIME_BACKEND', 'redis')
+    return realtime.get_backend()
+
+
+def _request_line(channel_name, socket_id, user_id, signature):
+    query = 'socket_id={}&user_id={}&auth={}'.format(socket_id, user_id, signature)
+    return 'GET /channels/{}?{} HTTP/1.1\r\n'.format(channel_name, query).encode('utf-8')
+
+
+class TestRedisBackend:
+    def test_batch_is_published_in_order(self, redis_backend, cache):
+        pubsub = cache.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(realtime.pubsub_channel('presence-room-1-'))
+
+        redis_backend.trigger_batch('presence-room-1-', [{'name': 'first', 'data': {}}, {'name': 'second', 'data': {}}])
+
+        # Subscribe confirmations are read as None
+        messages = [pubsub.get_message(timeout=1) for _ in range(3)]
+        events = [json.loads(message['data'].decode('utf-8'))['event'] for message in messages if message]
+        assert events == ['first', 'second']
+
+    def test_authenticated_subscription_is_accepted(self, session, redis_backend):
+        user = setup_user(session)
+        channel_name = 'presence-room-1-'
+        res = test_app.post('/api/pusher/auth', data={'channel_name': channel_name, 'socket_id': '1.2'},
+                            headers={'Authorization': 'Bearer {}'.format(create_token(user))})
+        assert res.status_code == 200
+
+        signature = json.loads(res.data)['auth']
+        subscriber = parse_subscription(_request_line(channel_name, '1.2', user.id, signature), None)
+        assert subscriber.user_id == user.id
+        assert parse_subscription(_request_line(channel_name, '1.3', user.id, signature), None) is None
+        assert parse_subscription(_request_line(channel_name, '1.2', user.id + 1, signature), None) is None
+
+
+class TestGatewayPresence:
+    def test_members_are_added_and_removed_once(self):
+        gateway = Gateway()
+        first = Subscriber('presence-room-1-', '1.1', 1, None)
+        second = Subscriber('presence-room-1-', '1.2', 1, None)
+
+        assert [event['name'] for event in gateway.join(first)] == ['member_added']
+        assert gateway.join(second) == []
+        assert gateway.leave(first) == []
+        assert [event['name'] for event in gateway.leave(second)] == ['member_removed', 'channel_vacated']
+        assert gateway.members == {}
+
+    def test_presence_events_update_participants(self, session):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        setup_participant(session, room, user, status=ParticipantStatus.OUT)
+
+        gateway = Gateway()
+        subscriber = Subscriber('presence-room-{}-'.format(room.id), '1.1', user.id, None)
+        presence.enqueue(1, gateway.join(subscriber))
+
+        participant = RoomParticipant.query.filter_by(room_id=room.id, user_id=user.id).one()
+        assert participant.status == ParticipantStatus.IN
@@ -0,0 +1,113 @@
+import pytest
+
+from main import db, app
+from main.libs import membership, replica, video_engine
+from main.models.room import Room
+from main.utils.routing import RoutingSession
+from tests.helpers import get_data, post_data, setup_user, setup_room, setup_participant, setup_video, create_token
+
+
+@pytest.fixture
+def replica_reads(monkeypatch):
+    """Configure a replica, recording reads routed to it but running them on the primary"""
+    reads = []
+
+    def get_replica(session):
+        reads.append(1)
+        return session.bind
+
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', {'replica': 'sqlite://'})
+    monkeypatch.setattr(RoutingSession, '_get_replica', get_replica)
+    return reads
+
+
+class TestReplicaRouting:
+    def test_pool_checks_connections(self):
+        assert db.engine.pool._pre_ping
+
+    def test_reads_go_to_replica_until_session_writes(self, session, replica_reads):
+        user = setup_user(session)
+        session.info.pop('wrote')
+        session.info['use_replica'] = True
+
+        Room.query.all()
+        assert len(replica_reads) == 1
+
+        # Locking reads need the primary
+        Room.query.with_for_update().all()
+        assert len(replica_reads) == 1
+
+        session.add(Room(name='Testing Room', creator_id=user.id, fingerprint='replica1'))
+        session.flush()
+        Room.query.all()
+        assert len(replica_reads) == 1
+
+    def test_bulk_updates_count_as_writes(self, session, replica_reads):
+        session.info['use_replica'] = True
+        Room.query.filter(Room.id == 0).update({Room.name: 'Renamed Room'}, synchronize_session=False)
+
+        Room.query.all()
+        assert replica_reads == []
+
+    def test_no_routing_without_replica(self, session):
+        session.info['use_replica'] = True
+        assert session.get_bind(clause=Room.__table__.select()) is session.bind
+
+    def test_read_endpoint_uses_replica(self, session, replica_reads):
+        user = setup_user(session)
+        setup_room(session, user)
+
+        res = get_data('/api/rooms', token=create_token(user))
+        assert res.status_code == 200
+        assert len(replica_reads) == 1
+
+    def test_snapshot_is_read_from_primary(self, session, replica_reads):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        url = '/api/rooms/{}'.format(room.id)
+
+        # A snapshot must have the changes of all events until its seq, since=5 gets one as there are no events
+        assert get_data(url, token=create_token(user)).status_code == 200
+        assert get_data(url + '/events?since=5', token=create_token(user)).status_code == 200
+        assert replica_reads == []
+
+    def test_recent_writer_reads_from_primary(self, session, replica_reads):
+        writer = setup_user(session)
+        reader = setup_user(session)
+        room = setup_room(session, writer)
+        setup_participant(session, room, reader)
+        res = post_data('/api/messages', {'room_id': room.id, 'content': 'Hello'}, token=create_token(writer))
+        assert res.status_code == 200
+        assert replica.has_recent_write(writer.id)
+        assert not replica.has_recent_write(reader.id)
+        del replica_reads[:]
+
+        url = '/api/rooms/{}/messages'.format(room.id)
+        assert get_data(url, token=create_token(writer)).status_code == 200
+        assert replica_reads == []
+
+        assert get_data(url, token=create_token(reader)).status_code == 200
+        assert replica_reads
+
+    def test_cached_state_is_read_from_primary(self, session, replica_reads):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        session.info['use_replica'] = True
+
+        with replica.primary():
+            assert 'use_replica' not in session.info
+        assert session.info['use_replica']
+
+        membership.get_status(room.id, user.id)
+        assert replica_reads == []
+
+    def test_next_video_is_read_from_primary(self, session, replica_reads):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        room_id, video_id = room.id, setup_video(session, room, user).id
+        session.info.pop('wrote')
+        session.info['use_replica'] = True
+
+        # The queue is shared, a video missing on the replica must not be dropped from it
+        assert video_engine.get_next_video(room_id).id == video_id
+        assert replica_reads == []
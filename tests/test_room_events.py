@@ -0,0 +1,83 @@
+import json
+
+from main.cfg import config
+from main.libs import room_events, outbox
+from tests.helpers import get_data, setup_user, setup_room, create_token
+
+
+def _get_events(room, user, since):
+    res = get_data('/api/rooms/{}/events?since={}'.format(room.id, since), token=create_token(user))
+    assert res.status_code == 200
+    return json.loads(res.data)['data']
+
+
+def _append(room_id, count):
+    for i in range(count):
+        room_events.append(room_id, [{'name': 'event', 'data': {'index': i}}])
+
+
+class TestRoomEvents:
+    def test_events_are_numbered_per_room(self):
+        first = [{'name': 'event', 'data': {}}, {'name': 'event', 'data': {}}]
+        other = [{'name': 'event', 'data': {}}]
+        room_events.append(1, first)
+        room_events.append(2, other)
+
+        assert [event['data']['seq'] for event in first] == [1, 2]
+        assert other[0]['data']['seq'] == 1
+        assert room_events.get_last_seq(1) == 2
+
+    def test_outbox_events_carry_sequence(self, session, monkeypatch):
+        sent = []
+        monkeypatch.setattr('main.libs.pusher.send_batch', lambda channel_name, events: sent.extend(events))
+
+        outbox.add(1, 'first', {})
+        outbox.add(1, 'second', {})
+        session.commit()
+
+        assert [event['data']['seq'] for event in sent] == [1, 2]
+
+    def test_missed_events_are_returned(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        _append(room.id, 5)
+
+        data = _get_events(room, user, since=3)
+        assert [event['seq'] for event in data['events']] == [4, 5]
+        assert [event['data']['index'] for event in data['events']] == [3, 4]
+        assert data['seq'] == 5
+        assert data['snapshot'] is None
+
+        data = _get_events(room, user, since=5)
+        assert data['events'] == []
+        assert data['seq'] == 5
+
+    def test_snapshot_when_events_are_no_longer_kept(self, session, monkeypatch):
+        monkeypatch.setattr(config, 'ROOM_EVENTS_MAXLEN', 3)
+        user = setup_user(session)
+        room = setup_room(session, user)
+        _append(room.id, 5)
+
+        assert len(_get_events(room, user, since=2)['events']) == 3
+
+        data = _get_events(room, user, since=1)
+        assert data['events'] is None
+        assert data['seq'] == 5
+        assert data['snapshot']['name'] == room.name
+        assert data['snapshot']['seq'] == 5
+
+    def test_snapshot_when_sequence_was_reset(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+
+        data = _get_events(room, user, since=10)
+        assert data['events'] is None
+        assert data['snapshot']['seq'] == 0
+
+    def test_only_members_get_events(self, session):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+
+        res = get_data('/api/rooms/{}/events?since=0'.format(room.id), token=create_token(user))
+        assert res.status_code == 403
@@ -0,0 +1,59 @@
+import pytest
+
+from main.libs.tasks import celery_app
+from main.libs import outbox, dispatch, queue_metrics, metrics
+from main.models.outbox_event import OutboxEvent
+from main.enums import PusherEvent, TaskQueue
+
+
+def _queue_of(task_name):
+    return celery_app.amqp.router.route({}, task_name)['queue'].name
+
+
+@pytest.fixture
+def scheduled(monkeypatch):
+    """Record queues of scheduled relays instead of sending them to Celery"""
+    queues = []
+    monkeypatch.setenv('FLASK_ENV', 'development')
+    monkeypatch.setattr(dispatch, 'apply_async', lambda task, args=(), countdown=0, queue=None:
+                        queues.append(queue or _queue_of(task.name)))
+    return queues
+
+
+class TestTaskQueues:
+    def test_tasks_are_routed(self):
+        assert _queue_of('main.libs.outbox._relay_critical_outbox') == TaskQueue.REALTIME_CRITICAL
+        assert _queue_of('main.libs.outbox._relay_outbox') == TaskQueue.REALTIME_BULK
+        assert _queue_of('main.libs.pusher._flush_channel') == TaskQueue.REALTIME_BULK
+        assert _queue_of('main.libs.playback._persist_state') == TaskQueue.BACKGROUND
+        assert _queue_of('main.libs.queue_metrics.report_queue_metrics') == TaskQueue.BACKGROUND
+
+    def test_playback_events_are_relayed_on_their_own(self, session, scheduled, batches):
+        outbox.add(1, PusherEvent.NEW_MESSAGE, {})
+        outbox.add(1, PusherEvent.PROCEED, {})
+        session.commit()
+
+        assert scheduled == [TaskQueue.REALTIME_CRITICAL, TaskQueue.REALTIME_BULK]
+
+        # Chat events waiting to be relayed do not hold back playback events
+        assert outbox.relay(critical=True) == 1
+        assert [event['name'] for batch in batches for event in batch] == [PusherEvent.PROCEED]
+        assert [row.name for row in OutboxEvent.query.all()] == [PusherEvent.NEW_MESSAGE]
+
+    def test_report_queue_metrics(self, cache, monkeypatch):
+        probes = []
+        monkeypatch.setattr(queue_metrics, '_broker', cache)
+        monkeypatch.setattr(queue_metrics._probe_queue_latency, 'apply_async',
+                            lambda args, queue: probes.append(queue))
+        cache.rpush(TaskQueue.REALTIME_BULK, 'message', 'message')
+
+        queue_metrics.report_queue_metrics()
+
+        gauges = metrics.get_gauges(prefix='celery_queue_depth')
+        assert gauges['celery_queue_depth{{queue="{}"}}'.format(TaskQueue.REALTIME_BULK)] == 2
+        assert gauges['celery_queue_depth{{queue="{}"}}'.format(TaskQueue.REALTIME_CRITICAL)] == 0
+        assert sorted(probes) == sorted([TaskQueue.REALTIME_CRITICAL, TaskQueue.REALTIME_BULK, TaskQueue.BACKGROUND])
+
+    def test_probe_records_latency(self):
+        queue_metrics._probe_queue_latency(TaskQueue.BACKGROUND, 0)
+        assert metrics.get_gauges()['celery_queue_latency_seconds{queue="background"}'] > 0
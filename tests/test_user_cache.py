@@ -0,0 +1,85 @@
+import time
+
+from main.libs import user_cache
+from main.libs.user_cache import LocalCache
+from tests.helpers import get_data, setup_user, create_token
+
+
+def _count(stats, tier, result):
+    return stats.get('user_cache_requests_total{{result="{}",tier="{}"}}'.format(result, tier), 0)
+
+
+class TestLocalCache:
+    def test_least_recently_used_is_evicted(self):
+        cache = LocalCache(size=2, ttl=60)
+        cache.set(1, 'a')
+        cache.set(2, 'b')
+        cache.get(1)
+        cache.set(3, 'c')
+
+        assert cache.get(1) == 'a'
+        assert cache.get(2) is None
+        assert cache.get(3) == 'c'
+
+    def test_entries_expire(self):
+        cache = LocalCache(size=2, ttl=0.05)
+        cache.set(1, 'a')
+        time.sleep(0.1)
+        assert cache.get(1) is None
+
+
+class TestUserCache:
+    def test_get_user_through_tiers(self, session):
+        user = setup_user(session)
+        before = user_cache.get_stats()
+
+        cached_user = user_cache.get_user(user.id)
+        assert (cached_user.id, cached_user.name, cached_user.email) == (user.id, user.name, user.email)
+        user_cache.get_user(user.id)
+        user_cache.clear_local_cache()
+        user_cache.get_user(user.id)
+
+        after = user_cache.get_stats()
+        assert _count(after, 'local', 'hit') - _count(before, 'local', 'hit') == 1
+        assert _count(after, 'local', 'miss') - _count(before, 'local', 'miss') == 2
+        assert _count(after, 'redis', 'hit') - _count(before, 'redis', 'hit') == 1
+        assert _count(after, 'redis', 'miss') - _count(before, 'redis', 'miss') == 1
+
+    def test_unknown_user(self, session):
+        assert user_cache.get_user(123456) is None
+
+    def test_invalidate_on_update(self, session):
+        user = setup_user(session, name='Old Name')
+        assert user_cache.get_user(user.id).name == 'Old Name'
+
+        user.name = 'New Name'
+        session.commit()
+        assert user_cache.get_user(user.id).name == 'New Name'
+
+    def test_fill_started_before_invalidation_is_not_cached(self, session, cache, monkeypatch):
+        user = setup_user(session, name='Old Name')
+        from_model = user_cache.CachedUser.from_model
+
+        def commit_while_filling(account):
+            # Another request commits a change once the old row has been read
+            user_cache.invalidate(account.id)
+            return from_model(account)
+
+        monkeypatch.setattr(user_cache.CachedUser, 'from_model', commit_while_filling)
+        assert user_cache.get_user(user.id).name == 'Old Name'
+        assert cache.get(user_cache._user_key(user.id)) is None
+
+        # Later lookups are cached again
+        monkeypatch.undo()
+        user_cache.get_user(user.id)
+        assert cache.get(user_cache._user_key(user.id)) is not None
+
+    def test_authenticated_request_uses_cache(self, session):
+        user = setup_user(session)
+        token = create_token(user)
+        assert get_data('/api/rooms', token=token).status_code == 200
+
+        before = user_cache.get_stats()
+        assert get_data('/api/rooms', token=token).status_code == 200
+        after = user_cache.get_stats()
+        assert _count(after, 'local', 'hit') - _count(before, 'local', 'hit') == 1
@@ -0,0 +1,63 @@
+from main.libs import video_engine
+from main.models.room_participant import RoomParticipant
+from main.enums import VoteStatus, VideoStatus, ParticipantStatus
+from tests.helpers import setup_user, setup_room, setup_participant, setup_video, setup_vote
+
+
+class TestSetIsVoted:
+    def test_set_is_voted(self, session):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        setup_participant(session, room, user)
+
+        up_voted = setup_video(session, room, creator)
+        down_voted = setup_video(session, room, creator)
+        not_voted = setup_video(session, room, creator)
+        setup_vote(session, up_voted, user)
+        setup_vote(session, down_voted, user, status=VoteStatus.DOWNVOTE)
+
+        videos = video_engine.set_is_voted([up_voted, down_voted, not_voted], user.id)
+        assert [video.is_voted for video in videos] == [True, False, False]
+
+    def test_set_is_voted_with_empty_list(self, session):
+        user = setup_user(session)
+        assert video_engine.set_is_voted([], user.id) == []
+
+
+class TestVote:
+    def test_up_vote(self, session):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        video = setup_video(session, room, creator, total_vote=1)
+
+        assert video_engine.up_vote(video, user.id) == 2
+        assert video_engine.up_vote(video, user.id) is None
+        assert video_engine.up_vote(video, creator.id) is None
+
+    def test_down_vote_then_up_vote(self, session):
+        creator = setup_user(session)
+        user = setup_user(session)
+        room = setup_room(session, creator)
+        video = setup_video(session, room, creator, total_vote=1)
+
+        assert video_engine.down_vote(video, user.id) is None
+        assert video_engine.down_vote(video, creator.id) == 0
+        assert video_engine.down_vote(video, creator.id) is None
+        assert video_engine.up_vote(video, creator.id) == 1
+
+
+class TestSetOnlineUsersVideoStatus:
+    def test_only_online_users_are_updated(self, session):
+        creator = setup_user(session)
+        room = setup_room(session, creator)
+        setup_participant(session, room, setup_user(session))
+        offline = setup_participant(session, room, setup_user(session), status=ParticipantStatus.OUT)
+
+        assert video_engine.set_online_users_video_status(room.id, VideoStatus.PLAYING) == 2
+
+        statuses = {participant.user_id: participant.video_status
+                    for participant in RoomParticipant.query.filter_by(room_id=room.id)}
+        assert statuses.pop(offline.user_id) is None
+        assert set(statuses.values()) == {VideoStatus.PLAYING}
@@ -0,0 +1,73 @@
+from main.libs import video_engine, video_queue
+from main.enums import VideoStatus
+from tests.helpers import setup_user, setup_room, setup_video
+
+
+class TestVideoQueue:
+    def test_rebuild_on_cache_miss(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        setup_video(session, room, user, total_vote=1)
+        most_voted = setup_video(session, room, user, total_vote=3)
+        setup_video(session, room, user, status=VideoStatus.FINISHED, total_vote=5)
+
+        assert not video_queue.is_built(room.id)
+        assert video_queue.get_next_video_id(room.id) == most_voted.id
+        assert video_queue.is_built(room.id)
+
+    def test_get_next_video_follows_votes(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        first = setup_video(session, room, user, total_vote=2)
+        second = setup_video(session, room, user, total_vote=1)
+        assert video_engine.get_next_video(room.id).id == first.id
+
+        video_queue.increase_vote(room.id, second.id, 2)
+        assert video_engine.get_next_video(room.id).id == second.id
+
+    def test_get_next_video_skips_stale_entries(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        played = setup_video(session, room, user, total_vote=2)
+        waiting = setup_video(session, room, user, total_vote=1)
+        video_queue.rebuild(room.id)
+
+        played.status = VideoStatus.PLAYING
+        session.commit()
+
+        assert video_engine.get_next_video(room.id).id == waiting.id
+        assert video_queue.find_drift(room.id)['stale'] == []
+
+    def test_empty_queue(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        assert video_engine.get_next_video(room.id) is None
+
+    def test_find_drift(self, session):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user, total_vote=2)
+        missing = setup_video(session, room, user, total_vote=1)
+        video_queue.rebuild(room.id)
+
+        video_queue.remove(room.id, missing.id)
+        video_queue.increase_vote(room.id, video.id, 1)
+        video_queue.add(room.id, 9999, 1)
+
+        drift = video_queue.find_drift(room.id)
+        assert drift['missing'] == [missing.id]
+        assert drift['stale'] == [9999]
+        assert drift['mismatched'] == {video.id: {'db': 2, 'cache': 3}}
+
+    def test_votes_reach_the_queue_on_commit(self, session):
+        user = setup_user(session)
+        voter = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user, total_vote=1)
+        video_queue.rebuild(room.id)
+
+        video_engine.up_vote(video, voter.id)
+        assert video_queue.find_drift(room.id)['mismatched'] == {video.id: {'db': 2, 'cache': 1}}
+
+        session.commit()
+        assert video_queue.find_drift(room.id)['mismatched'] == {}
@@ -0,0 +1,64 @@
+import pytest
+
+from main.cfg import config
+from main.libs import pusher, vote_broadcast
+from main.enums import PusherEvent
+from tests.helpers import setup_user, setup_room, setup_video
+
+
+@pytest.fixture
+def hot(monkeypatch):
+    """Keep flushes pending as outside of tests, and make every room hot"""
+    scheduled = []
+    monkeypatch.setattr(config, 'VOTE_COALESCE_THRESHOLD', 0)
+    monkeypatch.setenv('FLASK_ENV', 'development')
+    monkeypatch.setattr(vote_broadcast._flush_vote_totals, 'apply_async',
+                        lambda args, countdown: scheduled.append(args))
+    return scheduled
+
+
+class TestVoteBroadcast:
+    def test_quiet_room_sends_each_vote(self, session, events):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        video = setup_video(session, room, user)
+
+        vote_broadcast.broadcast(room.id, PusherEvent.UP_VOTE, {'id': video.id, 'total_vote': 1})
+        vote_broadcast.broadcast(room.id, PusherEvent.DOWN_VOTE, {'id': video.id, 'total_vote': 0})
+        session.commit()
+
+        assert [event for event, _ in events] == [PusherEvent.UP_VOTE, PusherEvent.DOWN_VOTE]
+
+    def test_room_becomes_hot_past_threshold(self, session, events, monkeypatch):
+        monkeypatch.setattr(config, 'VOTE_COALESCE_THRESHOLD', 3)
+        assert not vote_broadcast.is_coalescing(1)
+
+        for _ in range(3):
+            pusher.trigger(1, 'event', {})
+        assert pusher.get_event_rate(1) == 3
+        assert vote_broadcast.is_coalescing(1)
+        assert not vote_broadcast.is_coalescing(2)
+
+    def test_hot_room_coalesces_votes(self, session, events, hot, monkeypatch):
+        user = setup_user(session)
+        room = setup_room(session, user)
+        first = setup_video(session, room, user, total_vote=5)
+        second = setup_video(session, room, user, total_vote=2)
+
+        for total_vote in range(1, 5):
+            vote_broadcast.broadcast(room.id, PusherEvent.UP_VOTE, {'id': first.id, 'total_vote': total_vote})
+        vote_broadcast.broadcast(room.id, PusherEvent.DOWN_VOTE, {'id': second.id, 'total_vote': 2})
+
+        assert events == []
+        assert hot == [(room.id,)]
+
+        monkeypatch.setenv('FLASK_ENV', 'test')
+        vote_broadcast.flush_vote_totals(room.id)
+        assert events == [(PusherEvent.VOTE_TOTALS, {'videos': [
+            {'id': first.id, 'total_vote': 5},
+            {'id': second.id, 'total_vote': 2},
+        ], 'seq': 1})]
+
+    def test_flush_without_changes_sends_nothing(self, session, events):
+        vote_broadcast.flush_vote_totals(1)
+        assert events == []
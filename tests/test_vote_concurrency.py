@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from main import db as _db
+from main.libs import video_engine
+from main.models.room import Room
+from main.models.room_participant import RoomParticipant
+from main.models.user import User
+from main.models.video import Video
+from main.models.vote import Vote
+from main.enums import VideoStatus, RoomStatus, ParticipantStatus, VoteStatus
+
+USER_COUNT = 1000
+WORKERS = 10
+FINGERPRINT = 'stresstest'
+
+
+@pytest.fixture
+def committed_session(request):
+    """
+    Votes are counted across concurrent transactions, so they need committed data
+    instead of the rolled back testing transaction
+    """
+    session = _db.create_scoped_session()
+    _db.session = session
+
+    def teardown():
+        session.remove()
+        room_ids = [room.id for room in Room.query.filter(Room.fingerprint == FINGERPRINT)]
+        video_ids = [video.id for video in Video.query.filter(Video.room_id.in_(room_ids))]
+        Vote.query.filter(Vote.video_id.in_(video_ids)).delete(synchronize_session=False)
+        Video.query.filter(Video.id.in_(video_ids)).delete(synchronize_session=False)
+        RoomParticipant.query.filter(RoomParticipant.room_id.in_(room_ids)).delete(synchronize_session=False)
+        Room.query.filter(Room.id.in_(room_ids)).delete(synchronize_session=False)
+        User.query.filter(User.email.like('voter_%@test.com')).delete(synchronize_session=False)
+        session.commit()
+        session.remove()
+
+    request.addfinalizer(teardown)
+    return session
+
+
+def _vote_concurrently(video, user_ids, vote_function):
+    def vote(user_id):
+        try:
+            total_vote = vote_function(video, user_id)
+            _db.session.commit()
+            return total_vote
+        finally:
+            _db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        return list(executor.map(vote, user_ids))
+
+
+class TestVoteConcurrency:
+    def test_concurrent_votes(self, committed_session):
+        users = [User(name='Voter {}'.format(i), email='voter_{}@test.com'.format(i), password='123456')
+                 for i in range(USER_COUNT)]
+        committed_session.add_all(users)
+        committed_session.commit()
+
+        room = Room(name='Stress Room', creator_id=users[0].id, fingerprint=FINGERPRINT, status=RoomStatus.ACTIVE)
+        committed_session.add(room)
+        committed_session.commit()
+        committed_session.add_all([RoomParticipant(user_id=user.id, room_id=room.id, status=ParticipantStatus.IN)
+                                  for user in users])
+        video = Video(room_id=room.id, creator_id=users[0].id, url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+                      total_vote=0, status=VideoStatus.VOTING)
+        committed_session.add(video)
+        committed_session.commit()
+        video_id = video.id
+        user_ids = [user.id for user in users]
+        committed_session.remove()
+
+        video = Video.query.get(video_id)
+        _db.session.expunge(video)
+
+        # Every user up-votes twice at the same time, only one of them counts
+        results = _vote_concurrently(video, user_ids * 2, video_engine.up_vote)
+        assert len([result for result in results if result is not None]) == USER_COUNT
+        assert Video.query.get(video_id).total_vote == USER_COUNT
+        assert Vote.query.filter_by(video_id=video_id, status=VoteStatus.UPVOTE).count() == USER_COUNT
+        _db.session.remove()
+
+        # Half of users down-vote twice at the same time
+        results = _vote_concurrently(video, user_ids[:USER_COUNT // 2] * 2, video_engine.down_vote)
+        assert len([result for result in results if result is not None]) == USER_COUNT // 2
+        assert Video.query.get(video_id).total_vote == USER_COUNT - USER_COUNT // 2
+        assert Vote.query.filter_by(video_id=video_id).count() == USER_COUNT
+        assert Vote.query.filter_by(video_id=video_id, status=VoteStatus.UPVOTE).count() == USER_COUNT // 2